@@ -1 +1,2 @@
 from .core import Itre
+from .follow import Follow
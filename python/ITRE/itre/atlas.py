@@ -1,5 +1,174 @@
 import numpy as np
-import numba as nb
+from .utils import jit, prange, numba_threads, signature, f8, i8, f8_1d, f8_2d, f8_3d, i8_1d, i8_2d, i8_3d
+from .celllist import CellList, _cell_index
+from .storage import flat_storage, grow
+from .hills import is_covariance, hill_widths, whiten
+from .schedule import evaluation_frames, window_sums, hill_windows
+from .instrument import active
+
+
+@jit(nopython=True,fastmath=True,
+     signatures=[signature(f8_2d,f8_1d,f8_2d,f8_1d,f8_2d,i8,i8,i8,i8,f8,f8_1d)])
+def _atlas_hill_nb(colvars,boundaries,sigmas,heights,thetas,ref_index,k,
+                   n_minima,dims,residual_w,component_weights):
+    """Contribution of the hill k to the ATLAS bias in the frame ref_index."""
+    renorm = 0.0
+    for minimum in range(n_minima+1):
+        renorm += thetas[k,minimum]*thetas[k,minimum]
+
+    bias = 0.0
+    for minimum in range(n_minima):
+        dist2 = 0.0
+        dist3 = 0.0
+        for d in range(minimum*dims,minimum*dims+dims):
+            comp = colvars[ref_index,d]-colvars[k,d]
+            comp -= np.rint(comp/boundaries[d])*boundaries[d]
+            comp /= sigmas[k,d]
+            dist2 += comp*comp
+
+            comp = colvars[ref_index,d]-colvars[k,d]*component_weights[d-minimum*dims]
+            comp -= np.rint(comp/boundaries[d])*boundaries[d]
+            comp /= sigmas[k,d]
+            dist3 += comp*comp
+        switch = thetas[ref_index,minimum]*thetas[k,minimum]
+        bias += (np.exp(-0.5*dist2)+residual_w*np.exp(-0.5*dist3))*switch
+    bias += thetas[ref_index,n_minima]*thetas[k,n_minima]
+
+    return bias*heights[k]/renorm
+
+
+def atlas_tables(sigmas,heights,thetas):
+    """
+    Precompute the factors of each hill that do not depend on the reference
+    frame: the activation functions weighted by height/|theta|^2 and the
+    inverse of the sigmas (for full covariances, the inverse Cholesky factors
+    of the covariance of the local CVs of each minimum, see hill_widths).
+
+    Returns
+    -------
+    hill_thetas : thetas[k]*heights[k]/thetas[k].dot(thetas[k])
+    inv_sigmas : 1/sigmas, or the inverse Cholesky factors
+    """
+    renorm = np.einsum('ij,ij->i',thetas,thetas)
+    hill_thetas = thetas*(heights/renorm)[:,np.newaxis]
+    if is_covariance(sigmas):
+        dims = sigmas.shape[1]//(thetas.shape[1]-1)
+        return np.ascontiguousarray(hill_thetas),hill_widths(sigmas,dims)
+    return np.ascontiguousarray(hill_thetas),np.ascontiguousarray(1/sigmas)
+
+
+@jit(nopython=True,fastmath=True,
+     signatures=[signature(f8_2d,f8_1d,f8_2d,f8_2d,f8_2d,i8,i8,i8,i8,f8)])
+def _atlas_hill_plain_nb(colvars,boundaries,inv_sigmas,hill_thetas,thetas,
+                         ref_index,k,n_minima,dims,residual_w):
+    """Contribution of the hill k to the ATLAS bias in the frame ref_index,
+       from the precomputed tables, without the reflected residual."""
+    bias = thetas[ref_index,n_minima]*hill_thetas[k,n_minima]
+    for minimum in range(n_minima):
+        switch = thetas[ref_index,minimum]*hill_thetas[k,minimum]
+        if switch == 0.0:
+            continue
+        dist2 = 0.0
+        for d in range(minimum*dims,minimum*dims+dims):
+            comp = colvars[ref_index,d]-colvars[k,d]
+            comp -= np.rint(comp/boundaries[d])*boundaries[d]
+            comp *= inv_sigmas[k,d]
+            dist2 += comp*comp
+        bias += np.exp(-0.5*dist2)*switch
+    return bias
+
+
+@jit(nopython=True,fastmath=True,
+     signatures=[signature(f8_2d,f8_1d,f8_2d,f8_2d,f8_2d,i8,i8,i8,i8,f8)])
+def _atlas_hill_residual_nb(colvars,boundaries,inv_sigmas,hill_thetas,thetas,
+                            ref_index,k,n_minima,dims,residual_w):
+    """As _atlas_hill_plain_nb, adding the Gaussian centered on the hill
+       reflected along the last local CV, weighted by residual_w."""
+    bias = thetas[ref_index,n_minima]*hill_thetas[k,n_minima]
+    for minimum in range(n_minima):
+        switch = thetas[ref_index,minimum]*hill_thetas[k,minimum]
+        if switch == 0.0:
+            continue
+        dist2 = 0.0
+        dist3 = 0.0
+        last = minimum*dims+dims-1
+        for d in range(minimum*dims,last):
+            comp = colvars[ref_index,d]-colvars[k,d]
+            comp -= np.rint(comp/boundaries[d])*boundaries[d]
+            comp *= inv_sigmas[k,d]
+            dist2 += comp*comp
+        # the other components are the same for the reflected hill
+        dist3 = dist2
+        comp = colvars[ref_index,last]-colvars[k,last]
+        comp -= np.rint(comp/boundaries[last])*boundaries[last]
+        comp *= inv_sigmas[k,last]
+        dist2 += comp*comp
+        comp = colvars[ref_index,last]+colvars[k,last]
+        comp -= np.rint(comp/boundaries[last])*boundaries[last]
+        comp *= inv_sigmas[k,last]
+        dist3 += comp*comp
+        bias += (np.exp(-0.5*dist2)+residual_w*np.exp(-0.5*dist3))*switch
+    return bias
+
+
+@jit(nopython=True,fastmath=True,
+     signatures=[signature(f8_2d,f8_1d,f8_3d,f8_2d,f8_2d,i8,i8,i8,i8,f8)])
+def _atlas_hill_full_nb(colvars,boundaries,factors,hill_thetas,thetas,
+                        ref_index,k,n_minima,dims,residual_w):
+    """As _atlas_hill_residual_nb, for hills with a full covariance: factors
+       holds the lower triangular inverse Cholesky factor of the covariance
+       of the local CVs of each minimum, stacked along the CVs."""
+    bias = thetas[ref_index,n_minima]*hill_thetas[k,n_minima]
+    for minimum in range(n_minima):
+        switch = thetas[ref_index,minimum]*hill_thetas[k,minimum]
+        if switch == 0.0:
+            continue
+        start = minimum*dims
+        last = start+dims-1
+        dist2 = 0.0
+        for a in range(dims):
+            dist = 0.0
+            for b in range(a+1):
+                comp = colvars[ref_index,start+b]-colvars[k,start+b]
+                comp -= np.rint(comp/boundaries[start+b])*boundaries[start+b]
+                dist += factors[k,start+a,b]*comp
+            dist2 += dist*dist
+        bias += np.exp(-0.5*dist2)*switch
+        if residual_w > 0.:
+            # the reflection only changes the last whitened component,
+            # since the factor is lower triangular
+            comp = colvars[ref_index,last]-colvars[k,last]
+            comp -= np.rint(comp/boundaries[last])*boundaries[last]
+            reflected = colvars[ref_index,last]+colvars[k,last]
+            reflected -= np.rint(reflected/boundaries[last])*boundaries[last]
+            dist = 0.0
+            for b in range(dims-1):
+                other = colvars[ref_index,start+b]-colvars[k,start+b]
+                other -= np.rint(other/boundaries[start+b])*boundaries[start+b]
+                dist += factors[k,last,b]*other
+            dist3 = dist2-(dist+factors[k,last,dims-1]*comp)**2 + \
+                    (dist+factors[k,last,dims-1]*reflected)**2
+            bias += residual_w*np.exp(-0.5*dist3)*switch
+    return bias
+
+
+@jit(nopython=True,fastmath=True,
+     signatures=[signature(f8_2d,f8_1d,f8_2d,f8_3d,f8_2d,f8_2d,i8,i8,i8,i8,f8)])
+def _atlas_hill_tables_nb(colvars,boundaries,inv_sigmas,factors,hill_thetas,thetas,
+                          ref_index,k,n_minima,dims,residual_w):
+    """Contribution of the hill k to the ATLAS bias in the frame ref_index,
+       from the precomputed tables: with the inverse Cholesky factors of the
+       covariances if factors is not empty, otherwise with the inverse
+       sigmas, evaluating the reflected residual only if residual_w > 0."""
+    if factors.shape[0] > 0:
+        return _atlas_hill_full_nb(colvars,boundaries,factors,hill_thetas,thetas,
+                                   ref_index,k,n_minima,dims,residual_w)
+    if residual_w > 0.:
+        return _atlas_hill_residual_nb(colvars,boundaries,inv_sigmas,hill_thetas,thetas,
+                                       ref_index,k,n_minima,dims,residual_w)
+    return _atlas_hill_plain_nb(colvars,boundaries,inv_sigmas,hill_thetas,thetas,
+                                ref_index,k,n_minima,dims,residual_w)
+
 
 class Atlas(object):
     """This class implement the calculation of the bias matrix for an ATLAS
@@ -15,18 +184,19 @@ class Atlas(object):
            ----------
            a : first point (either a float or a array of float)
            b : second point (either a float or a array of float)
-           c : covariance (either a float or a array of float)
+           c : covariance (either a float or a array of float), or the
+               inverse Cholesky factor of a full covariance (see hill_widths)
 
            Returns
            -------
            the value of the Gaussian overlap
         """
         comp = a-b-np.rint((a-b)/boundaries)*boundaries
-        dist = comp/c
+        dist = whiten(comp,c)
         dist2 = 0.5 * dist.dot(dist)
 
         comp = a-b*comp_weights-np.rint((a-b*comp_weights)/boundaries)*boundaries
-        dist = comp/c
+        dist = whiten(comp,c)
         dist3 = 0.5 * dist.dot(dist)
         return np.exp(-dist2)+np.exp(-dist3)*res_weights
 
@@ -45,7 +215,8 @@ class Atlas(object):
         wall : the values of the restraint acting in the simulation (NB this is only a STATIC wall!)
         thetas : the values of the activation function theta for ATLAS
         n_evals :  the number of evaluation to do (T in here)
-        stride : the stride between two different evaluation.
+        stride : the stride between two different evaluation, or the array
+                 of the evaluated frames (see schedule).
         residual_w : the weight for the reflected residual CV.
 
         Returns
@@ -58,10 +229,11 @@ class Atlas(object):
         component_weights = np.ones(dims)
         if residual_w > 0.:
             component_weights[-1] = -1
-
+        sigmas = hill_widths(sigmas,dims)
+        frames = evaluation_frames(n_evals,stride)
 
         for i in range(n_evals):
-            upper_index = int(i*stride)
+            upper_index = int(frames[i])
             sum_bias = 0.0
             for k in range(upper_index+1):
                 renorm = thetas[k].dot(thetas[k])
@@ -74,10 +246,10 @@ class Atlas(object):
             bias_matrix[i,i] = sum_bias
 
         for i in range(n_evals):
-            ref_index= int(i*stride)
+            ref_index= int(frames[i])
             for j in range(i,n_evals-1):
-                lower_index = int(j*stride)
-                upper_index = int((j+1)*stride)
+                lower_index = int(frames[j])
+                upper_index = int(frames[j+1])
                 sum_bias = 0.0
                 for t in range(lower_index,upper_index):
                     renorm = thetas[t].dot(thetas[t])
@@ -87,18 +259,187 @@ class Atlas(object):
                         sum_bias += self.kernel(colvars[ref_index,start:end],colvars[t,start:end],sigmas[t,start:end],boundaries[start:end],residual_w,component_weights)*heights[t]*switch/renorm
                     sum_bias += thetas[ref_index,-1]*thetas[t,-1]*heights[t]/renorm
                 bias_matrix[j+1,i] = bias_matrix[j,i] + sum_bias
+            active().progress(i+1,n_evals)
 
         if wall is not None:
             for i in range(n_evals):
-                upper_index = int(i*stride)
+                upper_index = int(frames[i])
                 for j in range(i,n_evals):
                     bias_matrix[j,i] += wall[upper_index]
 
         return bias_matrix/(1+residual_w)
 
+    def kernel_np(self,a,b,c,boundaries,res_weights,comp_weights):
+        """This function evaluate the gaussian between one point and an array
+           of points given the covariances, in a vectorized fashion.
+
+           Parameters
+           ----------
+           a : the reference point (an array of float)
+           b : the array of points (n_points,dims)
+           c : the covariances (n_points,dims), or the inverse Cholesky
+               factors of full covariances (n_points,dims,dims)
+
+           Returns
+           -------
+           an array with the value of the Gaussian overlap for each point
+        """
+        comp = a-b-np.rint((a-b)/boundaries)*boundaries
+        dist = whiten(comp,c)
+        dist2 = 0.5 * np.einsum('ij,ij->i',dist,dist)
+
+        comp = a-b*comp_weights-np.rint((a-b*comp_weights)/boundaries)*boundaries
+        dist = whiten(comp,c)
+        dist3 = 0.5 * np.einsum('ij,ij->i',dist,dist)
+        return np.exp(-dist2)+np.exp(-dist3)*res_weights
+
+    def hill_contributions_np(self,colvars,boundaries,sigmas,heights,thetas,ref_index,start,stop,residual_w,widths=None):
+        """
+        Evaluate the contribution of the hills deposited between start and
+        stop (excluded) to the bias in the frame ref_index, summing over all
+        the minima and the unassigned basin.
+
+        widths are the hill_widths of the hills between start and stop, if
+        they have already been computed (e.g. for many reference frames).
+
+        Returns
+        -------
+        an array with the contribution of each hill
+        """
+        n_minima = len(thetas[0])-1
+        dims = int(len(colvars[0])//n_minima)
+        n_hills = stop-start
+        if widths is None:
+            widths = hill_widths(sigmas[start:stop],dims)
+        full = is_covariance(widths)
+        hill_thetas = thetas[start:stop]
+        renorm = np.einsum('ij,ij->i',hill_thetas,hill_thetas)
+
+        # all the minima are processed at once, as a n_hills*n_minima*dims block
+        n_local = n_minima*dims
+        lengths = np.reshape(boundaries[:n_local],(n_minima,dims))
+        reference = np.reshape(colvars[ref_index,:n_local],(n_minima,dims))
+        centers = np.reshape(colvars[start:stop,:n_local],(n_hills,n_minima,dims))
+        widths = np.reshape(widths[:,:n_local],(n_hills,n_minima)+np.shape(widths)[2:]+(dims,))
+        comp = reference-centers
+        comp -= np.rint(comp/lengths)*lengths
+        dist = whiten(comp,widths)
+        dist2 = np.einsum('ijk,ijk->ij',dist[:,:,:-1],dist[:,:,:-1])
+        gaussians = np.exp(-0.5*(dist2+dist[:,:,-1]**2))
+
+        if residual_w > 0.:
+            # the reflected hills only differ along the last local CV, and
+            # so does the last component of the whitened distance
+            reflected = reference[:,-1]+centers[:,:,-1]
+            reflected -= np.rint(reflected/lengths[:,-1])*lengths[:,-1]
+            if full:
+                last = dist[:,:,-1]+widths[:,:,-1,-1]*(reflected-comp[:,:,-1])
+            else:
+                last = reflected/widths[:,:,-1]
+            gaussians += residual_w*np.exp(-0.5*(dist2+last**2))
+
+        contributions = np.einsum('ij,ij->i',gaussians,hill_thetas[:,:-1]*thetas[ref_index,:-1]) + \
+                        hill_thetas[:,-1]*thetas[ref_index,-1]
+
+        return contributions*heights[start:stop]/renorm
+
+    def calculate_block_sums(self,colvars,boundaries,sigmas,heights,thetas,ref_indices,first_block,last_block,stride,residual_w):
+        """
+        Evaluate in each reference frame the sum of the hills deposited in the
+        windows between two evaluations going from first_block to last_block
+        (excluded), the window b going from the b-th evaluated frame to the
+        next one.
+
+        Parameters
+        ----------
+        colvars : the values of the collective variables
+        boundaries : the values of the periodic boundary conditions as [min,max]*n_cvs
+        sigmas : the covariances use to evaluate the overlap kernel
+        heights : the heights of the hills deposited in the simulations
+        thetas : the values of the activation function theta for ATLAS
+        ref_indices : the frames in which the hills are evaluated
+        first_block : the first window of hills to sum
+        last_block : the last window of hills to sum (excluded)
+        stride : the stride between two different evaluation, or the array
+                 of the evaluated frames (see schedule).
+        residual_w : the weight for the reflected residual CV.
+
+        Returns
+        -------
+        block_sums : a len(ref_indices)*(last_block-first_block) float matrix
+        """
+        frames = evaluation_frames(last_block+1,stride)[first_block:]
+        start = int(frames[0])
+        stop = int(frames[-1])
+        block_sums = np.zeros((len(ref_indices),last_block-first_block))
+        n_minima = len(thetas[0])-1
+        widths = hill_widths(sigmas[start:stop],int(len(colvars[0])//n_minima))
+
+        for n,ref_index in enumerate(ref_indices):
+            row = self.hill_contributions_np(colvars,boundaries,sigmas,heights,
+                                             thetas,ref_index,start,stop,residual_w,
+                                             widths)
+            block_sums[n] = window_sums(row,frames)
+        active().count(len(ref_indices)*(stop-start))
+
+        return block_sums
+
+    def extend_bias_matrix(self,bias_matrix,colvars,boundaries,sigmas,heights,wall,thetas,n_evals,stride,residual_w):
+        """
+        Extend a bias matrix previously computed on the first frames of
+        colvars to n_evals evaluations. Only the new rows of the old columns
+        (i.e. the hills deposited after the last evaluation) and the new
+        columns are evaluated, so that the cost scale as (n_evals-n_old)*T.
+
+        Parameters
+        ----------
+        bias_matrix : the n_old*n_old bias matrix to extend (a PackedMatrix
+                      is extended in place)
+        colvars : the values of the collective variables
+        boundaries : the values of the periodic boundary conditions as [min,max]*n_cvs
+        sigmas : the covariances use to evaluate the overlap kernel
+        heights : the heights of the hills deposited in the simulations
+        wall : the values of the restraint acting in the simulation (NB this is only a STATIC wall!)
+        thetas : the values of the activation function theta for ATLAS
+        n_evals :  the number of evaluation to do (T in here)
+        stride : the stride between two different evaluation, or the array
+                 of the evaluated frames (see schedule).
+        residual_w : the weight for the reflected residual CV.
+
+        Returns
+        -------
+        bias_matrix : a T*T float matrix containing the lagged potential matrix
+        """
+        n_old = len(bias_matrix)
+        last_row = np.array(bias_matrix[n_old-1,:n_old],dtype=np.float64)
+        extended = grow(bias_matrix,n_evals)
+        frames = evaluation_frames(n_evals,stride)
+
+        lagged = self.calculate_block_sums(colvars,boundaries,sigmas,heights,thetas,
+                                           frames[:n_old],
+                                           n_old-1,n_evals-1,frames,residual_w)
+        extended[n_old:,:n_old] = last_row + \
+                                  np.cumsum(lagged,axis=1).T/(1+residual_w)
+
+        blocks = self.calculate_block_sums(colvars,boundaries,sigmas,heights,thetas,
+                                           frames[n_old:],
+                                           0,n_evals-1,frames,residual_w)
+        cumulative = np.zeros(n_evals)
+        for n,i in enumerate(range(n_old,n_evals)):
+            ref_index = int(frames[i])
+            self_hill = self.hill_contributions_np(colvars,boundaries,sigmas,heights,
+                                                   thetas,ref_index,ref_index,
+                                                   ref_index+1,residual_w)[0]
+            if wall is not None:
+                self_hill += wall[ref_index]
+            np.cumsum(blocks[n],out=cumulative[1:])
+            extended[i:,i] = (cumulative[i:] + self_hill)/(1+residual_w)
+
+        return extended
+
     @staticmethod
-    @nb.jit
-    def calculate_bias_matrix_nb(colvars,boundaries,sigmas,heights,wall,thetas,n_evals,stride,dims,residual_w):
+    @jit(signatures=[signature(f8_2d,f8_1d,f8_2d,f8_1d,f8_1d,f8_2d,i8,i8_1d,i8,f8)])
+    def _bias_matrix_nb(colvars,boundaries,sigmas,heights,wall,thetas,n_evals,frames,dims,residual_w):
         n_minima = len(thetas[0])-1
         dims = int(len(colvars[0])//n_minima)
         bias_matrix = np.zeros((n_evals,n_evals))
@@ -108,7 +449,7 @@ class Atlas(object):
             component_weights[-1] = -1
 
         for i in range(n_evals):
-            upper_index = int(i*stride)
+            upper_index = frames[i]
             sum_bias = 0.0
             for k in range(upper_index+1):
                 renorm = thetas[k].dot(thetas[k])
@@ -131,10 +472,10 @@ class Atlas(object):
             bias_matrix[i,i] = sum_bias
 
         for i in range(n_evals):
-            ref_index= int(i*stride)
+            ref_index= frames[i]
             for j in range(i,n_evals-1):
-                lower_index = int(j*stride)
-                upper_index = int((j+1)*stride)
+                lower_index = frames[j]
+                upper_index = frames[j+1]
                 sum_bias = 0.0
                 for t in range(lower_index,upper_index):
                     renorm = thetas[t].dot(thetas[t])
@@ -147,7 +488,7 @@ class Atlas(object):
                         dist = corrected/sigmas[t,start:end]
                         dist2 = 0.5 * dist.dot(dist)
 
-                        comp = colvars[upper_index,start:end]-colvars[t,start:end]*component_weights
+                        comp = colvars[ref_index,start:end]-colvars[t,start:end]*component_weights
                         corrected = comp-np.rint(comp/boundaries[start:end])*boundaries[start:end]
                         dist = corrected/sigmas[t,start:end]
                         dist3 = 0.5 * dist.dot(dist)
@@ -159,8 +500,246 @@ class Atlas(object):
 
         if wall is not None:
             for i in range(n_evals):
-                upper_index = int(i*stride)
+                upper_index = frames[i]
                 for j in range(i,n_evals):
                     bias_matrix[j,i] += wall[upper_index]
 
         return bias_matrix/(1+residual_w)
+
+    @staticmethod
+    def calculate_bias_matrix_nb(colvars,boundaries,sigmas,heights,wall,thetas,n_evals,stride,dims,residual_w):
+        """
+        Evaluate the bias matrix with numba, with the same recursive formula
+        as calculate_bias_matrix. stride is the stride between two different
+        evaluations, or the array of the evaluated frames.
+        """
+        return Atlas._bias_matrix_nb(colvars,boundaries,sigmas,heights,wall,thetas,int(n_evals),
+                                     evaluation_frames(n_evals,stride),int(dims),float(residual_w))
+
+    @staticmethod
+    @jit(nopython=True,parallel=True,fastmath=True,
+         signatures=[signature(f8_2d,f8_1d,f8_2d,f8_3d,f8_2d,f8_1d,f8_2d,i8,i8_1d,f8,f8_1d,i8_1d)])
+    def _bias_matrix_parallel(colvars,boundaries,inv_sigmas,factors,hill_thetas,wall,thetas,
+                              n_evals,frames,residual_w,bias_matrix,row_offsets):
+        n_minima = thetas.shape[1]-1
+        dims = colvars.shape[1]//n_minima
+
+        for i in prange(n_evals):
+            ref_index = frames[i]
+            sum_bias = 0.0
+            for k in range(ref_index+1):
+                sum_bias += _atlas_hill_tables_nb(colvars,boundaries,inv_sigmas,factors,hill_thetas,
+                                                  thetas,ref_index,k,n_minima,dims,residual_w)
+            bias_matrix[row_offsets[i]+i] = (sum_bias + wall[ref_index])/(1+residual_w)
+
+            for j in range(i,n_evals-1):
+                for t in range(frames[j],frames[j+1]):
+                    sum_bias += _atlas_hill_tables_nb(colvars,boundaries,inv_sigmas,factors,hill_thetas,
+                                                      thetas,ref_index,t,n_minima,dims,residual_w)
+                bias_matrix[row_offsets[j+1]+i] = (sum_bias + wall[ref_index])/(1+residual_w)
+
+    def calculate_bias_matrix_parallel(self,colvars,boundaries,sigmas,heights,wall,thetas,n_evals,stride,residual_w,n_threads=None,out=None):
+        """
+        Evaluate the bias matrix with numba, distributing the reference frames
+        (i.e. the columns of the matrix) over n_threads threads. The kernel is
+        compiled in nopython mode with fastmath, so that it fails loudly
+        rather than falling back to the object mode.
+
+        The factors of each hill that do not depend on the reference frame
+        (height/|theta|^2 and 1/sigma) are computed once with atlas_tables,
+        the minima where either theta vanishes are skipped, and without
+        residual a kernel that does not evaluate the reflected Gaussians
+        is used. Hills with a full covariance (a n_cvs*n_cvs matrix per hill)
+        use the inverse Cholesky factors of the covariance of the local CVs
+        of each minimum.
+
+        Parameters
+        ----------
+        colvars : the values of the collective variables
+        boundaries : the values of the periodic boundary conditions as [min,max]*n_cvs
+        sigmas : the covariances use to evaluate the overlap kernel
+        heights : the heights of the hills deposited in the simulations
+        wall : the values of the restraint acting in the simulation (NB this is only a STATIC wall!)
+        thetas : the values of the activation function theta for ATLAS
+        n_evals :  the number of evaluation to do (T in here)
+        stride : the stride between two different evaluation, or the array
+                 of the evaluated frames (see schedule).
+        residual_w : the weight for the reflected residual CV.
+        n_threads : the number of threads to use. If None, all the cores
+                    available are used.
+        out : the T*T matrix (dense or PackedMatrix) in which the bias is
+              written. If None, a dense float64 matrix is allocated.
+
+        Returns
+        -------
+        bias_matrix : a T*T float matrix containing the lagged potential matrix
+        """
+        colvars = np.ascontiguousarray(colvars,dtype=np.float64).reshape(len(colvars),-1)
+        if not is_covariance(sigmas):
+            sigmas = np.asarray(sigmas,dtype=np.float64).reshape(len(sigmas),-1)
+        thetas = np.ascontiguousarray(thetas,dtype=np.float64).reshape(len(thetas),-1)
+        boundaries = np.ascontiguousarray(boundaries,dtype=np.float64).reshape(-1)
+        if wall is None:
+            wall = np.zeros(len(colvars))
+
+        hill_thetas,inv_sigmas = atlas_tables(sigmas,np.asarray(heights,dtype=np.float64),
+                                              thetas)
+        # the kernel uses the factors of the covariances if they are not empty
+        factors = np.zeros((0,0,0))
+        if is_covariance(sigmas):
+            factors,inv_sigmas = inv_sigmas,np.zeros((0,0))
+
+        bias_matrix,data,row_offsets = flat_storage(out,int(n_evals))
+        with numba_threads(n_threads):
+            self._bias_matrix_parallel(colvars,boundaries,inv_sigmas,factors,hill_thetas,
+                                       np.ascontiguousarray(wall,dtype=np.float64),
+                                       thetas,int(n_evals),evaluation_frames(n_evals,stride),
+                                       float(residual_w),data,row_offsets)
+        return bias_matrix
+
+    @staticmethod
+    @jit(nopython=True,parallel=True,fastmath=True,
+         signatures=[signature(f8_2d,f8_1d,f8_2d,f8_1d,f8_1d,f8_2d,i8,i8_1d,i8_1d,f8,f8,f8_1d,f8_1d,
+                               f8_2d,i8_2d,i8_3d,i8_1d,i8_2d,i8_2d,f8_1d,i8_1d)])
+    def _bias_matrix_cutoff(colvars,boundaries,sigmas,heights,wall,thetas,n_evals,frames,windows,residual_w,
+                            cutoff,renorm,unassigned,mins,n_cells,offsets,n_offsets,order,cell_start,bias_matrix,row_offsets):
+        n_minima = thetas.shape[1]-1
+        dims = colvars.shape[1]//n_minima
+        n_hills = frames[n_evals-1]
+        component_weights = np.ones(dims)
+        if residual_w > 0.:
+            component_weights[-1] = -1
+        n_images = 1
+        if residual_w > 0.:
+            n_images = 2
+        cutoff2 = cutoff*cutoff
+
+        for i in prange(n_evals):
+            ref_index = frames[i]
+            blocks = np.zeros(n_evals)
+            weights = np.ones(dims)
+            for minimum in range(n_minima):
+                start = minimum*dims
+                for image in range(n_images):
+                    # the second image is the reflected residual, for which
+                    # the hills close to the reflected reference are needed
+                    prefactor = 1.0
+                    if image == 1:
+                        weights = component_weights
+                        prefactor = residual_w
+                    else:
+                        weights = np.ones(dims)
+                    for o in range(n_offsets[minimum]):
+                        cell = _cell_index(colvars[ref_index,start:start+dims],weights,
+                                           mins[minimum],boundaries[start:start+dims],
+                                           n_cells[minimum],offsets[minimum,o])
+                        for n in range(cell_start[minimum,cell],cell_start[minimum,cell+1]):
+                            k = order[minimum,n]
+                            if k >= n_hills:
+                                break
+                            dist2 = 0.0
+                            for d in range(dims):
+                                comp = colvars[ref_index,start+d]-colvars[k,start+d]*weights[d]
+                                comp -= np.rint(comp/boundaries[start+d])*boundaries[start+d]
+                                comp /= sigmas[k,start+d]
+                                dist2 += comp*comp
+                            if dist2 < cutoff2:
+                                switch = thetas[ref_index,minimum]*thetas[k,minimum]
+                                blocks[windows[k]] += prefactor*np.exp(-0.5*dist2)*\
+                                                       switch*heights[k]/renorm[k]
+
+            self_hill = _atlas_hill_nb(colvars,boundaries,sigmas,heights,thetas,
+                                       ref_index,ref_index,n_minima,dims,residual_w,
+                                       component_weights)
+            sum_bias = 0.0
+            for j in range(n_evals):
+                sum_bias += blocks[j]
+                if j >= i:
+                    bias_matrix[row_offsets[j]+i] = (sum_bias + thetas[ref_index,n_minima]*unassigned[j] + \
+                                        self_hill + wall[ref_index])/(1+residual_w)
+
+    def calculate_bias_matrix_cutoff(self,colvars,boundaries,sigmas,heights,wall,thetas,n_evals,stride,residual_w,cutoff,mins,n_threads=None,out=None):
+        """
+        Evaluate the bias matrix with numba, neglecting the Gaussians (and
+        their reflected residuals) that are farther than cutoff (in units of
+        sigma) from the reference frame. The hills are stored in a periodic
+        cell list for each minimum, built on its local CVs, so that only the
+        hills in the cells neighbouring the reference frame are visited. The
+        contribution of the unassigned basin, which does not depend on the
+        CVs, is accumulated exactly. The error on each element is bounded by
+        truncation_error_bound.
+
+        Parameters
+        ----------
+        colvars : the values of the collective variables
+        boundaries : the periodicity of each CV
+        sigmas : the covariances use to evaluate the overlap kernel
+        heights : the heights of the hills deposited in the simulations
+        wall : the values of the restraint acting in the simulation (NB this is only a STATIC wall!)
+        thetas : the values of the activation function theta for ATLAS
+        n_evals :  the number of evaluation to do (T in here)
+        stride : the stride between two different evaluation, or the array
+                 of the evaluated frames (see schedule).
+        residual_w : the weight for the reflected residual CV.
+        cutoff : the truncation radius of the Gaussians, in units of sigma
+        mins : the lower boundary of each CV
+        n_threads : the number of threads to use. If None, all the cores
+                    available are used.
+        out : the T*T matrix (dense or PackedMatrix) in which the bias is
+              written. If None, a dense float64 matrix is allocated.
+
+        Returns
+        -------
+        bias_matrix : a T*T float matrix containing the lagged potential matrix
+        """
+        colvars = np.ascontiguousarray(colvars,dtype=np.float64).reshape(len(colvars),-1)
+        sigmas = np.ascontiguousarray(sigmas,dtype=np.float64).reshape(len(sigmas),-1)
+        thetas = np.ascontiguousarray(thetas,dtype=np.float64).reshape(len(thetas),-1)
+        heights = np.ascontiguousarray(heights,dtype=np.float64)
+        boundaries = np.ascontiguousarray(boundaries,dtype=np.float64).reshape(-1)
+        mins = np.ascontiguousarray(mins,dtype=np.float64).reshape(-1)
+        if wall is None:
+            wall = np.zeros(len(colvars))
+        n_minima = thetas.shape[1]-1
+        dims = int(colvars.shape[1]//n_minima)
+        frames = evaluation_frames(n_evals,stride)
+        n_hills = int(frames[-1])
+
+        renorm = np.einsum('ij,ij->i',thetas,thetas)
+        unassigned = np.zeros(n_evals)
+        np.cumsum(window_sums(thetas[:n_hills,-1]*heights[:n_hills]/renorm[:n_hills],frames),
+                  out=unassigned[1:])
+
+        cell_lists = []
+        for minimum in range(n_minima):
+            start = minimum*dims ; end = minimum*dims+dims
+            cell_lists.append(CellList(colvars[:n_hills,start:end],mins[start:end],
+                                       boundaries[start:end],
+                                       cutoff*np.amax(sigmas[:max(n_hills,1),start:end],axis=0)))
+
+        mins,lengths,n_cells,offsets,n_offsets,order,cell_start = CellList.stack(cell_lists)
+
+        bias_matrix,data,row_offsets = flat_storage(out,int(n_evals))
+        with numba_threads(n_threads):
+            self._bias_matrix_cutoff(colvars,boundaries,sigmas,heights,
+                                     np.ascontiguousarray(wall,dtype=np.float64),
+                                     thetas,int(n_evals),frames,hill_windows(frames,n_hills),
+                                     float(residual_w),float(cutoff),
+                                     renorm,unassigned,mins,n_cells,
+                                     offsets,n_offsets,order,cell_start,data,row_offsets)
+        return bias_matrix
+
+    def truncation_error_bound(self,heights,thetas,n_evals,stride,residual_w,cutoff):
+        """
+        Upper bound of the error made on any element of the bias matrix when
+        the Gaussians farther than cutoff (in units of sigma) are neglected,
+        i.e. exp(-cutoff**2/2) times the largest weight that all the hills
+        can have in a reference frame.
+        """
+        frames = evaluation_frames(n_evals,stride)
+        n_hills = int(frames[-1])
+        thetas = np.asarray(thetas).reshape(len(thetas),-1)
+        renorm = np.einsum('ij,ij->i',thetas[:n_hills],thetas[:n_hills])
+        max_switch = np.amax(np.abs(thetas[frames,:-1]),axis=0)
+        weights = np.abs(thetas[:n_hills,:-1]).dot(max_switch)*np.abs(heights[:n_hills])/renorm
+        return np.exp(-0.5*cutoff**2)*np.sum(weights)
@@ -0,0 +1,171 @@
+import os
+import hashlib
+import logging
+import numpy as np
+from .storage import PackedMatrix
+from .utils import printitre, atomic_file
+
+
+def hash_inputs(arrays,parameters,tag):
+    """
+    Hash the inputs of a calculation.
+
+    Parameters
+    ----------
+    arrays : a dictionary with the arrays the result depends on (None
+             values are allowed)
+    parameters : a dictionary with the other parameters, which are hashed
+                 through their repr
+    tag : a string identifying the kind (and version) of the result
+
+    Returns
+    -------
+    the hexadecimal digest of the inputs
+    """
+    digest = hashlib.sha256()
+    digest.update(tag.encode())
+    for name in sorted(arrays):
+        digest.update(name.encode())
+        if arrays[name] is None:
+            digest.update(b'None')
+            continue
+        array = np.ascontiguousarray(arrays[name])
+        digest.update('{}{}'.format(array.dtype.str,array.shape).encode())
+        digest.update(array.data)
+    for name in sorted(parameters):
+        digest.update('{}={!r}'.format(name,parameters[name]).encode())
+    return digest.hexdigest()
+
+
+class BiasMatrixCache(object):
+    """This class stores the bias matrices in a folder, each named after a
+       hash of everything the matrix depends on (the trajectory, the
+       boundaries, the stride, the engine and its parameters, but not kT or
+       the iterations), so that a calculation repeated on the same data
+       reloads the matrix instead of evaluating it again. The elements of a
+       matrix are saved in a raw npy file, so that a packed matrix can be
+       memory mapped and copied block by block, and the other scalars in a
+       small npz file next to it.
+
+       When the size of the folder exceeds max_size, the least recently used
+       matrices are removed. A matrix larger than max_size is not stored."""
+    # bump when the definition or the layout of the stored matrix changes
+    version = 2
+
+    def __init__(self,directory,max_size=None,block_size=2**22):
+        """
+        Parameters
+        ----------
+        directory : the folder containing the cached matrices
+        max_size : the maximum size of the cache in bytes (no limit if None)
+        block_size : the number of elements of a packed matrix copied at once
+                     when it is loaded
+        """
+        super(BiasMatrixCache, self).__init__()
+        self.directory = directory
+        self.max_size = max_size
+        self.block_size = block_size
+        os.makedirs(self.directory,exist_ok=True)
+
+    def key(self,arrays,parameters):
+        """
+        Hash the inputs of a bias matrix (see hash_inputs).
+
+        Returns
+        -------
+        the hexadecimal digest identifying the matrix
+        """
+        return hash_inputs(arrays,parameters,'itre-bias-matrix-{}'.format(self.version))
+
+    def __matrix_filename(self,key):
+        return os.path.join(self.directory,'{}.npy'.format(key))
+
+    def __info_filename(self,key):
+        return os.path.join(self.directory,'{}.npz'.format(key))
+
+    def load(self,key,matrix_file=None):
+        """
+        Load the matrix stored under key.
+
+        Parameters
+        ----------
+        key : the hash of the matrix (see key)
+        matrix_file : for a packed matrix, the file on which it is memory
+                      mapped
+
+        Returns
+        -------
+        matrix : the bias matrix, or None if it is not in the cache
+        info : a dictionary with the scalars stored with the matrix
+        """
+        filename = self.__matrix_filename(key)
+        # the info is written last, so the matrix is complete when it exists
+        if not os.path.exists(self.__info_filename(key)) or not os.path.exists(filename):
+            return None,{}
+
+        with np.load(self.__info_filename(key)) as stored:
+            info = {name:stored[name][()] for name in stored.files}
+        if info.pop('packed'):
+            # copy block by block from the memory mapped file, so that the
+            # packed matrix is never held twice in memory
+            data = np.load(filename,mmap_mode='r')
+            matrix = PackedMatrix(int(info.pop('n_evals')),data.dtype,matrix_file)
+            for start in range(0,len(data),self.block_size):
+                matrix.data[start:start+self.block_size] = data[start:start+self.block_size]
+            del data
+        else:
+            matrix = np.load(filename)
+        # the modification time tracks the last use of the matrix
+        os.utime(filename)
+        printitre("Bias matrix loaded from the cache {}".format(filename))
+        return matrix,info
+
+    def store(self,key,matrix,**info):
+        """
+        Store a dense or packed matrix under key, together with some
+        scalars (e.g. the error estimates of the engine), then evict the
+        least recently used matrices if the cache is too large. A matrix
+        larger than max_size is not stored.
+        """
+        if isinstance(matrix,PackedMatrix):
+            data = matrix.data
+            info.update({'packed':True,'n_evals':matrix.n_evals})
+        else:
+            data = np.asarray(matrix)
+            info['packed'] = False
+        if self.max_size is not None and data.nbytes > self.max_size:
+            printitre("WARNING: the bias matrix ({:.3g} GB) is larger than the cache, \
+it is not stored".format(data.nbytes/1e9),logging.WARNING)
+            return
+
+        with atomic_file(self.__matrix_filename(key)) as file_out:
+            np.save(file_out,data)
+        with atomic_file(self.__info_filename(key)) as file_out:
+            np.savez(file_out,**info)
+        self.evict(keep=key)
+
+    def evict(self,keep=None):
+        """
+        Remove the least recently used matrices beyond max_size, except
+        the one stored under keep.
+        """
+        if self.max_size is None:
+            return
+        entries = {}
+        for name in os.listdir(self.directory):
+            key,extension = os.path.splitext(name)
+            if extension in ['.npy','.npz'] and not name.startswith('.'):
+                stat = os.stat(os.path.join(self.directory,name))
+                mtime,size = entries.get(key,(0.0,0))
+                entries[key] = (max(mtime,stat.st_mtime),size+stat.st_size)
+        total = entries[keep][1] if keep in entries else 0
+        entries = sorted([(mtime,size,key) for key,(mtime,size) in entries.items()
+                          if key != keep],reverse=True)
+
+        for mtime,size,key in entries:
+            total += size
+            if total > self.max_size:
+                for filename in [self.__matrix_filename(key),self.__info_filename(key)]:
+                    if os.path.exists(filename):
+                        os.remove(filename)
+                printitre("Removed {} from the cache".format(key))
@@ -0,0 +1,96 @@
+import itertools
+import numpy as np
+from .utils import jit, signature, f8_1d, i8_1d
+
+
+@jit(nopython=True,fastmath=True,signatures=[signature(f8_1d,f8_1d,f8_1d,f8_1d,i8_1d,i8_1d)])
+def _cell_index(point,weights,mins,lengths,n_cells,offset):
+    """Flat index of the cell containing point*weights, shifted by offset
+       cells along each dimension, with periodic wrapping."""
+    flat = 0
+    for d in range(len(point)):
+        x = point[d]*weights[d]-mins[d]
+        x -= np.floor(x/lengths[d])*lengths[d]
+        cell = int(x/lengths[d]*n_cells[d])
+        if cell >= n_cells[d]:
+            cell = n_cells[d]-1
+        cell = (cell+offset[d]) % n_cells[d]
+        flat = flat*n_cells[d]+cell
+    return flat
+
+
+class CellList(object):
+    """This class implement a cell list over a set of points (e.g. the centers
+       of the hills) in a periodic domain. The cells are at least cell_sizes
+       wide, so that all the points closer than cell_sizes to a given point
+       are found in the cells neighbouring the one containing it. Within a
+       cell the points are sorted by index, i.e. by deposition time."""
+    def __init__(self,points,mins,lengths,cell_sizes,max_cells=None):
+        """
+        Parameters
+        ----------
+        points : the n_points*dims array of points
+        mins : the lower boundaries of the domain
+        lengths : the periodicity of the domain along each dimension
+        cell_sizes : the minimum size of a cell along each dimension
+        max_cells : the maximum number of cells, beyond which the cells are
+                    made larger (8*n_points by default)
+        """
+        super(CellList, self).__init__()
+        points = np.asarray(points,dtype=np.float64).reshape(len(points),-1)
+        self.mins = np.ascontiguousarray(mins,dtype=np.float64).reshape(-1)
+        self.lengths = np.ascontiguousarray(lengths,dtype=np.float64).reshape(-1)
+        cell_sizes = np.asarray(cell_sizes,dtype=np.float64).reshape(-1)
+        if max_cells is None:
+            max_cells = max(1024,8*len(points))
+
+        n_cells = np.maximum(1,np.floor(self.lengths/cell_sizes)).astype(np.int64)
+        while np.prod(n_cells) > max_cells:
+            n_cells = np.maximum(1,n_cells//2)
+        # with less than three cells, the neighbouring cells wrap on
+        # each other, so a single cell is used
+        n_cells[n_cells<3] = 1
+        self.n_cells = n_cells
+
+        per_dim = [[0] if n == 1 else [-1,0,1] for n in n_cells]
+        self.offsets = np.array(list(itertools.product(*per_dim)),dtype=np.int64)
+
+        reduced = (points-self.mins)
+        reduced -= np.floor(reduced/self.lengths)*self.lengths
+        cells = np.minimum((reduced/self.lengths*n_cells).astype(np.int64),n_cells-1)
+        flat = np.ravel_multi_index(cells.T,n_cells) if len(points) > 0 \
+               else np.zeros(0,dtype=np.int64)
+        self.order = np.argsort(flat,kind='stable').astype(np.int64)
+        self.cell_start = np.searchsorted(flat[self.order],
+                                          np.arange(np.prod(n_cells)+1)).astype(np.int64)
+
+    @staticmethod
+    def stack(cell_lists):
+        """
+        Stack several cell lists built on the same number of points (e.g. one
+        for each minimum of an ATLAS calculation) in padded arrays that can
+        be passed to numba.
+
+        Returns
+        -------
+        mins, lengths, n_cells, offsets, n_offsets, order, cell_start
+        """
+        n_lists = len(cell_lists)
+        dims = len(cell_lists[0].mins)
+        max_offsets = max([len(el.offsets) for el in cell_lists])
+        max_cells = max([len(el.cell_start) for el in cell_lists])
+
+        offsets = np.zeros((n_lists,max_offsets,dims),dtype=np.int64)
+        n_offsets = np.zeros(n_lists,dtype=np.int64)
+        cell_start = np.zeros((n_lists,max_cells),dtype=np.int64)
+        for n,el in enumerate(cell_lists):
+            offsets[n,:len(el.offsets)] = el.offsets
+            n_offsets[n] = len(el.offsets)
+            cell_start[n,:len(el.cell_start)] = el.cell_start
+
+        return np.array([el.mins for el in cell_lists]), \
+               np.array([el.lengths for el in cell_lists]), \
+               np.array([el.n_cells for el in cell_lists]), \
+               offsets,n_offsets, \
+               np.array([el.order for el in cell_lists]), \
+               cell_start
@@ -0,0 +1,78 @@
+"""
+Command line interface of ITRE, run as
+
+python -m itre pyitre.json --engine parallel --threads 4 --output-dir results
+
+The json file contains the directives described by Itre.print_dict (run
+python -m itre --list-directives to print them), and the options given on the
+command line override the corresponding directives. The c(t), the
+instantaneous bias and the weights of the evaluated frames are written in
+the output folder, as text .dat files (as written by Follow and read by the
+examples) or as binary .npy files.
+"""
+
+import os
+import sys
+import json
+import argparse as ap
+import numpy as np
+from .core import Itre
+from .utils import printitre
+
+
+def build_parser():
+    parser = ap.ArgumentParser(prog='python -m itre',
+                               description='Reweight a Metadynamics or ATLAS simulation with ITRE')
+    parser.add_argument('directives',nargs='?',default='pyitre.json',help='the json file with the directives (pyitre.json by default)')
+    parser.add_argument('--engine','-e',help='the engine that evaluates the bias matrix')
+    parser.add_argument('--threads','-n',type=int,help='the threads (or processes) of the parallel engines')
+    parser.add_argument('--stride','-s',type=int,help='the stride between two evaluations of c(t)')
+    parser.add_argument('--output-dir','-o',default='.',help='the folder in which the results are written')
+    parser.add_argument('--cache-dir','-c',help='the folder in which the bias matrices are cached')
+    parser.add_argument('--format','-f',choices=['txt','npy'],default='txt',help='write the results as text or as binary .npy files')
+    parser.add_argument('--list-directives',dest='print_directives',action='store_true',help='print the directives that can be set in the json file and exit')
+    return parser
+
+
+def save(output_dir,name,array,output_format):
+    """Write an array in output_dir as name.dat (text) or name.npy."""
+    if output_format == 'npy':
+        filename = os.path.join(output_dir,'{}.npy'.format(name))
+        np.save(filename,array)
+    else:
+        filename = os.path.join(output_dir,'{}.dat'.format(name))
+        np.savetxt(filename,array)
+    return filename
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.print_directives:
+        Itre().print_dict()
+        return 0
+
+    with open(args.directives,'r') as json_file:
+        directives = json.load(json_file)
+    for key,value in [('engine',args.engine),('n_threads',args.threads),
+                      ('stride',args.stride),('cache_dir',args.cache_dir)]:
+        if value is not None:
+            directives[key] = value
+
+    it = Itre()
+    it.from_dict(directives)
+    it.calculate_c_t()
+
+    ct = np.asarray(it.ct[-1],dtype=np.float64)
+    instantaneous_bias = np.asarray(it.instantaneous_bias,dtype=np.float64)
+    results = [('c_t',ct),('instantaneous_bias',instantaneous_bias)]
+    if it.n_walkers == 1:
+        results.append(('weights',it.weights()))
+
+    os.makedirs(args.output_dir,exist_ok=True)
+    for name,array in results:
+        printitre("Written {}".format(save(args.output_dir,name,array,args.format)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,10 +1,92 @@
 import numpy as np
 import os
-import numba as nb
 from .metadynamics import Metadynamics
 from .atlas import Atlas
-from .utils import printitre
+from .storage import PackedMatrix, exp_dot, log_exp_dot
+from .cache import BiasMatrixCache
+from .tiled import TiledBuilder
+from .loader import load_columns
+from .hills import is_covariance, covariance_matrices, read_hills, deposited_hills
+from .schedule import evaluation_frames, check_frames, uniform_frames, geometric_frames, adaptive_frames
+from .reweight import interpolate_ct, log_weights, confidence_band, grid_edges, log_histogram, log_kde
+from .instrument import Instrumentation, activate
+from .utils import printitre, set_log_level
 import json
+import logging
+import functools
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+def timed(method):
+    """
+    Decorator timing a method of Itre as a phase named after it (see
+    Itre.phase). At the end of the outermost timed method the report is
+    stored in Itre.timing_report, and written in timing_file if set.
+    """
+    @functools.wraps(method)
+    def timed_method(self,*args,**kwargs):
+        outermost = not self.timings.running()
+        with self.phase(method.__name__):
+            result = method(self,*args,**kwargs)
+        if outermost:
+            self.timing_report = self.timings.report()
+            for name,phase in self.timing_report['phases'].items():
+                printitre("{}: {:.3f} s wall ({:.3f} s in itself), {:.3f} s CPU in {} calls"\
+                          .format(name,phase['wall_time'],phase['self_wall_time'],
+                                  phase['cpu_time'],phase['calls']),logging.DEBUG)
+            if self.timing_file is not None:
+                self.timings.save(self.timing_file)
+        return result
+    return timed_method
+
+
+class AndersonMixing(object):
+    """This class accelerates a fixed point iteration x = g(x) with Anderson
+       mixing: the next point is the combination of the last depth images
+       g(x) that minimises the linearised residual g(x)-x."""
+    def __init__(self,depth=5):
+        super(AndersonMixing, self).__init__()
+        self.depth = int(depth)
+        self.reset()
+
+    def reset(self):
+        """Forget the previous iterations (i.e. take a plain step)."""
+        self.delta_residuals = []
+        self.delta_images = []
+        self.last_residual = None
+        self.last_image = None
+
+    def step(self,point,image):
+        """
+        Parameters
+        ----------
+        point : the current point x
+        image : the image g(x) of the current point
+
+        Returns
+        -------
+        the next point of the iteration
+        """
+        residual = image-point
+        if self.last_residual is not None:
+            self.delta_residuals.append(residual-self.last_residual)
+            self.delta_images.append(image-self.last_image)
+            if len(self.delta_residuals) > self.depth:
+                self.delta_residuals.pop(0)
+                self.delta_images.pop(0)
+        self.last_residual = residual
+        self.last_image = image
+
+        if len(self.delta_residuals) == 0:
+            return image
+        coefficients = np.linalg.lstsq(np.array(self.delta_residuals).T,
+                                       residual,rcond=None)[0]
+        mixed = image-np.array(self.delta_images).T.dot(coefficients)
+        if not np.all(np.isfinite(mixed)):
+            self.reset()
+            return image
+        return mixed
+
 
 class Itre(object):
     """ This class implement the Iterative Trajectory Reweighing method,
@@ -21,13 +103,30 @@ class Itre(object):
     Please visit the example folder in the module root directory to understand
     how to use it.
     """
+    engines = ['python','numba','numpy','parallel','cutoff','grid','tiled']
+    solvers = ['picard','anderson']
+
     def __init__(self):
         super(Itre, self).__init__()
         self.__required_properties_list = ['colvars_file','heights_file' \
                                           ,'sigmas_file']
         self.__optional_properties = ['kT','stride','thetas_file','iterations',\
                                       'starting_height','wall_file','boundaries',\
-                                      'boundaries_file']
+                                      'boundaries_file','engine','n_threads',\
+                                      'cutoff','grid_bins','storage',\
+                                      'matrix_dtype','matrix_file','tolerance',\
+                                      'ct_history','block_size','solver',\
+                                      'mixing_depth','cache_dir','cache_size',\
+                                      'colvars_fields','sigmas_fields',\
+                                      'heights_fields','thetas_fields',\
+                                      'wall_fields','sidecar','n_walkers',\
+                                      'walker_colvars_files','walker_wall_files',\
+                                      'tile_size','work_dir','log_level',\
+                                      'progress_every','timing_file',\
+                                      'log_domain','compute_dtype',\
+                                      'accumulate_dtype','sigmas_format',\
+                                      'schedule','schedule_evals',\
+                                      'hills_file','time_field']
 
         for el in self.__required_properties_list:
             object.__setattr__(self,'{}'.format(el),None)
@@ -45,6 +144,51 @@ class Itre(object):
         self.__setattr__('has_matrix',False)
         self.__setattr__('has_thetas',False)
         self.__setattr__('use_numba',False)
+        self.__setattr__('engine',None)
+        self.__setattr__('n_threads',None)
+        self.__setattr__('cutoff',8.0)
+        self.__setattr__('truncation_error',0.0)
+        self.__setattr__('grid_bins',None)
+        self.__setattr__('interpolation_error',0.0)
+        self.__setattr__('storage','dense')
+        self.__setattr__('matrix_dtype','float64')
+        self.__setattr__('matrix_file',None)
+        self.__setattr__('tolerance',None)
+        self.__setattr__('ct_history','full')
+        self.__setattr__('block_size',None)
+        self.__setattr__('solver','picard')
+        self.__setattr__('mixing_depth',5)
+        self.__setattr__('cache_dir',None)
+        self.__setattr__('cache_size',10.0)
+        self.__setattr__('sidecar',True)
+        self.__setattr__('n_walkers',1)
+        self.__setattr__('walker_colvars',None)
+        self.__setattr__('walker_wall',None)
+        self.__setattr__('scan_ct',None)
+        self.__setattr__('tile_size',512)
+        self.__setattr__('work_dir',None)
+        self.__setattr__('log_level',None)
+        self.__setattr__('progress_every',None)
+        self.__setattr__('progress_callback',None)
+        self.__setattr__('timing_file',None)
+        self.__setattr__('timings',Instrumentation())
+        self.__setattr__('timing_report',None)
+        self.__setattr__('log_domain',False)
+        self.__setattr__('compute_dtype','float64')
+        self.__setattr__('accumulate_dtype','float64')
+        self.__setattr__('sigmas_format','sigma')
+        self.__setattr__('schedule','uniform')
+        self.__setattr__('schedule_evals',None)
+        self.__setattr__('eval_frames',None)
+        self.__setattr__('time_field','time')
+        self.__setattr__('times',None)
+        self.__setattr__('hill_colvars',None)
+        self.__setattr__('hill_times',None)
+        self.__setattr__('bootstrap_ct',None)
+        self.__setattr__('bootstrap_counts',None)
+        self.__setattr__('bootstrap_block_length',None)
+        self.__setattr__('ct_residuals',None)
+        self.__setattr__('converged',False)
         self.__setattr__('has_periodicity',False)
         self.__setattr__('has_residual',False)
         self.__setattr__('boundary_lengths',None)
@@ -78,6 +222,111 @@ directly, not from a json object',
         'has_residual':'for an ATLAS calculation set True if you used the  \
 residual True keyword',
         'use_numba':'wether to use numba or not.',
+        'engine':'which engine evaluates the bias matrix: \"python\", \
+\"numba\", \"numpy\" (Metadynamics only), \"parallel\" (numba on \
+multiple threads), \"cutoff\" (parallel, neglecting the hills farther \
+than cutoff) or \"grid\" (Metadynamics with 1 to 3 CVs, accumulating the \
+hills on a grid) or \"tiled\" (out of core, on multiple processes, see \
+work_dir). If not set, \"numba\" is used when use_numba is True \
+and \"python\" otherwise.',
+        'n_threads':'the number of threads used by the parallel engines. If \
+not set, all the available cores are used.',
+        'cutoff':'for the cutoff engine, the distance (in units of sigma) \
+beyond which the hills are neglected. The default (8.0) makes the truncation \
+error negligible in double precision. It is also the distance up to which \
+the hills are deposited by the grid engine.',
+        'grid_bins':'for the grid engine, the number of bins along each CV \
+(a number or a list). If not set, the spacing is a fifth of the smallest \
+sigma.',
+        'storage':'how the bias matrix is stored: \"dense\" (the default) or \
+\"packed\", which keeps only the lower triangle, halving the memory.',
+        'matrix_dtype':'the precision of the stored bias matrix, \"float64\" \
+(the default) or \"float32\". The bias is always evaluated and summed in \
+double precision, only the stored elements are rounded.',
+        'matrix_file':'for a packed matrix, a file on which the matrix is \
+memory mapped, so that it does not need to fit in memory.',
+        'tolerance':'if set, the self consistent cycle stops as soon as the \
+largest change of c(t) between two iterations is smaller than tolerance, and \
+iterations is only the maximum number of iterations.',
+        'ct_history':'which iterates of c(t) are kept in Itre.ct: \"full\" \
+(the default) keeps all of them, \"last\" only the last two.',
+        'block_size':'exp(-beta*B) is not stored when block_size is set, \
+tolerance is set or ct_history is \"last\": the product with the lower \
+triangle is evaluated on blocks of rows of about block_size elements (2**22 \
+by default) at each iteration. This is always the case for a packed matrix.',
+        'solver':'the solver of the self consistent equation: \"picard\" \
+(the default) iterates the equation, \"anderson\" accelerates the \
+iterations with Anderson mixing, falling back to a plain iteration when a \
+step increases the residual.',
+        'mixing_depth':'for the anderson solver, the number of previous \
+iterations used to extrapolate c(t) (5 by default).',
+        'cache_dir':'if set, the bias matrices are stored in this folder, \
+named after a hash of the data and of the engine, and reloaded when the \
+same matrix is needed again (e.g. to change kT or the iterations).',
+        'cache_size':'the maximum size of cache_dir in GB (10 by default), \
+beyond which the least recently used matrices are removed.',
+        'colvars_fields':'the names of the fields (or the indices of the \
+columns) of colvars_file to use as CVs, e.g. [\"d1.x\",\"d1.y\"] for a \
+PLUMED HILLS file. If not set, all the columns are used. The same holds \
+for sigmas_fields, heights_fields, thetas_fields and wall_fields.',
+        'sidecar':'whether to save a binary copy of each input file next to \
+it (as a hidden .npy file), which is memory mapped instead of parsing the \
+text again as long as the file is not modified. True by default.',
+        'n_walkers':'the number of walkers of a multiple walkers \
+Metadynamics. The colvars, sigmas and heights files then contain the hills \
+of all the walkers interleaved (n_walkers hills per step) and a single c(t) \
+is calculated from the frames of all the walkers.',
+        'walker_colvars_files':'with multiple walkers, a list with the CVs \
+of each walker (e.g. their COLVAR files). If not set, the centers of the \
+hills deposited by each walker are used.',
+        'walker_wall_files':'with multiple walkers, a list with the restraint \
+acting on each walker. If not set, it is taken from wall_file.',
+        'tile_size':'for the tiled engine, the number of rows and columns \
+of the tiles in which the bias matrix is split (512 by default).',
+        'work_dir':'for the tiled engine, the folder in which the inputs \
+and the progress of the build are saved. An interrupted build is resumed \
+by running the same calculation again. The matrix is always packed and \
+memory mapped on matrix_file (bias_matrix.dat in work_dir if not set).',
+        'log_level':'the level of the messages printed by ITRE (through \
+the itre logger of the logging module): \"DEBUG\" also prints the \
+progress and the timings of each phase, \"WARNING\" only the warnings. \
+\"INFO\" by default.',
+        'progress_every':'the number of reference frames (or tiles, or \
+iterations) between two calls of Itre.progress_callback, a function called \
+as progress_callback(phase,done,total,elapsed). Every step by default.',
+        'timing_file':'if set, the timings of each phase (file loading, \
+boundaries, bias matrix, c(t) iterations), the kernel evaluations and the \
+peak memory are written in this json file, as in Itre.timing_report.',
+        'log_domain':'if True, the self consistent equation is solved in \
+the log domain: the sums over the frames are log-sum-exp reductions of \
+each row of the matrix, relative to the instantaneous bias, so that no \
+exponential overflows or underflows at large bias/kT. False by default.',
+        'compute_dtype':'in the log domain, the precision of the \
+exponentials of the bias matrix: \"float64\" (the default) or \"float32\", \
+which is safe in the log domain and about twice as fast.',
+        'sigmas_format':'\"sigma\" (the default) if sigmas_file has a sigma \
+per CV, \"covariance\" if it has the full covariance matrix of each hill, \
+either all its n_cvs*n_cvs elements or its lower triangle, row by row. \
+Full covariances are supported by the python, numpy, parallel and tiled \
+engines.',
+        'accumulate_dtype':'in the log domain, the precision of the sums \
+of the exponentials, \"float64\" by default.',
+        'schedule':'the frames in which c(t) is evaluated: \"uniform\" (the \
+default) one every stride frames, \"geometric\" with a spacing that starts \
+from stride and grows geometrically, \"adaptive\" with a spacing inversely \
+proportional to the rate of change of the bias (the heights of the hills), \
+never smaller than stride, or directly the sorted list of the frames, \
+starting from 0. The hills are accumulated between two evaluations.',
+        'schedule_evals':'for the geometric and adaptive schedules, the \
+number of evaluations of c(t).',
+        'hills_file':'a HILLS file written by PLUMED, from which the time, \
+the center, the sigmas and the height of each hill are read, when the hills \
+are deposited less often than the CVs are printed in colvars_file (e.g. every \
+PACE steps). Only the hills deposited before each evaluated frame are summed, \
+and sigmas_file and heights_file are not needed. Available for Metadynamics \
+with the numpy, parallel and cutoff engines.',
+        'time_field':'with hills_file, the field of the time in colvars_file \
+and in hills_file, \"time\" by default.',
         'boundaries_file':'this directive tells Itre to read a file from which \
 the boundaries of each CVs are readed. If a CVs is \
 not bounded, then the string \"unbounded\" is expected.',
@@ -98,10 +347,25 @@ assumed to be unbounded. This key has priority over \
         printitre(json.dumps(dd, indent=4, sort_keys=True))
 
 
-    def from_dict(self,dict):
+    @contextmanager
+    def phase(self,name):
         """
-        Read the directive from a json object (dictionary) and populate the
-        attributes of the class.
+        Context manager timing a phase of the calculation in self.timings,
+        to which the engines report their progress meanwhile (see
+        Instrumentation). The main methods of the class are timed as phases
+        named after them.
+        """
+        if self.log_level is not None:
+            set_log_level(self.log_level)
+        self.timings.callback = self.progress_callback
+        self.timings.progress_every = self.progress_every
+        with activate(self.timings), self.timings.phase(name):
+            yield
+
+    def set_directives(self,dict):
+        """
+        Set the attributes corresponding to the directives contained in a
+        json object (dictionary), without reading any file.
 
         Parameters
         ----------
@@ -115,32 +379,70 @@ assumed to be unbounded. This key has priority over \
                 printitre("Found {} directive with {} value".format(key, \
                                                                     dict[key]))
 
+    @timed
+    def from_dict(self,dict):
+        """
+        Read the directive from a json object (dictionary) and populate the
+        attributes of the class.
+
+        Parameters
+        ----------
+        dict : a dictionary containing the optional and required directives
+               to use the class.
+        """
+        self.set_directives(dict)
+
         if os.path.isfile(self.colvars_file):
-            colvars = np.loadtxt(self.colvars_file)
+            colvars = load_columns(self.colvars_file,self.colvars_fields,self.sidecar)
             self.__setattr__('colvars',colvars)
             self.__setattr__('n_cvs',self.__get_num_colvars(colvars))
 
-        if os.path.isfile(self.sigmas_file):
-            sigmas = np.loadtxt(self.sigmas_file)
+        if self.hills_file is not None:
+            if self.thetas_file is not None or self.n_walkers > 1:
+                raise ValueError("The hills_file is only available for Metadynamics \
+with a single walker")
+            cv_fields = self.colvars_fields
+            if cv_fields is not None and not all(isinstance(el,str) for el in np.atleast_1d(cv_fields)):
+                # the columns of colvars_file do not tell the fields of the hills
+                cv_fields = None
+            hill_times,hill_colvars,sigmas,heights = read_hills(self.hills_file,cv_fields,
+                                                                self.sidecar)
+            if np.shape(hill_colvars)[1] != self.n_cvs:
+                raise ValueError('The hills have {} CVs, colvars {}'.format(np.shape(hill_colvars)[1],
+                                                                         self.n_cvs))
+            if self.n_cvs == 1:
+                hill_colvars,sigmas = hill_colvars[:,0],sigmas[:,0]
+            heights = self.starting_height*heights/heights[0]
+            self.__setattr__('times',load_columns(self.colvars_file,self.time_field,self.sidecar))
+            self.__setattr__('hill_times',hill_times)
+            self.__setattr__('hill_colvars',hill_colvars)
+        elif os.path.isfile(self.sigmas_file):
+            sigmas = load_columns(self.sigmas_file,self.sigmas_fields,self.sidecar)
             if len(colvars)!=len(sigmas):
                 raise ValueError('Length of colvars and sigmas is different!')
-        if os.path.isfile(self.heights_file):
-            heights = np.loadtxt(self.heights_file)
+            if self.sigmas_format == 'covariance':
+                sigmas = covariance_matrices(sigmas,self.n_cvs)
+                if self.n_cvs == 1:
+                    sigmas = np.sqrt(sigmas).reshape(np.shape(colvars))
+            elif self.sigmas_format != 'sigma':
+                raise ValueError("Unknown sigmas_format {}, use sigma or covariance"\
+                                 .format(self.sigmas_format))
+        if self.hills_file is None and os.path.isfile(self.heights_file):
+            heights = load_columns(self.heights_file,self.heights_fields,self.sidecar)
             if len(colvars)!=len(heights):
                 raise ValueError('Length of colvars and heights is different!')
-            heights /=heights[0]
-            heights *= self.starting_height
+            heights = self.starting_height*heights/heights[0]
 
         if self.thetas_file is not None:
             if os.path.isfile(self.thetas_file):
-                thetas = np.loadtxt(self.thetas_file)
+                thetas = load_columns(self.thetas_file,self.thetas_fields,self.sidecar)
                 if len(colvars)!=len(thetas):
                     raise ValueError('Length of colvars and thetas is different!')
                 self.__setattr__('has_thetas',True)
 
         if self.wall_file is not None:
             if os.path.isfile(self.wall_file):
-                wall = np.loadtxt(self.wall_file)
+                wall = load_columns(self.wall_file,self.wall_fields,self.sidecar)
                 if len(colvars)!=len(wall):
                     raise ValueError('Length of colvars and wall is different!')
         else:
@@ -167,11 +469,95 @@ assumed to be unbounded. This key has priority over \
         if self.has_thetas:
             self.__setattr__('thetas',thetas)
 
-        self.__setattr__('steps',len(self.colvars))
-        self.__setattr__('n_evals',int(self.steps//self.stride))
+        if self.walker_colvars_files is not None:
+            if len(self.walker_colvars_files) != self.n_walkers:
+                raise ValueError('There are {} walkers but {} walker_colvars_files'\
+                                 .format(self.n_walkers,len(self.walker_colvars_files)))
+            self.__setattr__('walker_colvars',[load_columns(el,self.colvars_fields,self.sidecar)
+                                               for el in self.walker_colvars_files])
+        if self.walker_wall_files is not None:
+            self.__setattr__('walker_wall',[load_columns(el,self.wall_fields,self.sidecar)
+                                            for el in self.walker_wall_files])
+
+        self.__setattr__('steps',int(len(self.colvars)//self.n_walkers))
+        self.set_schedule()
 
         self.set_boundaries(boundaries)
 
+    def set_schedule(self,schedule=None):
+        """
+        Choose the frames in which c(t) is evaluated (see the schedule
+        directive), setting eval_frames and n_evals. For the uniform schedule
+        eval_frames is None, and the bias is evaluated every stride frames.
+
+        Parameters
+        ----------
+        schedule : "uniform", "geometric", "adaptive" or the list of the
+                   evaluated frames. If None, the schedule directive is used.
+        """
+        if schedule is None:
+            schedule = self.schedule
+        steps = int(self.steps)
+
+        if isinstance(schedule,str):
+            if schedule == 'uniform':
+                self.__setattr__('eval_frames',None)
+                self.__setattr__('n_evals',int(steps//self.stride))
+                return
+            if schedule not in ['geometric','adaptive']:
+                raise ValueError("Unknown schedule {}, use uniform, geometric, adaptive \
+or a list of frames".format(schedule))
+            if self.schedule_evals is None:
+                raise ValueError("The {} schedule needs schedule_evals".format(schedule))
+            if schedule == 'geometric':
+                frames = geometric_frames(steps,self.schedule_evals,self.stride)
+            else:
+                # the bias in the visited point grows by the hills deposited
+                # there, so its rate of change is given by their heights
+                if self.hill_times is None:
+                    rate = np.sum(np.reshape(np.abs(self.heights),(steps,-1)),axis=1)
+                else:
+                    deposited = np.concatenate(([0.0],np.cumsum(np.abs(self.heights))))
+                    counts = deposited_hills(self.hill_times,self.times)
+                    rate = np.diff(deposited[np.append(counts,len(self.heights))])
+                frames = adaptive_frames(rate,self.schedule_evals,self.stride)
+        else:
+            frames = check_frames(schedule,steps)
+
+        self.__setattr__('eval_frames',frames)
+        self.__setattr__('n_evals',len(frames))
+        printitre("c(t) is evaluated in {} frames, with a spacing from {} to {}"\
+                  .format(len(frames),np.amin(np.diff(frames),initial=steps),
+                          np.amax(np.diff(frames),initial=0)))
+
+    def __evaluation_frames(self):
+        """
+        The frames in which c(t) is evaluated, eval_frames or one every stride
+        frames (see set_schedule).
+        """
+        if self.eval_frames is None:
+            return evaluation_frames(self.n_evals,self.stride)
+        return np.asarray(self.eval_frames,dtype=np.int64)[:self.n_evals]
+
+    def __hill_counts(self,frames):
+        """
+        The number of hills of hills_file deposited before each of the frames
+        of colvars (see deposited_hills).
+        """
+        if self.times is None or len(self.times) != len(self.colvars):
+            raise ValueError("The time of each frame of colvars is needed with a hills_file")
+        return deposited_hills(self.hill_times,np.asarray(self.times)[frames])
+
+    def __count_evaluations(self,hill_counts):
+        """
+        Count the kernel evaluations of a bias matrix, given the number of
+        hills deposited before each evaluated frame: every reference frame is
+        evaluated against the hills deposited before the last one. Nothing is
+        counted if there are no evaluated frames.
+        """
+        if len(hill_counts) > 0:
+            self.timings.count(self.n_evals*hill_counts[-1])
+
     def __get_num_colvars(self,array):
         """
         Get the number of CVs passed to the file
@@ -187,6 +573,7 @@ assumed to be unbounded. This key has priority over \
         return ln
 
 
+    @timed
     def set_boundaries(self,boundaries=None):
         """
         This function picks the directive for the boundary conditions provided
@@ -292,12 +679,194 @@ assumed to be unbounded. This key has priority over \
             printitre("CV {} has boundaries {} {} with a domain of {}".format(k,float_boundaries[2*k],float_boundaries[2*k+1],float_lengths[k]))
 
 
+    def __get_engine(self):
+        """
+        Get the engine used to evaluate the bias matrix. If no engine has
+        been set, fall back to the use_numba directive.
+        """
+        if self.engine is None:
+            if self.use_numba:
+                return 'numba'
+            return 'python'
+
+        if self.engine not in self.engines:
+            raise ValueError("Unknown engine {}, available engines are {}"\
+                             .format(self.engine,self.engines))
+
+        return self.engine
+
+    def __allocate_bias_matrix(self,matrix_file=None):
+        """
+        Allocate the bias matrix according to the storage, matrix_dtype and
+        matrix_file directives. None is returned for a dense float64 matrix,
+        which is allocated by the engines themselves.
+        """
+        if matrix_file is None:
+            matrix_file = self.matrix_file
+        dtype = np.dtype(self.matrix_dtype)
+        if dtype not in [np.float64,np.float32]:
+            raise ValueError("The bias matrix can only be stored as float64 \
+or float32, not {}".format(self.matrix_dtype))
+
+        if self.storage == 'packed':
+            printitre("Storing the lower triangle of the matrix as {}".format(dtype))
+            return PackedMatrix(self.n_evals,dtype,matrix_file)
+        if self.storage != 'dense':
+            raise ValueError("Unknown storage {}, use dense or packed"\
+                             .format(self.storage))
+        if matrix_file is not None:
+            raise ValueError("Only a packed matrix can be stored on file")
+        if dtype == np.float64:
+            return None
+        return np.zeros((self.n_evals,self.n_evals),dtype=dtype)
+
+    @timed
+    def calculate_walker_bias_matrices(self):
+        """
+        Evaluate the bias matrix of each walker of a multiple walkers
+        Metadynamics, i.e. the bias of the hills deposited by all the walkers
+        evaluated in the frames of that walker. The walkers are distributed
+        over n_threads threads (one per walker by default), which share the
+        arrays of the hills. The numpy engine is used.
+
+        Returns
+        -------
+        bias_matrices : a list with the n_eval,n_eval matrix of each walker
+        """
+        if self.has_thetas:
+            raise ValueError("Multiple walkers are only available for Metadynamics")
+        if self.hill_times is not None:
+            raise ValueError("Multiple walkers are not available with a hills_file")
+
+        walker_colvars = self.walker_colvars
+        if walker_colvars is None:
+            walker_colvars = [self.colvars[w::self.n_walkers] for w in range(self.n_walkers)]
+        walker_wall = self.walker_wall
+        if walker_wall is None:
+            walker_wall = [self.wall[w::self.n_walkers] for w in range(self.n_walkers)]
+        if len(walker_colvars) != self.n_walkers or len(walker_wall) != self.n_walkers:
+            raise ValueError("The CVs and the wall of all the {} walkers are needed"\
+                             .format(self.n_walkers))
+
+        printitre(" You are reweighing a METAD calculations with {} walkers "\
+                  .format(self.n_walkers))
+        printitre("With the numpy engine.")
+        bias_scheme = Metadynamics()
+        frames = self.__evaluation_frames()
+        if len(frames) == 0:
+            raise ValueError("The walkers have {} frames, too few to evaluate \
+c(t) every {} frames".format(self.steps,self.stride))
+
+        def walker_matrix(walker):
+            matrix_file = None
+            if self.matrix_file is not None:
+                matrix_file = '{}.{}'.format(self.matrix_file,walker)
+            out = self.__allocate_bias_matrix(matrix_file)
+            self.__count_evaluations(frames*self.n_walkers)
+            return bias_scheme.calculate_bias_matrix_np(self.colvars,
+                                                        self.boundary_lengths,
+                                                        self.sigmas,
+                                                        self.heights,
+                                                        walker_wall[walker],
+                                                        self.n_evals,
+                                                        frames,
+                                                        out=out,
+                                                        ref_colvars=walker_colvars[walker],
+                                                        n_walkers=self.n_walkers)
+
+        n_threads = self.n_walkers if self.n_threads is None else self.n_threads
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            matrices = list(executor.map(walker_matrix,range(self.n_walkers)))
+
+        self.has_matrix=True
+        printitre("")
+        return matrices
+
+    def __cached_bias_matrix(self):
+        """
+        Load the bias matrix from cache_dir if it has already been
+        calculated with the same data and engine, otherwise calculate it and
+        store it in the cache. Without cache_dir, just calculate it.
+        """
+        if self.n_walkers > 1:
+            return self.calculate_walker_bias_matrices()
+        if self.cache_dir is None:
+            return self.calculate_bias_matrix()
+
+        max_size = None if self.cache_size is None else int(self.cache_size*1e9)
+        cache = BiasMatrixCache(self.cache_dir,max_size)
+        engine = self.__get_engine()
+        arrays = {'colvars':self.colvars,'sigmas':self.sigmas,
+                  'heights':self.heights,'wall':self.wall,
+                  'boundaries':self.boundaries,
+                  'boundary_lengths':self.boundary_lengths,
+                  'thetas':self.thetas if self.has_thetas else None}
+        parameters = {'engine':engine,'stride':int(self.stride),
+                      'n_evals':int(self.n_evals),'has_thetas':bool(self.has_thetas),
+                      'has_residual':bool(self.has_residual),
+                      'storage':self.storage,'matrix_dtype':str(self.matrix_dtype)}
+        if self.eval_frames is not None:
+            arrays['eval_frames'] = self.__evaluation_frames()
+        if self.hill_times is not None:
+            arrays['times'] = self.times
+            arrays['hill_times'] = self.hill_times
+            arrays['hill_colvars'] = self.hill_colvars
+        if engine in ['cutoff','grid']:
+            parameters['cutoff'] = float(self.cutoff)
+        if engine == 'grid':
+            parameters['grid_bins'] = self.grid_bins
+        key = cache.key(arrays,parameters)
+
+        matrix,info = cache.load(key,self.matrix_file)
+        if matrix is not None:
+            self.truncation_error = float(info['truncation_error'])
+            self.interpolation_error = float(info['interpolation_error'])
+            self.has_matrix = True
+            return matrix
+
+        matrix = self.calculate_bias_matrix()
+        cache.store(key,matrix,truncation_error=self.truncation_error,
+                    interpolation_error=self.interpolation_error)
+        return matrix
+
+    def __tiled_bias_matrix(self):
+        """
+        Build the bias matrix with the tiled engine (see TiledBuilder), as a
+        PackedMatrix memory mapped on matrix_file.
+        """
+        work_dir = self.work_dir
+        if work_dir is None:
+            if self.matrix_file is None:
+                raise ValueError("The tiled engine needs a work_dir or a matrix_file")
+            work_dir = '{}.tiles'.format(self.matrix_file)
+        builder = TiledBuilder(work_dir,self.matrix_file,self.tile_size,self.n_threads)
+
+        thetas = None
+        residual_weights = 0.0
+        if self.has_thetas:
+            printitre(" You are reweighing an ATLAS calculations ")
+            thetas = self.thetas
+            if self.has_residual:
+                residual_weights = 1.0
+                printitre(" with the residual activated ")
+        else:
+            printitre(" You are reweighing a METAD calculations ")
+        printitre("With tiles of {} frames on multiple processes.".format(builder.tile_size))
+        matrix = builder.build(self.colvars,self.boundary_lengths,self.sigmas,
+                               self.heights,self.wall,self.n_evals,
+                               self.__evaluation_frames(),thetas,residual_weights,
+                               np.dtype(self.matrix_dtype))
+        self.has_matrix=True
+        printitre("")
+        return matrix
+
+    @timed
     def calculate_bias_matrix(self):
         """
         This function is a selector. Depending on which directives has
         been set, it selects if the simulations that we are reweighting is a
-        Metadynamics, a Atlas or other calculations. It also check if the
-        calculation should be performed with or withouth numba.
+        Metadynamics, a Atlas or other calculations. It also check which
+        engine should be used to perform the calculation (see print_dict).
 
         The class call classes that evaluate the lagged and instantaneous bias.
 
@@ -307,6 +876,21 @@ assumed to be unbounded. This key has priority over \
                       lagged potential. The instantaneous potential is
                       equal to the diagonal of this matrix
         """
+        engine = self.__get_engine()
+        if is_covariance(self.sigmas) and engine not in ['python','numpy','parallel','tiled']:
+            raise ValueError("The {} engine does not support hills with a full \
+covariance, use the python, numpy, parallel or tiled engine".format(engine))
+        frames = self.__evaluation_frames()
+        if len(frames) == 0:
+            raise ValueError("The trajectory has {} frames, too few to evaluate \
+c(t) every {} frames".format(self.steps,self.stride))
+        if self.hill_times is not None:
+            return self.__hills_bias_matrix(engine,frames)
+        # the pairs of reference frame and hill of the lagged bias, whatever the engine
+        self.__count_evaluations(frames)
+        if engine == 'tiled':
+            return self.__tiled_bias_matrix()
+        out = self.__allocate_bias_matrix()
 
         if self.has_thetas:
             printitre(" You are reweighing an ATLAS calculations ")
@@ -315,7 +899,7 @@ assumed to be unbounded. This key has priority over \
             if self.has_residual:
                 residual_weights = 1.0
                 printitre(" with the residual activated ")
-            if self.use_numba:
+            if engine == 'numba':
                 printitre("With numba enabled.")
                 matrix = bias_scheme.calculate_bias_matrix_nb(self.colvars,
                                                               self.boundary_lengths,
@@ -324,10 +908,46 @@ assumed to be unbounded. This key has priority over \
                                                               self.wall,
                                                               self.thetas,
                                                               self.n_evals,
-                                                              self.stride,
+                                                              frames,
                                                               self.n_cvs,
                                                               residual_weights)
-            else:
+            elif engine == 'parallel':
+                printitre("With numba enabled on multiple threads.")
+                matrix = bias_scheme.calculate_bias_matrix_parallel(self.colvars,
+                                                                    self.boundary_lengths,
+                                                                    self.sigmas,
+                                                                    self.heights,
+                                                                    self.wall,
+                                                                    self.thetas,
+                                                                    self.n_evals,
+                                                                    frames,
+                                                                    residual_weights,
+                                                                    self.n_threads,
+                                                                    out=out)
+            elif engine == 'cutoff':
+                printitre("With a cutoff of {} sigmas.".format(self.cutoff))
+                matrix = bias_scheme.calculate_bias_matrix_cutoff(self.colvars,
+                                                                  self.boundary_lengths,
+                                                                  self.sigmas,
+                                                                  self.heights,
+                                                                  self.wall,
+                                                                  self.thetas,
+                                                                  self.n_evals,
+                                                                  frames,
+                                                                  residual_weights,
+                                                                  self.cutoff,
+                                                                  self.boundaries[0::2],
+                                                                  self.n_threads,
+                                                                  out=out)
+                self.truncation_error = bias_scheme.truncation_error_bound(self.heights,
+                                                                           self.thetas,
+                                                                           self.n_evals,
+                                                                           frames,
+                                                                           residual_weights,
+                                                                           self.cutoff)
+                printitre("The truncation error is smaller than {}"\
+                          .format(self.truncation_error))
+            elif engine == 'python':
                 printitre("With numba disabled")
                 matrix = bias_scheme.calculate_bias_matrix(self.colvars,
                                                            self.boundary_lengths,
@@ -336,12 +956,15 @@ assumed to be unbounded. This key has priority over \
                                                            self.wall,
                                                            self.thetas,
                                                            self.n_evals,
-                                                           self.stride,
+                                                           frames,
                                                            residual_weights)
+            else:
+                raise ValueError("The {} engine is not available for ATLAS"\
+                                 .format(engine))
         else:
             printitre(" You are reweighing a METAD calculations ")
             bias_scheme = Metadynamics()
-            if self.use_numba:
+            if engine == 'numba':
                 printitre("With numba enabled.")
                 matrix = bias_scheme.calculate_bias_matrix_nb(self.colvars,
                                                               self.boundary_lengths,
@@ -349,8 +972,72 @@ assumed to be unbounded. This key has priority over \
                                                               self.heights,
                                                               self.wall,
                                                               self.n_evals,
-                                                              self.stride,
+                                                              frames,
                                                               self.n_cvs)
+            elif engine == 'numpy':
+                printitre("With the numpy engine.")
+                matrix = bias_scheme.calculate_bias_matrix_np(self.colvars,
+                                                              self.boundary_lengths,
+                                                              self.sigmas,
+                                                              self.heights,
+                                                              self.wall,
+                                                              self.n_evals,
+                                                              frames,
+                                                              out=out)
+            elif engine == 'parallel':
+                printitre("With numba enabled on multiple threads.")
+                matrix = bias_scheme.calculate_bias_matrix_parallel(self.colvars,
+                                                                    self.boundary_lengths,
+                                                                    self.sigmas,
+                                                                    self.heights,
+                                                                    self.wall,
+                                                                    self.n_evals,
+                                                                    frames,
+                                                                    self.n_threads,
+                                                                    out=out)
+            elif engine == 'cutoff':
+                printitre("With a cutoff of {} sigmas.".format(self.cutoff))
+                matrix = bias_scheme.calculate_bias_matrix_cutoff(self.colvars,
+                                                                  self.boundary_lengths,
+                                                                  self.sigmas,
+                                                                  self.heights,
+                                                                  self.wall,
+                                                                  self.n_evals,
+                                                                  frames,
+                                                                  self.cutoff,
+                                                                  self.boundaries[0::2],
+                                                                  self.n_threads,
+                                                                  out=out)
+                self.truncation_error = bias_scheme.truncation_error_bound(self.heights,
+                                                                           self.n_evals,
+                                                                           frames,
+                                                                           self.cutoff)
+                printitre("The truncation error is smaller than {}"\
+                          .format(self.truncation_error))
+            elif engine == 'grid':
+                printitre("With the hills accumulated on a grid.")
+                matrix = bias_scheme.calculate_bias_matrix_grid(self.colvars,
+                                                                self.boundary_lengths,
+                                                                self.sigmas,
+                                                                self.heights,
+                                                                self.wall,
+                                                                self.n_evals,
+                                                                frames,
+                                                                self.boundaries[0::2],
+                                                                self.grid_bins,
+                                                                self.cutoff,
+                                                                self.n_threads,
+                                                                out=out)
+                self.interpolation_error = bias_scheme.interpolation_error(matrix,
+                                                                           self.colvars,
+                                                                           self.boundary_lengths,
+                                                                           self.sigmas,
+                                                                           self.heights,
+                                                                           self.wall,
+                                                                           self.n_evals,
+                                                                           frames)
+                printitre("The interpolation error on the sampled columns is {}"\
+                          .format(self.interpolation_error))
             else:
                 printitre("With numba disabled")
                 matrix = bias_scheme.calculate_bias_matrix(self.colvars,
@@ -359,18 +1046,139 @@ assumed to be unbounded. This key has priority over \
                                                            self.heights,
                                                            self.wall,
                                                            self.n_evals,
-                                                           self.stride)
+                                                           frames)
+        if out is not None and matrix is not out:
+            # the python and numba engines only return a dense matrix
+            if isinstance(out,PackedMatrix):
+                out.fill(matrix)
+            else:
+                out[:,:] = matrix
+            matrix = out
+        self.has_matrix=True
+        printitre("")
+        return matrix
+
+    def __hills_bias_matrix(self,engine,frames):
+        """
+        Evaluate the bias matrix of the hills read from hills_file, summing
+        in each evaluated frame of colvars only the hills deposited before it.
+        The hills deposited every PACE frames are not padded to the frames of
+        colvars, so the kernel is evaluated PACE times less.
+        """
+        if engine not in ['numpy','parallel','cutoff']:
+            raise ValueError("The hills of a hills_file are summed by the numpy, \
+parallel and cutoff engines, not by the {} engine".format(engine))
+        counts = self.__hill_counts(frames)
+        self.__count_evaluations(counts)
+        out = self.__allocate_bias_matrix()
+
+        printitre(" You are reweighing a METAD calculations ")
+        printitre("With {} hills deposited before the last evaluated frame."\
+                  .format(counts[-1]))
+        bias_scheme = Metadynamics()
+        if engine == 'numpy':
+            printitre("With the numpy engine.")
+            matrix = bias_scheme.calculate_bias_matrix_np(self.hill_colvars,
+                                                          self.boundary_lengths,
+                                                          self.sigmas,
+                                                          self.heights,
+                                                          self.wall,
+                                                          self.n_evals,
+                                                          frames,
+                                                          out=out,
+                                                          ref_colvars=self.colvars,
+                                                          hill_counts=counts)
+        elif engine == 'parallel':
+            printitre("With numba enabled on multiple threads.")
+            matrix = bias_scheme.calculate_bias_matrix_parallel(self.hill_colvars,
+                                                                self.boundary_lengths,
+                                                                self.sigmas,
+                                                                self.heights,
+                                                                self.wall,
+                                                                self.n_evals,
+                                                                frames,
+                                                                self.n_threads,
+                                                                out=out,
+                                                                ref_colvars=self.colvars,
+                                                                hill_counts=counts)
+        else:
+            printitre("With a cutoff of {} sigmas.".format(self.cutoff))
+            matrix = bias_scheme.calculate_bias_matrix_cutoff(self.hill_colvars,
+                                                              self.boundary_lengths,
+                                                              self.sigmas,
+                                                              self.heights,
+                                                              self.wall,
+                                                              self.n_evals,
+                                                              frames,
+                                                              self.cutoff,
+                                                              self.boundaries[0::2],
+                                                              self.n_threads,
+                                                              out=out,
+                                                              ref_colvars=self.colvars,
+                                                              hill_counts=counts)
+            self.truncation_error = bias_scheme.truncation_error_bound(self.heights,
+                                                                       self.n_evals,
+                                                                       counts,
+                                                                       self.cutoff)
+            printitre("The truncation error is smaller than {}"\
+                      .format(self.truncation_error))
         self.has_matrix=True
         printitre("")
         return matrix
 
-    def calculate_c_t(self):
+    def __lagged_dot(self,bias_matrix,factor=None):
+        """
+        Return the function that multiplies a vector (or the columns of a
+        matrix) by exp(factor*B), restricted to the lower triangle, either
+        storing the exponentiated matrix or streaming it by blocks of rows
+        (see block_size). The matrix is streamed if it is packed, if
+        block_size is set, and whenever the memory of the cycle is bounded
+        (with a tolerance or ct_history set to last). The factor is -beta
+        by default.
+        """
+        if factor is None:
+            factor = -self.beta
+        streamed = self.block_size is not None or self.tolerance is not None or \
+                   self.ct_history == 'last'
+        if isinstance(bias_matrix,PackedMatrix) or streamed:
+            block_size = 2**22 if self.block_size is None else int(self.block_size)
+            return lambda vec: exp_dot(bias_matrix,vec,factor,block_size)
+        matw = np.tril(np.exp(factor*np.asarray(bias_matrix,dtype=np.float64)))
+        return matw.dot
+
+    def __lagged_log_dot(self,bias_matrix,instantaneous):
+        """
+        Return the function that maps the log of a vector v to the log of
+        the product between exp(-beta*B), restricted to the lower triangle,
+        and v, as log-sum-exp reductions of the rows of beta*(B-V), with V
+        the instantaneous bias (see storage.log_exp_dot).
+        """
+        dtypes = [np.dtype(self.compute_dtype),np.dtype(self.accumulate_dtype)]
+        for dtype in dtypes:
+            if dtype not in [np.float64,np.float32]:
+                raise ValueError("The log domain products can only be evaluated \
+as float64 or float32, not {}".format(dtype))
+        block_size = 2**22 if self.block_size is None else int(self.block_size)
+        return lambda log_vec: log_exp_dot(bias_matrix,instantaneous,log_vec,
+                                           -self.beta,block_size,*dtypes)
+
+    @timed
+    def calculate_c_t(self,initial_ct=None):
         """
         Calculate c(t) by solving the self consistent equation n 13 presented
         in the publication.
 
         If the bias matrix has not been calculate, calculate the matrix and
         then proceed in the self consistent cycle.
+
+        The iterates are stored in self.ct (see the ct_history directive),
+        whose last row is the final c(t), and the largest change of c(t) at
+        each iteration in self.ct_residuals.
+
+        Parameters
+        ----------
+        initial_ct : an optional n_evals array used as a starting point of
+                     the self consistent cycle (zero by default).
         """
         self.__setattr__('beta',1/self.kT)
 
@@ -382,24 +1190,559 @@ assumed to be unbounded. This key has priority over \
             printitre("The lagged potential matrix was not calculated")
             printitre("Calculating it now!")
             printitre("")
-            self.bias_matrix=self.calculate_bias_matrix()
-            self.instantaneous_bias = np.diag(self.bias_matrix)
+            self.bias_matrix=self.__cached_bias_matrix()
+            if self.n_walkers > 1:
+                self.instantaneous_bias = np.array([el.diagonal() for el in self.bias_matrix],
+                                                   dtype=np.float64)
+            else:
+                self.instantaneous_bias = np.array(self.bias_matrix.diagonal(),dtype=np.float64)
 
-        iter = 0
-        self.ct = np.zeros((self.iterations,self.n_evals))
-        matw = np.tril(np.exp(-self.bias_matrix*self.beta))
+        # with multiple walkers, the frames of all of them enter in the sums
+        matrices = self.bias_matrix if self.n_walkers > 1 else [self.bias_matrix]
+        instantaneous = np.reshape(self.instantaneous_bias,(len(matrices),-1))
+        if self.log_domain:
+            log_dots = [self.__lagged_log_dot(el,shift) for el,shift in zip(matrices,instantaneous)]
+        else:
+            lagged_dots = [self.__lagged_dot(el) for el in matrices]
+
+        if self.solver not in self.solvers:
+            raise ValueError("Unknown solver {}, available solvers are {}"\
+                             .format(self.solver,self.solvers))
+        if self.ct_history not in ['full','last']:
+            raise ValueError("Unknown ct_history {}, use full or last"\
+                             .format(self.ct_history))
+
+        ct = np.zeros(self.n_evals)
+        if initial_ct is not None:
+            ct[:] = initial_ct
+        previous = ct
+        history = [ct]
+        self.ct_residuals = []
+        self.converged = False
+        mixing = AndersonMixing(self.mixing_depth)
         for iteration in range(1,self.iterations):
-            printitre(" Done iteration n {}".format(iteration))
-            offset = self.instantaneous_bias-self.ct[iteration-1]
-            vec1 = np.exp(offset*self.beta)
-            res = matw.dot(vec1)
-            norm = np.cumsum(vec1)
-            self.ct[iteration] = -self.kT*np.log(res/norm)
+            offset = instantaneous-ct
+            if self.log_domain:
+                # the instantaneous bias is already subtracted from the matrix
+                log_res = np.logaddexp.reduce([dot(-self.beta*ct) for dot in log_dots],axis=0)
+                log_norm = np.logaddexp.accumulate(np.logaddexp.reduce(offset*self.beta,axis=0))
+                mapped = -self.kT*(log_res-log_norm)
+            else:
+                vec1 = np.exp(offset*self.beta)
+                res = sum([dot(vec) for dot,vec in zip(lagged_dots,vec1)])
+                norm = np.cumsum(np.sum(vec1,axis=0))
+                mapped = -self.kT*np.log(res/norm)
+
+            residual = np.amax(np.abs(mapped-ct))
+            if self.solver == 'anderson':
+                if len(self.ct_residuals) > 0 and residual > self.ct_residuals[-1]:
+                    printitre(" The residual increased, restarting the mixing")
+                    mixing.reset()
+                new_ct = mixing.step(ct,mapped)
+            else:
+                new_ct = mapped
+            self.ct_residuals.append(residual)
+            previous, ct = ct, new_ct
+            if self.ct_history == 'full':
+                history.append(ct)
+
+            printitre(" Done iteration n {}, max |dc(t)| = {}".format(iteration,residual))
+            self.timings.progress(iteration,self.iterations-1)
+            if self.tolerance is not None and residual < self.tolerance:
+                self.converged = True
+                printitre("Converged after {} iterations".format(iteration))
+                break
+
+        if self.tolerance is not None and not self.converged:
+            printitre("WARNING: c(t) did not converge within {} iterations"\
+                      .format(self.iterations),logging.WARNING)
+        if self.ct_history == 'full':
+            self.ct = np.array(history)
+        else:
+            self.ct = np.array([previous,ct])
+        self.ct_residuals = np.array(self.ct_residuals)
 
         printitre("Finished, c(t) calculated!")
         printitre("")
 
+    @timed
+    def scan_c_t(self,kT_values,starting_heights=None):
+        """
+        Calculate c(t) for several values of kT and of the height of the
+        first hill, from a single bias matrix.
+
+        The heights only rescale the part of the bias due to the hills, and
+        kT only enters the self consistent equation, so for each point the
+        matrix is exp(-gamma*B), with gamma=scale/kT, times a factor for each
+        column. The points sharing the same gamma (e.g. the same temperature)
+        are solved together, with a single matrix-matrix product at each
+        iteration. The options of the self consistent cycle (iterations,
+        tolerance, solver, block_size) are the same as calculate_c_t.
+
+        Parameters
+        ----------
+        kT_values : the values of kT (a number or an array)
+        starting_heights : the heights of the first hill, to which the heights
+                           are rescaled (a number or an array broadcastable
+                           with kT_values). If None, the heights are not
+                           rescaled.
+
+        Returns
+        -------
+        ct : a n_points*n_evals array with c(t) for each pair of kT and
+             starting height, in the order of the flattened broadcast arrays
+        """
+        if self.n_walkers > 1:
+            raise ValueError("The scan is not available for multiple walkers")
+        if self.boundary_lengths is None:
+            self.set_boundaries()
+        if not self.has_matrix:
+            self.__setattr__('beta',1/self.kT)
+            self.bias_matrix=self.__cached_bias_matrix()
+            self.instantaneous_bias = np.array(self.bias_matrix.diagonal(),dtype=np.float64)
+
+        if starting_heights is None:
+            starting_heights = self.heights[0]
+        kT_values,starting_heights = np.broadcast_arrays(np.atleast_1d(kT_values),
+                                                         np.atleast_1d(starting_heights))
+        # a grid of values is flattened in a list of points
+        kT_values = np.array(kT_values,dtype=np.float64).reshape(-1)
+        scales = np.array(starting_heights,dtype=np.float64).reshape(-1)/self.heights[0]
+        betas = 1/kT_values
+        n_points = len(kT_values)
+
+        # the wall does not scale with the heights
+        wall = np.zeros(self.n_evals)
+        if self.wall is not None:
+            wall = np.asarray(self.wall,dtype=np.float64)[self.__evaluation_frames()]
+        if self.has_thetas:
+            wall = wall/(2.0 if self.has_residual else 1.0)
+        instantaneous = scales[:,np.newaxis]*(self.instantaneous_bias-wall)+wall
+
+        gammas,groups = np.unique(scales*betas,return_inverse=True)
+        groups = np.reshape(groups,-1)
+        printitre("Solving c(t) for {} points with {} different matrices"\
+                  .format(n_points,len(gammas)))
+        # exp(-gamma*B) with the wall correction moved on the vector
+        lagged_dots = [self.__lagged_dot(self.bias_matrix,-gamma) for gamma in gammas]
+        column_factors = np.exp((scales*betas)[:,np.newaxis]*wall-betas[:,np.newaxis]*wall)
+
+        ct = np.zeros((n_points,self.n_evals))
+        self.ct_residuals = []
+        self.converged = False
+        mixing = AndersonMixing(self.mixing_depth)
+        for iteration in range(1,self.iterations):
+            vec1 = np.exp(betas[:,np.newaxis]*(instantaneous-ct))
+            res = np.zeros((n_points,self.n_evals))
+            for group,dot in enumerate(lagged_dots):
+                members = np.where(groups==group)[0]
+                res[members] = dot((vec1[members]*column_factors[members]).T).T
+            norm = np.cumsum(vec1,axis=1)
+            mapped = -kT_values[:,np.newaxis]*np.log(res/norm)
+
+            residual = np.amax(np.abs(mapped-ct))
+            if self.solver == 'anderson':
+                if len(self.ct_residuals) > 0 and residual > self.ct_residuals[-1]:
+                    mixing.reset()
+                ct = np.reshape(mixing.step(ct.reshape(-1),mapped.reshape(-1)),ct.shape)
+            else:
+                ct = mapped
+            self.ct_residuals.append(residual)
+            printitre(" Done iteration n {}, max |dc(t)| = {}".format(iteration,residual))
+            self.timings.progress(iteration,self.iterations-1)
+            if self.tolerance is not None and residual < self.tolerance:
+                self.converged = True
+                printitre("Converged after {} iterations".format(iteration))
+                break
+
+        self.ct_residuals = np.array(self.ct_residuals)
+        self.__setattr__('scan_ct',ct)
+        printitre("Finished, c(t) calculated for all the points!")
+        printitre("")
+        return ct
+
+    def __frame_log_weights(self,bias=None):
+        """
+        The frames in which the weights are evaluated and the function
+        returning their log weights by chunks (see weights).
+        """
+        if self.n_walkers > 1:
+            raise ValueError("The weights are not available for multiple walkers")
+        if getattr(self,'ct',None) is None:
+            raise ValueError("c(t) has not been calculated, run calculate_c_t first")
+        eval_frames = self.__evaluation_frames()
+        ct = np.asarray(self.ct[-1],dtype=np.float64)
+        if bias is None:
+            frames = eval_frames
+            bias = self.instantaneous_bias
+        else:
+            frames = np.arange(len(bias))
+
+        def weights_of(start,stop):
+            return log_weights(bias[start:stop],
+                               interpolate_ct(ct,eval_frames,frames[start:stop]),
+                               self.beta)
+        return frames,weights_of
+
+    def weights(self,bias=None,log=False):
+        """
+        The weights exp(beta*(V(s,t)-c(t))) of the frames of the trajectory,
+        with c(t) interpolated linearly between the evaluated frames.
+
+        Parameters
+        ----------
+        bias : the instantaneous bias V(s,t) in each frame (e.g. the bias
+               written by PLUMED in the COLVAR file). If None, only the
+               evaluated frames (see schedule) are weighted, with the
+               instantaneous bias calculated by Itre.
+        log : if True, return the logarithm of the weights
+
+        Returns
+        -------
+        weights : the weights of the frames, relative to the largest one
+                  (or their logarithm, without any shift)
+        """
+        frames,weights_of = self.__frame_log_weights(bias)
+        log_w = weights_of(0,len(frames))
+        if log:
+            return log_w
+        return np.exp(log_w-np.amax(log_w))
+
+    def free_energy(self,cvs=None,bins=50,ranges=None,bias=None,bandwidth=None,chunk_size=100000):
+        """
+        Estimate the free energy surface as a function of some CVs, from the
+        weights of the frames (see weights). The frames are processed in
+        chunks of chunk_size, so that chunk_size sets the memory used, and
+        the weighted counts are accumulated in the log domain, so that they
+        never overflow.
+
+        Parameters
+        ----------
+        cvs : the CVs on which the free energy is estimated, with a row for
+              each frame of the trajectory (it can be a memory map). If
+              None, the colvars are used.
+        bins : the number of bins along each CV (a number or a list)
+        ranges : the [min,max] of each CV. If None, the range of the data.
+        bias : the instantaneous bias in each frame (see weights)
+        bandwidth : if None, a weighted histogram is accumulated. Otherwise
+                    a Gaussian kernel density estimate with this width along
+                    each CV is evaluated on the centers of the bins.
+        chunk_size : the number of frames processed at once
+
+        Returns
+        -------
+        fes : the free energy -kT*log(p), with its minimum at zero (inf in
+              the empty bins), shaped as the grid
+        centers : a list with the centers of the bins along each CV
+        """
+        frames,weights_of = self.__frame_log_weights(bias)
+        if cvs is None:
+            cvs = self.colvars
+        if np.ndim(cvs) == 1:
+            cvs = np.reshape(cvs,(-1,1))
+        if bias is None:
+            # only the evaluated frames are weighted
+            cvs = np.asarray(cvs[frames])
+        elif len(cvs) < len(frames):
+            raise ValueError("The CVs have {} frames, but the bias has {}"\
+                             .format(len(cvs),len(frames)))
+        cvs = cvs[:len(frames)]
+
+        edges = grid_edges(cvs,bins,ranges,chunk_size)
+        centers = [0.5*(el[1:]+el[:-1]) for el in edges]
+        if bandwidth is None:
+            log_counts = log_histogram(cvs,weights_of,edges,chunk_size)
+        else:
+            log_counts = log_kde(cvs,weights_of,centers,bandwidth,chunk_size)
+        fes = -self.kT*log_counts
+        return fes-np.amin(fes),centers
+
+    @timed
+    def bootstrap_c_t(self,n_replicas=100,block_length=None,confidence=0.95,seed=None):
+        """
+        Estimate the uncertainty of c(t) with a block bootstrap. The evaluated
+        frames are divided in blocks of block_length consecutive frames, and
+        each replica draws with replacement as many blocks as there are. A
+        replica only changes how many times each frame enters the sums of
+        the self consistent equation, so all the replicas are solved with
+        the bias matrix already calculated (a single matrix, shared by the
+        n_threads threads that solve the replicas concurrently). The options
+        of the self consistent cycle are the same as calculate_c_t.
+
+        The replicas are stored in self.bootstrap_ct, where c(t) is nan
+        before the first frame drawn by the replica, and the number of times
+        each block has been drawn in self.bootstrap_counts.
+
+        Parameters
+        ----------
+        n_replicas : the number of bootstrap replicas
+        block_length : the number of evaluated frames in a block. If None,
+                       n_evals**(1/3), rounded.
+        confidence : the fraction of the replicas within the band
+        seed : the seed of the random generator
+
+        Returns
+        -------
+        lower, upper : the limits of the percentile confidence band of c(t)
+        """
+        if self.n_walkers > 1:
+            raise ValueError("The bootstrap is not available for multiple walkers")
+        if getattr(self,'ct',None) is None:
+            self.calculate_c_t()
+        if block_length is None:
+            block_length = max(int(round(self.n_evals**(1.0/3.0))),1)
+        block_length = int(block_length)
+        if block_length < 1 or block_length > self.n_evals:
+            raise ValueError("block_length has to be between 1 and {}".format(self.n_evals))
+
+        n_blocks = -(-self.n_evals//block_length)
+        rng = np.random.default_rng(seed)
+        draws = rng.integers(n_blocks,size=(int(n_replicas),n_blocks))
+        block_counts = np.array([np.bincount(el,minlength=n_blocks) for el in draws])
+        frame_blocks = np.arange(self.n_evals)//block_length
+        printitre("Solving c(t) for {} bootstrap replicas of {} blocks of {} evaluated frames"\
+                  .format(n_replicas,n_blocks,block_length))
+
+        instantaneous = np.asarray(self.instantaneous_bias,dtype=np.float64)
+        if self.log_domain:
+            log_dot = self.__lagged_log_dot(self.bias_matrix,instantaneous)
+        else:
+            lagged_dot = self.__lagged_dot(self.bias_matrix)
+
+        def replica_ct(counts):
+            multiplicity = counts[frame_blocks].astype(np.float64)
+            sampled = np.cumsum(multiplicity) > 0
+            ct = np.zeros(self.n_evals)
+            residuals = []
+            converged = False
+            mixing = AndersonMixing(self.mixing_depth)
+            # the rows before the first drawn frame have no frame to average
+            with np.errstate(divide='ignore',invalid='ignore'):
+                for iteration in range(1,self.iterations):
+                    offset = instantaneous-ct
+                    if self.log_domain:
+                        log_res = log_dot(np.log(multiplicity)-self.beta*ct)
+                        log_norm = np.logaddexp.accumulate(offset*self.beta+np.log(multiplicity))
+                        mapped = -self.kT*(log_res-log_norm)
+                    else:
+                        vec1 = multiplicity*np.exp(offset*self.beta)
+                        mapped = -self.kT*np.log(lagged_dot(vec1)/np.cumsum(vec1))
+                    mapped[~sampled] = 0.0
+
+                    residual = np.amax(np.abs(mapped-ct))
+                    if self.solver == 'anderson':
+                        if len(residuals) > 0 and residual > residuals[-1]:
+                            mixing.reset()
+                        ct = mixing.step(ct,mapped)
+                    else:
+                        ct = mapped
+                    residuals.append(residual)
+                    if self.tolerance is not None and residual < self.tolerance:
+                        converged = True
+                        break
+            ct[~sampled] = np.nan
+            return ct,converged
+
+        replicas = np.zeros((int(n_replicas),self.n_evals))
+        n_converged = 0
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+            for replica,(ct,converged) in enumerate(executor.map(replica_ct,block_counts)):
+                replicas[replica] = ct
+                n_converged += converged
+                self.timings.progress(replica+1,n_replicas)
+        if self.tolerance is not None and n_converged < n_replicas:
+            printitre("WARNING: c(t) did not converge within {} iterations in {} replicas"\
+                      .format(self.iterations,n_replicas-n_converged),logging.WARNING)
+
+        self.__setattr__('bootstrap_ct',replicas)
+        self.__setattr__('bootstrap_counts',block_counts)
+        self.__setattr__('bootstrap_block_length',block_length)
+        printitre("Finished, bootstrap replicas of c(t) calculated!")
+        printitre("")
+        return confidence_band(replicas,confidence)
+
+    @timed
+    def bootstrap_average(self,observable,bias=None,confidence=0.95):
+        """
+        The reweighted average of an observable, with the confidence band
+        given by the replicas of bootstrap_c_t: in each replica the frames
+        are weighted (see weights) with the c(t) of the replica, times the
+        number of times their block has been drawn. The replicas are averaged
+        concurrently by n_threads threads.
+
+        Parameters
+        ----------
+        observable : the value of the observable in each frame (or the
+                     n_frames*n_observables values of several observables).
+                     Without bias, only the evaluated frames are used.
+        bias : the instantaneous bias in each frame (see weights)
+        confidence : the fraction of the replicas within the band
+
+        Returns
+        -------
+        average : the reweighted average, with the c(t) of calculate_c_t
+        lower, upper : the limits of the percentile confidence band
+        """
+        if self.bootstrap_ct is None:
+            raise ValueError("The bootstrap replicas have not been calculated, \
+run bootstrap_c_t first")
+        frames,weights_of = self.__frame_log_weights(bias)
+        values = np.asarray(observable,dtype=np.float64)
+        if bias is None:
+            values = values[frames] if len(values) > self.n_evals else values
+            bias = self.instantaneous_bias
+        if len(values) < len(frames):
+            raise ValueError("The observable has {} frames, but the bias has {}"\
+                             .format(len(values),len(frames)))
+        values = values[:len(frames)]
+        bias = np.asarray(bias[:len(frames)],dtype=np.float64)
+
+        eval_frames = self.__evaluation_frames()
+        # each frame belongs to the block of the last evaluation before it
+        frame_blocks = (np.searchsorted(eval_frames,frames,side='right')-1)//self.bootstrap_block_length
+
+        def average(log_w):
+            w = np.exp(log_w-np.amax(log_w))
+            return w.dot(values)/np.sum(w)
+
+        def replica_average(replica):
+            multiplicity = self.bootstrap_counts[replica][frame_blocks]
+            drawn = multiplicity > 0
+            log_w = np.full(len(frames),-np.inf)
+            ct = self.bootstrap_ct[replica]
+            sampled = np.isfinite(ct)
+            log_w[drawn] = log_weights(bias[drawn],interpolate_ct(ct[sampled],eval_frames[sampled],
+                                                                  frames[drawn]),
+                                       self.beta)+np.log(multiplicity[drawn])
+            return average(log_w)
+
+        estimate = average(weights_of(0,len(frames)))
+        n_replicas = len(self.bootstrap_ct)
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+            replicas = np.array(list(executor.map(replica_average,range(n_replicas))))
+        lower,upper = confidence_band(replicas,confidence)
+        return estimate,lower,upper
+
+    @timed
+    def extend(self,colvars,sigmas,heights,wall=None,thetas=None):
+        """
+        Append new frames to the trajectory and update the bias matrix and
+        c(t). The bias matrix already calculated is kept: only the new rows
+        and columns corresponding to the new evaluations are calculated
+        (with numpy, independently of the engine), and the self consistent
+        cycle is started from the previous c(t). If nothing has been
+        calculated yet, the whole calculation is performed.
+
+        The boundaries of the CVs are not updated, so they should be set
+        for the whole trajectory (e.g. with set_boundaries) beforehand.
+
+        Parameters
+        ----------
+        colvars : the values of the collective variables of the new frames
+        sigmas : the covariances of the hills deposited in the new frames
+        heights : the heights of the hills deposited in the new frames, with
+                  the same normalization as the heights attribute
+        wall : the values of the restraint in the new frames (zero if None)
+        thetas : for an ATLAS calculation, the activation functions of the
+                 new frames
+        """
+        if self.n_walkers > 1:
+            raise ValueError("Multiple walkers calculations cannot be extended")
+        if self.hill_times is not None:
+            raise ValueError("The calculations with a hills_file cannot be extended")
+        if wall is None:
+            wall = np.zeros(len(colvars))
+
+        for name,array in [('sigmas',sigmas),('heights',heights),('wall',wall)]:
+            if len(colvars)!=len(array):
+                raise ValueError('Length of colvars and {} is different!'.format(name))
+        if self.has_thetas:
+            if thetas is None:
+                raise ValueError('An ATLAS calculation requires the new thetas!')
+            if len(colvars)!=len(thetas):
+                raise ValueError('Length of colvars and thetas is different!')
+
+        if self.boundary_lengths is not None:
+            new_colvars = np.reshape(colvars,(len(colvars),-1))
+            if np.any(new_colvars < self.boundaries[0::2]) or \
+               np.any(new_colvars > self.boundaries[1::2]):
+                printitre("WARNING: the new colvars are outside the boundaries, \
+which are not updated by extend!",logging.WARNING)
+
+        bias_matrix = getattr(self,'bias_matrix',None)
+        ct = getattr(self,'ct',None)
+
+        if self.colvars is None:
+            self.__setattr__('colvars',np.array(colvars))
+            self.__setattr__('sigmas',np.array(sigmas))
+            self.__setattr__('heights',np.array(heights))
+            self.__setattr__('wall',np.array(wall))
+            if self.has_thetas:
+                self.__setattr__('thetas',np.array(thetas))
+        else:
+            self.__setattr__('colvars',np.concatenate((self.colvars,colvars)))
+            self.__setattr__('sigmas',np.concatenate((self.sigmas,sigmas)))
+            self.__setattr__('heights',np.concatenate((self.heights,heights)))
+            if self.wall is None:
+                self.__setattr__('wall',np.zeros(len(self.colvars)-len(wall)))
+            self.__setattr__('wall',np.concatenate((self.wall,wall)))
+            if self.has_thetas:
+                self.__setattr__('thetas',np.concatenate((self.thetas,thetas)))
+
+        n_old = self.n_evals
+        self.__setattr__('steps',len(self.colvars))
+        if self.eval_frames is None:
+            self.__setattr__('n_evals',int(self.steps//self.stride))
+        else:
+            # the new frames are evaluated every stride frames after the last one
+            frames = self.__evaluation_frames()
+            frames = np.concatenate((frames,uniform_frames(self.steps,self.stride,
+                                                           frames[-1]+self.stride)))
+            self.__setattr__('eval_frames',frames)
+            self.__setattr__('n_evals',len(frames))
+
+        if not self.has_matrix or bias_matrix is None or ct is None or n_old == 0:
+            self.__setattr__('has_matrix',False)
+            self.calculate_c_t()
+            return
+
+        if self.n_evals == n_old:
+            printitre("No new evaluation of c(t) is required.")
+            return
+
+        printitre("Extending the bias matrix from {} to {} evaluations"\
+                  .format(n_old,self.n_evals))
+        if self.has_thetas:
+            residual_weights = 0.0
+            if self.has_residual:
+                residual_weights = 1.0
+            bias_matrix = Atlas().extend_bias_matrix(bias_matrix,
+                                                     self.colvars,
+                                                     self.boundary_lengths,
+                                                     self.sigmas,
+                                                     self.heights,
+                                                     self.wall,
+                                                     self.thetas,
+                                                     self.n_evals,
+                                                     self.__evaluation_frames(),
+                                                     residual_weights)
+        else:
+            bias_matrix = Metadynamics().extend_bias_matrix(bias_matrix,
+                                                            self.colvars,
+                                                            self.boundary_lengths,
+                                                            self.sigmas,
+                                                            self.heights,
+                                                            self.wall,
+                                                            self.n_evals,
+                                                            self.__evaluation_frames())
+        self.bias_matrix = bias_matrix
+        self.instantaneous_bias = np.array(self.bias_matrix.diagonal(),dtype=np.float64)
+
+        initial_ct = np.full(self.n_evals,ct[-1][-1])
+        initial_ct[:n_old] = ct[-1]
+        self.calculate_c_t(initial_ct)
+
 
 if __name__ == '__main__':
-    printitre("A __main__ implementation is still missing")
-    printitre("please implement it or use it as a module.")
+    printitre("Run ITRE from the command line with python -m itre,")
+    printitre("see python -m itre --help.")
@@ -0,0 +1,224 @@
+import io
+import os
+import time
+import warnings
+import numpy as np
+from .core import Itre
+from .loader import field_columns
+from .hills import covariance_matrices
+from .utils import printitre, savetxt_atomic
+
+
+class FileTail(object):
+    """This class keeps track of the position reached in a text file that is
+       still being written, so that only the lines appended since the last
+       read are parsed. If columns is given, only those columns are
+       returned."""
+    def __init__(self,filename,columns=None):
+        super(FileTail, self).__init__()
+        self.filename = filename
+        self.columns = columns
+        self.offset = 0
+
+    def read(self):
+        """
+        Parse the complete lines appended to the file since the last call.
+        A line that is still being written (i.e. without a newline) is left
+        for the next call. Comments (lines starting with #) are skipped.
+
+        Returns
+        -------
+        data : a float array with the new rows, or None if there are none
+        """
+        size = os.path.getsize(self.filename)
+        if size < self.offset:
+            raise ValueError("{} has been truncated, it cannot be followed"\
+                             .format(self.filename))
+
+        with open(self.filename,'rb') as file_in:
+            file_in.seek(self.offset)
+            chunk = file_in.read(size-self.offset)
+
+        end = chunk.rfind(b'\n')+1
+        if end == 0:
+            return None
+        self.offset += end
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore',UserWarning)
+            data = np.loadtxt(io.BytesIO(chunk[:end]),ndmin=2)
+
+        if data.size == 0:
+            return None
+        if self.columns is not None:
+            data = data[:,self.columns]
+        if data.shape[1] == 1:
+            data = data[:,0]
+
+        return data
+
+
+class Follow(object):
+    """ This class follows the files written by a running simulation (e.g.
+    the COLVAR, HILLS and THETA files written by PLUMED) and updates the bias
+    matrix and c(t) as new frames are appended.
+
+    It is driven by the same json directives accepted by Itre.from_dict. The
+    files are read from the offset reached in the previous update, so that
+    only the new lines are parsed, and the new frames are passed to
+    Itre.extend. After each update c(t) and the instantaneous bias are
+    written (atomically) in output_dir as c_t.dat and instantaneous_bias.dat.
+
+    The boundaries of the CVs are fixed at the first update, so for non
+    periodic CVs it is better to provide them with the boundaries directives.
+    The hills of a hills_file cannot be followed, since the calculations
+    that read them cannot be extended.
+    """
+    def __init__(self,directives,output_dir='.'):
+        super(Follow, self).__init__()
+        self.itre = Itre()
+        self.itre.set_directives(directives)
+        if self.itre.hills_file is not None:
+            raise ValueError("A hills_file cannot be followed, give the colvars, sigmas \
+and heights files instead")
+        if self.itre.sigmas_format not in ['sigma','covariance']:
+            raise ValueError("Unknown sigmas_format {}, use sigma or covariance"\
+                             .format(self.itre.sigmas_format))
+        self.output_dir = output_dir
+        self.heights_scale = None
+
+        self.tails = {}
+        for name in ['colvars','sigmas','heights','thetas','wall']:
+            filename = getattr(self.itre,'{}_file'.format(name))
+            if filename is not None:
+                columns = field_columns(filename,getattr(self.itre,'{}_fields'.format(name)))
+                self.tails[name] = FileTail(filename,columns)
+        if 'thetas' in self.tails:
+            self.itre.has_thetas = True
+        self.pending = dict.fromkeys(self.tails)
+
+        if self.itre.boundaries_file is not None:
+            self.boundaries = np.loadtxt(self.itre.boundaries_file)
+        else:
+            self.boundaries = self.itre.boundaries
+
+    def __read_new_frames(self):
+        """
+        Read the new lines of all the followed files and return the number
+        of frames that are complete, i.e. present in all the files.
+        """
+        for name,tail in self.tails.items():
+            new = tail.read()
+            if new is None:
+                continue
+            if self.pending[name] is None:
+                self.pending[name] = new
+            else:
+                self.pending[name] = np.concatenate((self.pending[name],new))
+
+        return min([0 if el is None else len(el) for el in self.pending.values()])
+
+    def __pending_frames(self,n_frames):
+        """
+        Return the first n_frames complete frames, with the heights
+        rescaled and the covariance matrices built from the columns of the
+        sigmas file, without removing them from the pending ones.
+        """
+        frames = dict.fromkeys(['colvars','sigmas','heights','thetas','wall'])
+        for name in self.tails:
+            frames[name] = self.pending[name][:n_frames]
+
+        if self.itre.sigmas_format == 'covariance':
+            colvars = frames['colvars']
+            n_cvs = 1 if np.ndim(colvars) == 1 else np.shape(colvars)[1]
+            frames['sigmas'] = covariance_matrices(frames['sigmas'],n_cvs)
+            if n_cvs == 1:
+                frames['sigmas'] = np.sqrt(frames['sigmas']).reshape(np.shape(colvars))
+
+        if self.heights_scale is None:
+            self.heights_scale = self.itre.starting_height/frames['heights'][0]
+        frames['heights'] = frames['heights']*self.heights_scale
+
+        return frames
+
+    def __consume_frames(self,n_frames):
+        """Remove the first n_frames frames from the pending ones."""
+        for name in self.tails:
+            self.pending[name] = self.pending[name][n_frames:]
+
+    def update(self):
+        """
+        Read the frames appended to the files since the last update and
+        update the bias matrix and c(t). Until the frames are enough for a
+        first evaluation of c(t), they are kept for the next update.
+
+        Returns
+        -------
+        n_new : the number of new evaluations of c(t)
+        """
+        n_frames = self.__read_new_frames()
+        if n_frames == 0:
+            return 0
+        frames = self.__pending_frames(n_frames)
+
+        it = self.itre
+        if it.colvars is None:
+            it.colvars = frames['colvars']
+            it.sigmas = frames['sigmas']
+            it.heights = frames['heights']
+            it.wall = frames['wall']
+            if it.wall is None:
+                it.wall = np.zeros(n_frames)
+            if it.has_thetas:
+                it.thetas = frames['thetas']
+            it.steps = n_frames
+            it.set_schedule()
+            if it.n_evals == 0:
+                printitre("{} frames are not enough to evaluate c(t), waiting for more"\
+                          .format(n_frames))
+                it.colvars = None
+                return 0
+            self.__consume_frames(n_frames)
+            it.set_boundaries(self.boundaries)
+            it.calculate_c_t()
+            return it.n_evals
+
+        self.__consume_frames(n_frames)
+        n_old = it.n_evals
+        it.extend(frames['colvars'],frames['sigmas'],frames['heights'],
+                  frames['wall'],frames['thetas'])
+        return it.n_evals-n_old
+
+    def write(self):
+        """
+        Write c(t) and the instantaneous bias in output_dir. The files are
+        replaced atomically, so they can be read at any time.
+        """
+        savetxt_atomic(os.path.join(self.output_dir,'c_t.dat'),self.itre.ct[-1])
+        savetxt_atomic(os.path.join(self.output_dir,'instantaneous_bias.dat'),
+                       self.itre.instantaneous_bias)
+
+    def run(self,interval=60.0,max_updates=None):
+        """
+        Update c(t) every interval seconds, writing the output files every
+        time new evaluations are available. Stops after max_updates updates
+        (never if None) or on a KeyboardInterrupt.
+
+        Parameters
+        ----------
+        interval : the time in seconds between two updates
+        max_updates : the maximum number of updates to perform
+        """
+        n_updates = 0
+        try:
+            while max_updates is None or n_updates < max_updates:
+                n_new = self.update()
+                n_updates += 1
+                if n_new > 0:
+                    self.write()
+                    printitre("Update {}: {} new evaluations, {} in total"\
+                              .format(n_updates,n_new,self.itre.n_evals))
+                if max_updates is None or n_updates < max_updates:
+                    time.sleep(interval)
+        except KeyboardInterrupt:
+            printitre("Stopped following the files.")
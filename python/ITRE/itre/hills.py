@@ -0,0 +1,157 @@
+import numpy as np
+from .loader import read_fields, read_settings, load_columns
+
+
+def is_covariance(sigmas):
+    """Whether the hills have full covariance matrices (n_hills*n_cvs*n_cvs)
+       rather than a sigma per CV."""
+    return np.ndim(sigmas) == 3
+
+
+def covariance_matrices(columns,n_cvs):
+    """
+    Build the covariance matrix of each hill from the columns of a file,
+    which contain either all its n_cvs*n_cvs elements or its lower triangle
+    (n_cvs*(n_cvs+1)/2 elements), row by row.
+
+    Returns
+    -------
+    covariances : a n_hills*n_cvs*n_cvs array
+    """
+    columns = np.asarray(columns,dtype=np.float64).reshape(len(columns),-1)
+    if columns.shape[1] == n_cvs*n_cvs:
+        return columns.reshape(-1,n_cvs,n_cvs).copy()
+    if columns.shape[1] != n_cvs*(n_cvs+1)//2:
+        raise ValueError("The covariance of {} CVs needs {} or {} columns, not {}"\
+                         .format(n_cvs,n_cvs*n_cvs,n_cvs*(n_cvs+1)//2,columns.shape[1]))
+    covariances = np.zeros((len(columns),n_cvs,n_cvs))
+    rows,cols = np.tril_indices(n_cvs)
+    covariances[:,rows,cols] = columns
+    covariances[:,cols,rows] = columns
+    return covariances
+
+
+def inverse_cholesky(covariances):
+    """
+    The inverse of the Cholesky factor L of each covariance matrix
+    (covariance = L.L^T), so that the squared distance from the center of a
+    hill is |L^-1.x|^2. The factors are lower triangular and computed for
+    all the hills at once.
+
+    Parameters
+    ----------
+    covariances : a n_hills*dims*dims array of symmetric positive definite
+                  matrices
+
+    Returns
+    -------
+    factors : a n_hills*dims*dims array
+    """
+    try:
+        factors = np.linalg.cholesky(np.asarray(covariances,dtype=np.float64))
+    except np.linalg.LinAlgError:
+        raise ValueError("The covariance matrices of the hills must be positive definite")
+    return np.ascontiguousarray(np.tril(np.linalg.inv(factors)))
+
+
+def hill_widths(sigmas,dims=None):
+    """
+    The widths of the hills used by the kernels: the sigmas themselves, or
+    for full covariances the inverse Cholesky factors of their diagonal
+    blocks of dims CVs (all the CVs if None), e.g. the local CVs of each
+    minimum of ATLAS. The factors are stacked along the CVs, so that the
+    widths of the CVs start:end are widths[:,start:end] in both cases.
+
+    Returns
+    -------
+    widths : sigmas, or a n_hills*n_cvs*dims array of factors
+    """
+    if not is_covariance(sigmas):
+        return sigmas
+    sigmas = np.asarray(sigmas,dtype=np.float64)
+    n_cvs = sigmas.shape[1]
+    if dims is None:
+        dims = n_cvs
+    return np.concatenate([inverse_cholesky(sigmas[:,start:start+dims,start:start+dims])
+                           for start in range(0,n_cvs,dims)],axis=1)
+
+
+def whiten(comp,widths):
+    """
+    Divide the displacements from the centers of the hills by their sigmas,
+    or multiply them by the inverse Cholesky factors of their covariances
+    (see hill_widths), so that the squared distance is the squared norm of
+    the result.
+    """
+    if np.ndim(widths) == np.ndim(comp)+1:
+        return np.matmul(widths,comp[...,np.newaxis])[...,0]
+    return comp/widths
+
+
+def read_hills(filename,cv_fields=None,sidecar=True):
+    """
+    Read the hills deposited by a Metadynamics run from a HILLS file written
+    by PLUMED, i.e. the time, the center and the sigmas of each hill, its
+    height and the bias factor. In a well-tempered run PLUMED writes the
+    heights multiplied by biasf/(biasf-1), which is removed here.
+
+    Parameters
+    ----------
+    filename : the HILLS file
+    cv_fields : the names of the CVs. If None, all the fields with a
+                sigma_ field are taken as CVs.
+    sidecar : whether to use the binary copy of the file (see load_columns)
+
+    Returns
+    -------
+    times : the time in which each hill has been deposited
+    centers : the n_hills*n_cvs centers of the hills
+    sigmas : the n_hills*n_cvs sigmas of the hills
+    heights : the heights of the hills
+    """
+    names = read_fields(filename)
+    if names is None:
+        raise ValueError("{} has no #! FIELDS header".format(filename))
+    if read_settings(filename).get('multivariate','false') == 'true':
+        raise ValueError("The multivariate hills of {} are not supported, write \
+their covariances in a sigmas file (see sigmas_format)".format(filename))
+    if cv_fields is None:
+        cv_fields = [name for name in names if 'sigma_{}'.format(name) in names]
+    if isinstance(cv_fields,str):
+        cv_fields = [cv_fields]
+    fields = ['time']+list(cv_fields)+['sigma_{}'.format(name) for name in cv_fields]+['height']
+    if 'biasf' in names:
+        fields.append('biasf')
+    table = load_columns(filename,fields,sidecar)
+
+    n_cvs = len(cv_fields)
+    times = table[:,0]
+    centers = table[:,1:n_cvs+1]
+    sigmas = table[:,n_cvs+1:2*n_cvs+1]
+    heights = table[:,2*n_cvs+1]
+    if 'biasf' in names:
+        biasf = table[:,2*n_cvs+2]
+        heights = np.where(biasf > 1.0,heights*(biasf-1.0)/np.maximum(biasf,1.0),heights)
+    if np.any(np.diff(times) < 0):
+        raise ValueError("The hills of {} are not sorted in time".format(filename))
+    return times,centers,sigmas,heights
+
+
+def deposited_hills(hill_times,times):
+    """
+    The number of hills deposited before each of the times, i.e. the hills
+    in the bias acting at that time: PLUMED adds a hill after the bias of
+    the step in which it is deposited has been calculated. The times are
+    compared up to a small fraction of their spacing, since the files print
+    them with a finite precision.
+
+    Returns
+    -------
+    counts : the number of hills before each time, as an int64 array
+    """
+    times = np.asarray(times,dtype=np.float64)
+    spacing = np.diff(times)
+    spacing = spacing[spacing > 0]
+    tolerance = 1e-3*np.amin(spacing) if len(spacing) > 0 else 0.0
+    return np.searchsorted(np.asarray(hill_times,dtype=np.float64),
+                           times-tolerance,side='left').astype(np.int64)
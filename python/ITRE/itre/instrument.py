@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from .utils import logger, atomic_file
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def current_rss():
+    """The resident memory of the process in MB (None if unknown)."""
+    try:
+        with open('/proc/self/statm','r') as file_in:
+            pages = int(file_in.read().split()[1])
+        return pages*os.sysconf('SC_PAGE_SIZE')/2**20
+    except (OSError,ValueError,IndexError,AttributeError):
+        return None
+
+
+def peak_rss():
+    """The peak resident memory of the process in MB (None if unknown)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kB elsewhere
+    if os.uname().sysname == 'Darwin':
+        return peak/2**20
+    return peak/2**10
+
+
+class Instrumentation(object):
+    """This class collects where the time goes in a calculation: the wall
+       and CPU time of each phase (e.g. loading the files, building the bias
+       matrix, the c(t) iterations), the number of kernel evaluations (the
+       pairs of reference frame and hill evaluated by the engines) and the
+       largest resident memory sampled during each phase (at its end and
+       whenever its progress is reported).
+
+       The engines report their progress, which is logged at the DEBUG
+       level and passed to an optional callback every progress_every
+       steps."""
+    def __init__(self,callback=None,progress_every=None):
+        """
+        Parameters
+        ----------
+        callback : a function called as callback(phase,done,total,elapsed)
+                   while a phase progresses. done and total count the
+                   reference frames while the bias matrix is built, the
+                   tiles for the tiled engine and the iterations for c(t).
+        progress_every : the number of steps between two calls of callback
+                         (every step if None)
+        """
+        super(Instrumentation, self).__init__()
+        self.callback = callback
+        self.progress_every = progress_every
+        self.phases = {}
+        self.kernel_evaluations = 0
+        self.__stack = []
+        self.__reported = {}
+        self.__lock = threading.Lock()
+
+    def __entry(self,name):
+        if name not in self.phases:
+            self.phases[name] = {'calls':0,'wall_time':0.0,'self_wall_time':0.0,
+                                 'cpu_time':0.0,'kernel_evaluations':0,'max_rss_mb':None}
+        return self.phases[name]
+
+    @contextmanager
+    def phase(self,name):
+        """
+        Context manager timing a phase. The phases can be nested: the
+        wall_time of a phase includes the phases nested in it, while its
+        self_wall_time does not.
+        """
+        entry = self.__entry(name)
+        # the name, the start and the time spent in the nested phases
+        frame = [name,time.perf_counter(),0.0]
+        self.__stack.append(frame)
+        cpu_start = time.process_time()
+        logger.debug("Started {}".format(name))
+        try:
+            yield entry
+        finally:
+            self.__stack.pop()
+            elapsed = time.perf_counter()-frame[1]
+            entry['calls'] += 1
+            entry['wall_time'] += elapsed
+            entry['self_wall_time'] += elapsed-frame[2]
+            entry['cpu_time'] += time.process_time()-cpu_start
+            self.__sample_memory(entry)
+            if len(self.__stack) > 0:
+                self.__stack[-1][2] += elapsed
+            logger.debug("Finished {} in {:.3f} s".format(name,elapsed))
+
+    def __sample_memory(self,entry):
+        rss = current_rss()
+        if rss is not None and (entry['max_rss_mb'] is None or rss > entry['max_rss_mb']):
+            entry['max_rss_mb'] = rss
+
+    def running(self):
+        """Whether a phase is being timed."""
+        return len(self.__stack) > 0
+
+    def count(self,n_evaluations):
+        """Add n_evaluations kernel evaluations to the total and to the current phase."""
+        with self.__lock:
+            self.kernel_evaluations += int(n_evaluations)
+            if len(self.__stack) > 0:
+                self.phases[self.__stack[-1][0]]['kernel_evaluations'] += int(n_evaluations)
+
+    def progress(self,done,total):
+        """
+        Report that done steps out of total have been performed in the
+        current phase. The callback is called (and the progress logged)
+        every progress_every steps and at the end of the phase.
+        """
+        if self.callback is None and not logger.isEnabledFor(logging.DEBUG):
+            return
+        name,start = self.__stack[-1][:2] if len(self.__stack) > 0 else (None,None)
+        every = 1 if self.progress_every is None else self.progress_every
+        with self.__lock:
+            last = self.__reported.get(name,0)
+            if done < last:
+                # a new run of the phase
+                last = 0
+            if done-last < every and done < total:
+                return
+            self.__reported[name] = done
+        elapsed = 0.0 if start is None else time.perf_counter()-start
+        if name is not None:
+            self.__sample_memory(self.phases[name])
+        logger.debug("{}: {}/{} in {:.1f} s".format(name,done,total,elapsed))
+        if self.callback is not None:
+            self.callback(name,done,total,elapsed)
+
+    def report(self):
+        """
+        Returns
+        -------
+        a dictionary with the timings of each phase, the kernel evaluations
+        and the peak memory (in MB)
+        """
+        phases = {}
+        for name,entry in self.phases.items():
+            phases[name] = dict(entry)
+            if entry['kernel_evaluations'] > 0 and entry['wall_time'] > 0:
+                phases[name]['evaluations_per_second'] = entry['kernel_evaluations']/entry['wall_time']
+        return {'phases':phases,'kernel_evaluations':self.kernel_evaluations,
+                'peak_rss_mb':peak_rss()}
+
+    def save(self,filename):
+        """Write the report in a json file."""
+        with atomic_file(filename) as file_out:
+            file_out.write(json.dumps(self.report(),indent=1).encode())
+
+
+# the instrumentation to which the engines report, see activate
+_active = [Instrumentation()]
+
+
+def active():
+    """The instrumentation to which the engines report."""
+    return _active[-1]
+
+
+@contextmanager
+def activate(instrumentation):
+    """
+    Context manager making instrumentation the one to which the engines
+    report (see active). Outside of it, the reports are collected by a
+    default instrumentation that nobody reads.
+    """
+    _active.append(instrumentation)
+    try:
+        yield instrumentation
+    finally:
+        _active.remove(instrumentation)
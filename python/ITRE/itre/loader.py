@@ -0,0 +1,172 @@
+import os
+import glob
+import itertools
+import logging
+import numpy as np
+from .utils import printitre, atomic_file
+
+
+def read_fields(filename):
+    """
+    Read the names of the columns from the #! FIELDS header of a file written
+    by PLUMED (e.g. a COLVAR or HILLS file).
+
+    Returns
+    -------
+    fields : the list of the names of the columns, or None if the file has
+             no FIELDS header
+    """
+    with open(filename,'r') as file_in:
+        for line in file_in:
+            if not line.startswith('#'):
+                return None
+            words = line.split()
+            if len(words) > 1 and words[0] == '#!' and words[1] == 'FIELDS':
+                return words[2:]
+    return None
+
+
+def read_settings(filename):
+    """
+    Read the constants written in the #! SET lines of the header of a file
+    written by PLUMED (e.g. the periodicity of the CVs or whether the hills
+    of a HILLS file are multivariate).
+
+    Returns
+    -------
+    settings : a dictionary with the value (as a string) of each constant
+    """
+    settings = {}
+    with open(filename,'r') as file_in:
+        for line in file_in:
+            if not line.startswith('#'):
+                break
+            words = line.split()
+            if len(words) > 3 and words[0] == '#!' and words[1] == 'SET':
+                settings[words[2]] = words[3]
+    return settings
+
+
+def field_columns(filename,fields):
+    """
+    Convert a list of field names (or column indices) in the indices of the
+    corresponding columns of a PLUMED file.
+    """
+    if fields is None:
+        return None
+    if isinstance(fields,(str,int)):
+        fields = [fields]
+
+    names = None
+    columns = []
+    for field in fields:
+        if isinstance(field,(int,np.integer)):
+            columns.append(int(field))
+            continue
+        if names is None:
+            names = read_fields(filename)
+            if names is None:
+                raise ValueError("{} has no #! FIELDS header, select the columns \
+by index".format(filename))
+        if field not in names:
+            raise ValueError("Field {} not found in {}, available fields are {}"\
+                             .format(field,filename,names))
+        columns.append(names.index(field))
+    return columns
+
+
+def parse_text(filename,chunk_size=1000000):
+    """
+    Parse all the numerical rows of a text file, skipping the comments (i.e.
+    the lines starting with #, such as the headers that PLUMED writes again
+    on restart). The file is parsed with the C reader of numpy in chunks of
+    chunk_size lines, so that the text is never held in memory at once.
+
+    Returns
+    -------
+    data : a n_rows*n_columns float array
+    """
+    chunks = []
+    with open(filename,'r') as file_in:
+        while True:
+            lines = list(itertools.islice(file_in,chunk_size))
+            if len(lines) == 0:
+                break
+            chunk = np.loadtxt(lines,ndmin=2)
+            if chunk.size > 0:
+                chunks.append(chunk)
+    if len(chunks) == 0:
+        return np.zeros((0,0))
+    return np.concatenate(chunks)
+
+
+def sidecar_name(filename):
+    """
+    Name of the binary copy of a text file, which encodes the size and the
+    modification time of the text file so that a stale copy is never used.
+    """
+    stat = os.stat(filename)
+    directory,base = os.path.split(os.path.abspath(filename))
+    return os.path.join(directory,'.{}.{}.{}.itre.npy'.format(base,stat.st_size,
+                                                              stat.st_mtime_ns))
+
+
+def load_columns(filename,fields=None,sidecar=True):
+    """
+    Load the columns of a text file, selecting them by name for the files
+    written by PLUMED.
+
+    The first time the file is read, all its numerical columns are saved in
+    a hidden .npy file next to it (the sidecar), named after the size and the
+    modification time of the text file. The following loads memory map the
+    sidecar, so the text is not parsed again until the file changes.
+
+    Parameters
+    ----------
+    filename : the text file
+    fields : the names of the FIELDS (or the indices of the columns) to
+             load. If None, all the columns are loaded.
+    sidecar : whether to read and write the binary sidecar
+
+    Returns
+    -------
+    data : the selected columns. A single column is returned as a 1D array.
+           When all the columns, a single column or a range of consecutive
+           columns are selected, data is a view of the table, i.e. a read
+           only memory map of the sidecar, which is not loaded in memory.
+           Columns in a different order or not consecutive are copied.
+    """
+    columns = field_columns(filename,fields)
+
+    table = None
+    if sidecar:
+        cached = sidecar_name(filename)
+        if os.path.isfile(cached):
+            table = np.load(cached,mmap_mode='r')
+    if table is None:
+        table = parse_text(filename)
+        if sidecar:
+            # remove the copies of previous versions of the file
+            pattern = '.{}.*.itre.npy'.format(glob.escape(os.path.basename(filename)))
+            for stale in glob.glob(os.path.join(os.path.dirname(os.path.abspath(filename)),
+                                                pattern)):
+                os.remove(stale)
+            try:
+                with atomic_file(cached) as file_out:
+                    np.save(file_out,table)
+            except OSError as error:
+                printitre("WARNING: unable to write {}: {}".format(cached,error),
+                          logging.WARNING)
+
+    if columns is None:
+        data = table
+    else:
+        columns = np.arange(table.shape[1])[columns]
+        if np.all(np.diff(columns) == 1):
+            # a range of consecutive columns is a view of the table
+            data = table[:,columns[0]:columns[-1]+1]
+        else:
+            data = table[:,columns]
+    if data.shape[1] == 1:
+        data = data[:,0]
+    return data
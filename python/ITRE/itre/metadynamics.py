@@ -1,5 +1,86 @@
 import numpy as np
-import numba as nb
+from .utils import jit, prange, numba_threads, signature, f8, i8, f8_1d, f8_2d, f8_3d, i8_1d, i8_2d
+from .celllist import CellList, _cell_index
+from .storage import flat_storage, grow
+from .hills import is_covariance, hill_widths, whiten
+from .schedule import evaluation_frames, window_sums, hill_windows
+from .instrument import active
+
+
+@jit(nopython=True,fastmath=True,signatures=[signature(f8_2d,f8_2d,f8_1d,f8_2d,i8,i8)])
+def _gaussian_nb(ref_colvars,colvars,boundaries,sigmas,ref_index,k):
+    """Gaussian overlap between the frame ref_index of ref_colvars and the
+       hill k, centered in colvars[k]."""
+    dist2 = 0.0
+    for d in range(colvars.shape[1]):
+        comp = ref_colvars[ref_index,d]-colvars[k,d]
+        comp -= np.rint(comp/boundaries[d])*boundaries[d]
+        comp /= sigmas[k,d]
+        dist2 += comp*comp
+    return np.exp(-0.5*dist2)
+
+
+@jit(nopython=True,fastmath=True,signatures=[signature(f8_2d,f8_2d,f8_1d,f8_3d,i8,i8)])
+def _gaussian_full_nb(ref_colvars,colvars,boundaries,factors,ref_index,k):
+    """Gaussian overlap between the frame ref_index and the hill k, given
+       the inverse Cholesky factor of its covariance (lower triangular)."""
+    dist2 = 0.0
+    for a in range(colvars.shape[1]):
+        dist = 0.0
+        for b in range(a+1):
+            comp = ref_colvars[ref_index,b]-colvars[k,b]
+            comp -= np.rint(comp/boundaries[b])*boundaries[b]
+            dist += factors[k,a,b]*comp
+        dist2 += dist*dist
+    return np.exp(-0.5*dist2)
+
+
+@jit(nopython=True,fastmath=True,signatures=[signature(f8_2d,f8_2d,f8_1d,f8_2d,f8_3d,i8,i8)])
+def _hill_gaussian_nb(ref_colvars,colvars,boundaries,sigmas,factors,ref_index,k):
+    """Gaussian overlap between the frame ref_index and the hill k, with
+       the sigmas or, if factors is not empty, the inverse Cholesky factors
+       of the covariances."""
+    if factors.shape[0] > 0:
+        return _gaussian_full_nb(ref_colvars,colvars,boundaries,factors,ref_index,k)
+    return _gaussian_nb(ref_colvars,colvars,boundaries,sigmas,ref_index,k)
+
+
+@jit(nopython=True,fastmath=True,signatures=[signature(f8_1d,f8_1d,f8_1d,f8,f8_1d,f8_1d,i8_1d,f8)])
+def _deposit_hill_nb(grid,center,sigma,height,mins,lengths,n_bins,cutoff):
+    """Add a Gaussian hill to a flattened periodic grid, on the grid points
+       closer than cutoff sigmas from its center."""
+    dims = len(center)
+    spacing = lengths/n_bins
+    first = np.zeros(dims,dtype=np.int64)
+    widths = np.zeros(dims,dtype=np.int64)
+    halves = np.zeros(dims,dtype=np.int64)
+    for d in range(dims):
+        halves[d] = int(np.ceil(cutoff*sigma[d]/spacing[d]))
+        widths[d] = min(2*halves[d],n_bins[d])
+
+    # the Gaussian is separable, so the weights are evaluated per dimension
+    weights = np.zeros((dims,np.amax(widths)))
+    for d in range(dims):
+        reduced = (center[d]-mins[d])/spacing[d]
+        first[d] = int(np.floor(reduced))-halves[d]+1
+        for o in range(widths[d]):
+            dist = (first[d]+o-reduced)*spacing[d]
+            dist -= np.rint(dist/lengths[d])*lengths[d]
+            weights[d,o] = np.exp(-0.5*(dist/sigma[d])**2)
+
+    n_points = 1
+    for d in range(dims):
+        n_points *= widths[d]
+    for point in range(n_points):
+        flat = 0
+        value = height
+        rest = point
+        for d in range(dims):
+            o = rest % widths[d]
+            rest //= widths[d]
+            value *= weights[d,o]
+            flat = flat*n_bins[d]+((first[d]+o) % n_bins[d])
+        grid[flat] += value
 
 
 class Metadynamics(object):
@@ -17,26 +98,52 @@ class Metadynamics(object):
            ----------
            a : first point (either a float or a array of float)
            b : second point (either a float or a array of float)
-           c : covariance (either a float or a array of float)
+           c : covariance (either a float or a array of float), or the
+               inverse Cholesky factor of a full covariance (see hill_widths)
 
            Returns
            -------
            the value of the Gaussian overlap
         """
         comp = a-b-np.rint((a-b)/boundaries)*boundaries
-        dist = comp/c
+        dist = whiten(comp,c)
         dist = 0.5 * dist.dot(dist)
         return np.exp(-dist)
 
+    def kernel_np(self,a,b,c,boundaries):
+        """This function evaluate the gaussian between one point and an array
+           of points given the covariances, in a vectorized fashion.
+
+           Parameters
+           ----------
+           a : the reference point (either a float or a array of float)
+           b : the array of points (n_points or n_points,n_cvs)
+           c : the covariances (n_points or n_points,n_cvs), or the inverse
+               Cholesky factors of full covariances (n_points,n_cvs,n_cvs)
+
+           Returns
+           -------
+           an array with the value of the Gaussian overlap for each point
+        """
+        comp = a-b-np.rint((a-b)/boundaries)*boundaries
+        dist = whiten(comp,c)
+        if dist.ndim > 1:
+            dist = 0.5 * np.einsum('ij,ij->i',dist,dist)
+        else:
+            dist = 0.5 * dist * dist
+        return np.exp(-dist)
+
     @staticmethod
-    @nb.jit
-    def calculate_bias_matrix_nb(colvars,boundaries,sigmas,heights,wall,n_evals,stride,dims):
+    @jit(signatures=[signature(f8_2d,f8_1d,f8_2d,f8_1d,f8_1d,i8,i8_1d,i8),
+                     # a single CV given as a 1D array
+                     signature(f8_1d,f8_1d,f8_1d,f8_1d,f8_1d,i8,i8_1d,i8)])
+    def _bias_matrix_nb(colvars,boundaries,sigmas,heights,wall,n_evals,frames,dims):
         bias_matrix = np.zeros((n_evals,n_evals))
         dist = np.zeros(dims)
 
         for i in range(n_evals):
-            for k in range(i*stride):
-                comp = (colvars[i*stride]-colvars[k]) - np.rint((colvars[i*stride]-colvars[k])/boundaries)*boundaries
+            for k in range(frames[i]):
+                comp = (colvars[frames[i]]-colvars[k]) - np.rint((colvars[frames[i]]-colvars[k])/boundaries)*boundaries
                 dist = comp/sigmas[k]
                 dist2 = 0.5 * dist.dot(dist)
                 bias_matrix[i,i] += np.exp(-dist2)*heights[k]
@@ -44,8 +151,8 @@ class Metadynamics(object):
         for i in range(n_evals):
             for j in range(i,n_evals-1):
                 bias_sum = 0.0
-                for t in range(j*stride,(j+1)*stride):
-                    comp = (colvars[i*stride]-colvars[t]) - np.rint((colvars[i*stride]-colvars[t])/boundaries)*boundaries
+                for t in range(frames[j],frames[j+1]):
+                    comp = (colvars[frames[i]]-colvars[t]) - np.rint((colvars[frames[i]]-colvars[t])/boundaries)*boundaries
                     dist = comp/sigmas[t]
                     dist2 = 0.5 * dist.dot(dist)
                     bias_sum += np.exp(-dist2)*heights[t]
@@ -53,12 +160,22 @@ class Metadynamics(object):
                 bias_matrix[j+1,i] = bias_matrix[j,i] + bias_sum
 
         for i in range(n_evals):
-            upper_index = int(i*stride)
+            upper_index = frames[i]
             for j in range(i,n_evals):
                 bias_matrix[j,i] += wall[upper_index]
 
         return bias_matrix
 
+    @staticmethod
+    def calculate_bias_matrix_nb(colvars,boundaries,sigmas,heights,wall,n_evals,stride,dims):
+        """
+        Evaluate the bias matrix with numba, with the same recursive formula
+        as calculate_bias_matrix. stride is the stride between two different
+        evaluations, or the array of the evaluated frames.
+        """
+        return Metadynamics._bias_matrix_nb(colvars,boundaries,sigmas,heights,wall,int(n_evals),
+                                            evaluation_frames(n_evals,stride),int(dims))
+
     def calculate_bias_matrix(self,colvars,boundaries,sigmas,heights,wall,n_evals,stride):
         """
         Evaluate the bias matrix by looping over time. A recursive formula is
@@ -72,33 +189,489 @@ class Metadynamics(object):
         heights : the heights of the hills deposited in the simulations
         wall : the value of the restraint acting in the simulation
         n_evals :  the number of evaluation to do (T in here)
-        stride : the stride between two different evaluation.
+        stride : the stride between two different evaluation, or the array
+                 of the evaluated frames (see schedule).
 
         Returns
         -------
         bias_matrix : a T*T float matrix containing the lagged potential matrix
         """
         bias_matrix = np.zeros((n_evals,n_evals))
+        sigmas = hill_widths(sigmas)
+        frames = evaluation_frames(n_evals,stride)
 
         for i in range(n_evals):
-            upper_index = int(i*stride)
+            upper_index = int(frames[i])
             for k in range(upper_index):
                 bias_matrix[i,i] += self.kernel(colvars[upper_index],colvars[k],sigmas[k],boundaries)*heights[k]
 
         for i in range(n_evals):
-            ref_index= int(i*stride)
+            ref_index= int(frames[i])
             for j in range(i,n_evals-1):
-                lower_index = int(j*stride)
-                upper_index = int((j+1)*stride)
+                lower_index = int(frames[j])
+                upper_index = int(frames[j+1])
                 bias_sum = 0.0
                 for t in range(lower_index,upper_index):
                     bias_sum += self.kernel(colvars[ref_index],colvars[t],sigmas[t],boundaries)*heights[t]
 
                 bias_matrix[j+1,i] = bias_matrix[j,i] + bias_sum
+            active().progress(i+1,n_evals)
 
         for i in range(n_evals):
-            upper_index = int(i*stride)
+            upper_index = int(frames[i])
             for j in range(i,n_evals):
                 bias_matrix[j,i] += wall[upper_index]
-                
+
+        return bias_matrix
+
+    def calculate_bias_matrix_np(self,colvars,boundaries,sigmas,heights,wall,n_evals,stride,out=None,ref_colvars=None,n_walkers=1,hill_counts=None):
+        """
+        Evaluate the bias matrix with numpy. For each reference frame the
+        kernel is evaluated against all the hills at once, and the hills are
+        then summed over the windows between two evaluations. The lagged
+        potential is the cumulative sum of these blocks, so that
+        bias_matrix[j,i] contains all the hills deposited before the j-th
+        evaluated frame, evaluated in the i-th one.
+
+        With multiple walkers, colvars, sigmas and heights are the hills
+        deposited by all the walkers, interleaved (n_walkers hills per step),
+        while the reference frames are taken from ref_colvars, the CVs of a
+        single walker, and wall is the restraint acting on that walker.
+
+        In the same way, the hills read from a HILLS file (deposited every
+        PACE frames) are evaluated in the frames of ref_colvars, given the
+        number of hills deposited before each evaluated frame (hill_counts).
+
+        Parameters
+        ----------
+        colvars : the value of the collective variables
+        sigmas : the covariances use to evaluate the overlap kernel
+        heights : the heights of the hills deposited in the simulations
+        wall : the value of the restraint acting in the simulation
+        n_evals :  the number of evaluation to do (T in here)
+        stride : the stride between two different evaluation, or the array
+                 of the evaluated frames (see schedule).
+        out : the T*T matrix (dense or PackedMatrix) in which the bias is
+              written. If None, a dense float64 matrix is allocated.
+        ref_colvars : the CVs of the walker in which the bias is evaluated
+                      (colvars if None)
+        n_walkers : the number of hills deposited at each step
+        hill_counts : the number of hills deposited before each evaluated
+                      frame. If None, n_walkers hills per frame.
+
+        Returns
+        -------
+        bias_matrix : a T*T float matrix containing the lagged potential matrix
+        """
+        bias_matrix = np.zeros((n_evals,n_evals)) if out is None else out
+        if ref_colvars is None:
+            ref_colvars = colvars
+        frames = evaluation_frames(n_evals,stride)
+        if hill_counts is None:
+            # the walkers deposit n_walkers hills at each step
+            hill_counts = frames*int(n_walkers)
+        first = int(hill_counts[0])
+        n_hills = int(hill_counts[-1])
+        cumulative = np.zeros(n_evals)
+        widths = hill_widths(sigmas[:n_hills])
+
+        for i in range(n_evals):
+            ref_index = int(frames[i])
+            row = self.kernel_np(ref_colvars[ref_index],colvars[:n_hills],
+                                 widths,boundaries)*heights[:n_hills]
+            # the hills deposited before the first evaluated frame, if any
+            cumulative[0] = np.sum(row[:first])
+            np.cumsum(window_sums(row[first:],hill_counts),out=cumulative[1:])
+            cumulative[1:] += cumulative[0]
+            bias_matrix[i:,i] = cumulative[i:] + wall[ref_index]
+            active().progress(i+1,n_evals)
+
+        return bias_matrix
+
+    def calculate_block_sums(self,colvars,boundaries,sigmas,heights,ref_indices,first_block,last_block,stride):
+        """
+        Evaluate in each reference frame the sum of the hills deposited in the
+        windows between two evaluations going from first_block to last_block
+        (excluded), the window b going from the b-th evaluated frame to the
+        next one.
+
+        Parameters
+        ----------
+        colvars : the value of the collective variables
+        sigmas : the covariances use to evaluate the overlap kernel
+        heights : the heights of the hills deposited in the simulations
+        ref_indices : the frames in which the hills are evaluated
+        first_block : the first window of hills to sum
+        last_block : the last window of hills to sum (excluded)
+        stride : the stride between two different evaluation, or the array
+                 of the evaluated frames (see schedule).
+
+        Returns
+        -------
+        block_sums : a len(ref_indices)*(last_block-first_block) float matrix
+        """
+        frames = evaluation_frames(last_block+1,stride)[first_block:]
+        start = int(frames[0])
+        stop = int(frames[-1])
+        block_sums = np.zeros((len(ref_indices),last_block-first_block))
+        widths = hill_widths(sigmas[start:stop])
+
+        for n,ref_index in enumerate(ref_indices):
+            row = self.kernel_np(colvars[ref_index],colvars[start:stop],
+                                 widths,boundaries)*heights[start:stop]
+            block_sums[n] = window_sums(row,frames)
+        active().count(len(ref_indices)*(stop-start))
+
+        return block_sums
+
+    def extend_bias_matrix(self,bias_matrix,colvars,boundaries,sigmas,heights,wall,n_evals,stride):
+        """
+        Extend a bias matrix previously computed on the first frames of
+        colvars to n_evals evaluations. Only the new rows of the old columns
+        (i.e. the hills deposited after the last evaluation) and the new
+        columns are evaluated, so that the cost scale as (n_evals-n_old)*T.
+
+        Parameters
+        ----------
+        bias_matrix : the n_old*n_old bias matrix to extend (a PackedMatrix
+                      is extended in place)
+        colvars : the value of the collective variables
+        sigmas : the covariances use to evaluate the overlap kernel
+        heights : the heights of the hills deposited in the simulations
+        wall : the value of the restraint acting in the simulation
+        n_evals :  the number of evaluation to do (T in here)
+        stride : the stride between two different evaluation, or the array
+                 of the evaluated frames (see schedule).
+
+        Returns
+        -------
+        bias_matrix : a T*T float matrix containing the lagged potential matrix
+        """
+        n_old = len(bias_matrix)
+        last_row = np.array(bias_matrix[n_old-1,:n_old],dtype=np.float64)
+        extended = grow(bias_matrix,n_evals)
+        frames = evaluation_frames(n_evals,stride)
+
+        lagged = self.calculate_block_sums(colvars,boundaries,sigmas,heights,
+                                           frames[:n_old],
+                                           n_old-1,n_evals-1,frames)
+        extended[n_old:,:n_old] = last_row + np.cumsum(lagged,axis=1).T
+
+        blocks = self.calculate_block_sums(colvars,boundaries,sigmas,heights,
+                                           frames[n_old:],
+                                           0,n_evals-1,frames)
+        cumulative = np.zeros(n_evals)
+        for n,i in enumerate(range(n_old,n_evals)):
+            np.cumsum(blocks[n],out=cumulative[1:])
+            extended[i:,i] = cumulative[i:] + wall[int(frames[i])]
+
+        return extended
+
+    @staticmethod
+    @jit(nopython=True,parallel=True,fastmath=True,
+         signatures=[signature(f8_2d,f8_2d,f8_1d,f8_2d,f8_3d,f8_1d,f8_1d,i8,i8_1d,i8_1d,f8_1d,i8_1d)])
+    def _bias_matrix_parallel(ref_colvars,colvars,boundaries,sigmas,factors,heights,wall,n_evals,frames,hill_counts,bias_matrix,row_offsets):
+
+        for i in prange(n_evals):
+            ref_index = frames[i]
+            bias_sum = 0.0
+            for k in range(hill_counts[i]):
+                bias_sum += _hill_gaussian_nb(ref_colvars,colvars,boundaries,sigmas,factors,ref_index,k)*heights[k]
+            bias_matrix[row_offsets[i]+i] = bias_sum + wall[ref_index]
+
+            for j in range(i,n_evals-1):
+                for t in range(hill_counts[j],hill_counts[j+1]):
+                    bias_sum += _hill_gaussian_nb(ref_colvars,colvars,boundaries,sigmas,factors,ref_index,t)*heights[t]
+                bias_matrix[row_offsets[j+1]+i] = bias_sum + wall[ref_index]
+
+    def calculate_bias_matrix_parallel(self,colvars,boundaries,sigmas,heights,wall,n_evals,stride,n_threads=None,out=None,ref_colvars=None,hill_counts=None):
+        """
+        Evaluate the bias matrix with numba, distributing the reference frames
+        (i.e. the columns of the matrix) over n_threads threads. The kernel is
+        compiled in nopython mode with fastmath, so that it fails loudly
+        rather than falling back to the object mode. For hills with a full
+        covariance, the inverse of its Cholesky factor is computed once per
+        hill, so that each kernel evaluation is a triangular matrix-vector
+        product. As for calculate_bias_matrix_np, the hills can be evaluated
+        in the frames of ref_colvars, given hill_counts.
+
+        Parameters
+        ----------
+        colvars : the value of the collective variables
+        sigmas : the covariances use to evaluate the overlap kernel, either
+                 a sigma per CV or a n_cvs*n_cvs matrix per hill
+        heights : the heights of the hills deposited in the simulations
+        wall : the value of the restraint acting in the simulation
+        n_evals :  the number of evaluation to do (T in here)
+        stride : the stride between two different evaluation, or the array
+                 of the evaluated frames (see schedule).
+        n_threads : the number of threads to use. If None, all the cores
+                    available are used.
+        out : the T*T matrix (dense or PackedMatrix) in which the bias is
+              written. If None, a dense float64 matrix is allocated.
+        ref_colvars : the CVs of the frames in which the bias is evaluated
+                      (colvars if None)
+        hill_counts : the number of hills deposited before each evaluated
+                      frame. If None, one hill per frame.
+
+        Returns
+        -------
+        bias_matrix : a T*T float matrix containing the lagged potential matrix
+        """
+        colvars = np.ascontiguousarray(colvars,dtype=np.float64).reshape(len(colvars),-1)
+        ref_colvars = colvars if ref_colvars is None else \
+                      np.ascontiguousarray(ref_colvars,dtype=np.float64).reshape(len(ref_colvars),-1)
+        boundaries = np.ascontiguousarray(boundaries,dtype=np.float64).reshape(-1)
+        frames = evaluation_frames(n_evals,stride)
+        hill_counts = frames if hill_counts is None else \
+                      np.ascontiguousarray(hill_counts,dtype=np.int64)
+        # the kernel uses the factors of the covariances if they are not empty
+        factors = np.zeros((0,0,0))
+        if is_covariance(sigmas):
+            factors = hill_widths(sigmas[:int(hill_counts[-1])+1])
+            sigmas = np.zeros((0,0))
+        else:
+            sigmas = np.ascontiguousarray(sigmas,dtype=np.float64).reshape(len(sigmas),-1)
+
+        bias_matrix,data,row_offsets = flat_storage(out,int(n_evals))
+        with numba_threads(n_threads):
+            self._bias_matrix_parallel(ref_colvars,colvars,boundaries,sigmas,factors,
+                                       np.ascontiguousarray(heights,dtype=np.float64),
+                                       np.ascontiguousarray(wall,dtype=np.float64),
+                                       int(n_evals),frames,hill_counts,data,row_offsets)
+        return bias_matrix
+
+    @staticmethod
+    @jit(nopython=True,parallel=True,fastmath=True,
+         signatures=[signature(f8_2d,f8_2d,f8_1d,f8_2d,f8_1d,f8_1d,i8,i8_1d,i8_1d,f8,f8_1d,
+                               i8_1d,i8_2d,i8_1d,i8_1d,f8_1d,i8_1d)])
+    def _bias_matrix_cutoff(ref_colvars,colvars,boundaries,sigmas,heights,wall,n_evals,frames,windows,cutoff,
+                            mins,n_cells,offsets,order,cell_start,bias_matrix,row_offsets):
+        n_hills = windows.shape[0]
+        weights = np.ones(colvars.shape[1])
+        cutoff2 = cutoff*cutoff
+
+        for i in prange(n_evals):
+            ref_index = frames[i]
+            blocks = np.zeros(n_evals)
+            for o in range(offsets.shape[0]):
+                cell = _cell_index(ref_colvars[ref_index],weights,mins,boundaries,n_cells,offsets[o])
+                for n in range(cell_start[cell],cell_start[cell+1]):
+                    k = order[n]
+                    if k >= n_hills:
+                        break
+                    dist2 = 0.0
+                    for d in range(colvars.shape[1]):
+                        comp = ref_colvars[ref_index,d]-colvars[k,d]
+                        comp -= np.rint(comp/boundaries[d])*boundaries[d]
+                        comp /= sigmas[k,d]
+                        dist2 += comp*comp
+                    if dist2 < cutoff2:
+                        blocks[windows[k]] += np.exp(-0.5*dist2)*heights[k]
+
+            bias_sum = 0.0
+            for j in range(n_evals):
+                bias_sum += blocks[j]
+                if j >= i:
+                    bias_matrix[row_offsets[j]+i] = bias_sum + wall[ref_index]
+
+    def calculate_bias_matrix_cutoff(self,colvars,boundaries,sigmas,heights,wall,n_evals,stride,cutoff,mins,n_threads=None,out=None,ref_colvars=None,hill_counts=None):
+        """
+        Evaluate the bias matrix with numba, neglecting the hills that are
+        farther than cutoff (in units of sigma) from the reference frame.
+        The hills are stored in a periodic cell list, so that only the hills
+        in the cells neighbouring the reference frame are visited. The error
+        on each element is bounded by truncation_error_bound. As for
+        calculate_bias_matrix_np, the hills can be evaluated in the frames of
+        ref_colvars, given hill_counts.
+
+        Parameters
+        ----------
+        colvars : the value of the collective variables
+        boundaries : the periodicity of each CV
+        sigmas : the covariances use to evaluate the overlap kernel
+        heights : the heights of the hills deposited in the simulations
+        wall : the value of the restraint acting in the simulation
+        n_evals :  the number of evaluation to do (T in here)
+        stride : the stride between two different evaluation, or the array
+                 of the evaluated frames (see schedule).
+        cutoff : the truncation radius of the Gaussians, in units of sigma
+        mins : the lower boundary of each CV
+        n_threads : the number of threads to use. If None, all the cores
+                    available are used.
+        out : the T*T matrix (dense or PackedMatrix) in which the bias is
+              written. If None, a dense float64 matrix is allocated.
+        ref_colvars : the CVs of the frames in which the bias is evaluated
+                      (colvars if None)
+        hill_counts : the number of hills deposited before each evaluated
+                      frame. If None, one hill per frame.
+
+        Returns
+        -------
+        bias_matrix : a T*T float matrix containing the lagged potential matrix
+        """
+        colvars = np.ascontiguousarray(colvars,dtype=np.float64).reshape(len(colvars),-1)
+        ref_colvars = colvars if ref_colvars is None else \
+                      np.ascontiguousarray(ref_colvars,dtype=np.float64).reshape(len(ref_colvars),-1)
+        sigmas = np.ascontiguousarray(sigmas,dtype=np.float64).reshape(len(sigmas),-1)
+        boundaries = np.ascontiguousarray(boundaries,dtype=np.float64).reshape(-1)
+        frames = evaluation_frames(n_evals,stride)
+        if hill_counts is None:
+            hill_counts = frames
+        n_hills = int(hill_counts[-1])
+
+        cells = CellList(colvars[:n_hills],mins,boundaries,
+                         cutoff*np.amax(sigmas[:max(n_hills,1)],axis=0))
+
+        bias_matrix,data,row_offsets = flat_storage(out,int(n_evals))
+        with numba_threads(n_threads):
+            self._bias_matrix_cutoff(ref_colvars,colvars,boundaries,sigmas,
+                                     np.ascontiguousarray(heights,dtype=np.float64),
+                                     np.ascontiguousarray(wall,dtype=np.float64),
+                                     int(n_evals),frames,hill_windows(hill_counts,n_hills),
+                                     float(cutoff),cells.mins,cells.n_cells,cells.offsets,
+                                     cells.order,cells.cell_start,data,row_offsets)
         return bias_matrix
+
+    def truncation_error_bound(self,heights,n_evals,stride,cutoff):
+        """
+        Upper bound of the error made on any element of the bias matrix when
+        the hills farther than cutoff (in units of sigma) are neglected, i.e.
+        exp(-cutoff**2/2) times the sum of all the heights. For the hills of
+        a HILLS file, stride is the number of hills deposited before each
+        evaluated frame.
+        """
+        n_hills = int(evaluation_frames(n_evals,stride)[-1])
+        return np.exp(-0.5*cutoff**2)*np.sum(np.abs(heights[:n_hills]))
+
+    @staticmethod
+    @jit(nopython=True,parallel=True,fastmath=True,
+         signatures=[signature(f8_2d,f8_1d,f8_1d,f8_2d,f8_1d,f8_1d,i8,i8_1d,f8,i8_1d,f8_1d,i8_1d)])
+    def _bias_matrix_grid(colvars,mins,lengths,sigmas,heights,wall,n_evals,frames,cutoff,n_bins,bias_matrix,row_offsets):
+        dims = colvars.shape[1]
+        n_corners = 2**dims
+        spacing = lengths/n_bins
+        grid = np.zeros(np.prod(n_bins))
+
+        # multilinear interpolation weights of the reference frames
+        corners = np.zeros((n_evals,n_corners),dtype=np.int64)
+        corner_weights = np.ones((n_evals,n_corners))
+        for i in prange(n_evals):
+            for c in range(n_corners):
+                flat = 0
+                for d in range(dims):
+                    reduced = (colvars[frames[i],d]-mins[d])/spacing[d]
+                    reduced -= np.floor(reduced/n_bins[d])*n_bins[d]
+                    low = int(np.floor(reduced))
+                    frac = reduced-low
+                    if (c >> d) & 1:
+                        low += 1
+                        corner_weights[i,c] *= frac
+                    else:
+                        corner_weights[i,c] *= 1.0-frac
+                    flat = flat*n_bins[d]+(low % n_bins[d])
+                corners[i,c] = flat
+
+        for j in range(n_evals):
+            if j > 0:
+                for k in range(frames[j-1],frames[j]):
+                    _deposit_hill_nb(grid,colvars[k],sigmas[k],heights[k],
+                                     mins,lengths,n_bins,cutoff)
+            for i in prange(j+1):
+                value = wall[frames[i]]
+                for c in range(n_corners):
+                    value += corner_weights[i,c]*grid[corners[i,c]]
+                bias_matrix[row_offsets[j]+i] = value
+
+    def grid_bins(self,boundaries,sigmas,points_per_sigma=5,max_points=10**7):
+        """
+        Choose the number of bins of the grid along each CV, so that the
+        spacing is the smallest sigma divided by points_per_sigma, with at most
+        max_points grid points in total.
+        """
+        boundaries = np.asarray(boundaries,dtype=np.float64).reshape(-1)
+        sigmas = np.asarray(sigmas,dtype=np.float64).reshape(len(sigmas),-1)
+        n_bins = np.ceil(boundaries*points_per_sigma/np.amin(sigmas,axis=0))
+        scale = (np.prod(n_bins)/max_points)**(1.0/len(n_bins))
+        if scale > 1:
+            n_bins = np.ceil(n_bins/scale)
+        return np.maximum(n_bins,2).astype(np.int64)
+
+    def calculate_bias_matrix_grid(self,colvars,boundaries,sigmas,heights,wall,n_evals,stride,mins,n_bins=None,cutoff=8.0,n_threads=None,out=None):
+        """
+        Evaluate the bias matrix by accumulating the hills on a periodic grid,
+        as done by PLUMED. The hills of each window between two evaluations
+        are deposited on the grid (up to cutoff sigmas from their center), then
+        the bias of all the reference frames is obtained by multilinear
+        interpolation. The cost scales as the number of hills times the size
+        of the stencil plus T*T interpolations, instead of a kernel evaluation
+        for each pair of reference frame and hill. Only suitable for 1 to 3
+        CVs.
+
+        Parameters
+        ----------
+        colvars : the value of the collective variables
+        boundaries : the periodicity of each CV
+        sigmas : the covariances use to evaluate the overlap kernel
+        heights : the heights of the hills deposited in the simulations
+        wall : the value of the restraint acting in the simulation
+        n_evals :  the number of evaluation to do (T in here)
+        stride : the stride between two different evaluation, or the array
+                 of the evaluated frames (see schedule).
+        mins : the lower boundary of each CV
+        n_bins : the number of bins of the grid along each CV. If None, it is
+                 chosen with grid_bins.
+        cutoff : the distance (in units of sigma) up to which the hills are
+                 deposited on the grid
+        n_threads : the number of threads to use. If None, all the cores
+                    available are used.
+        out : the T*T matrix (dense or PackedMatrix) in which the bias is
+              written. If None, a dense float64 matrix is allocated.
+
+        Returns
+        -------
+        bias_matrix : a T*T float matrix containing the lagged potential matrix
+        """
+        colvars = np.ascontiguousarray(colvars,dtype=np.float64).reshape(len(colvars),-1)
+        sigmas = np.ascontiguousarray(sigmas,dtype=np.float64).reshape(len(sigmas),-1)
+        boundaries = np.ascontiguousarray(boundaries,dtype=np.float64).reshape(-1)
+        if colvars.shape[1] > 3:
+            raise ValueError("The grid engine supports at most 3 CVs, {} given"\
+                             .format(colvars.shape[1]))
+        if n_bins is None:
+            n_bins = self.grid_bins(boundaries,sigmas)
+        n_bins = np.ones(colvars.shape[1],dtype=np.int64)*np.asarray(n_bins,dtype=np.int64)
+
+        bias_matrix,data,row_offsets = flat_storage(out,int(n_evals))
+        with numba_threads(n_threads):
+            self._bias_matrix_grid(colvars,
+                                   np.ascontiguousarray(mins,dtype=np.float64).reshape(-1),
+                                   boundaries,sigmas,
+                                   np.ascontiguousarray(heights,dtype=np.float64),
+                                   np.ascontiguousarray(wall,dtype=np.float64),
+                                   int(n_evals),evaluation_frames(n_evals,stride),
+                                   float(cutoff),n_bins,
+                                   data,row_offsets)
+        return bias_matrix
+
+    def interpolation_error(self,bias_matrix,colvars,boundaries,sigmas,heights,wall,n_evals,stride,n_samples=16):
+        """
+        Estimate the error of an approximated bias matrix (e.g. the one
+        obtained on a grid) by computing exactly n_samples of its columns,
+        evenly spaced in time.
+
+        Returns
+        -------
+        the largest absolute error on the sampled columns
+        """
+        samples = np.unique(np.linspace(0,n_evals-1,min(n_samples,n_evals)).astype(int))
+        frames = evaluation_frames(n_evals,stride)
+        blocks = self.calculate_block_sums(colvars,boundaries,sigmas,heights,
+                                           frames[samples],0,n_evals-1,frames)
+        error = 0.0
+        cumulative = np.zeros(n_evals)
+        for n,i in enumerate(samples):
+            np.cumsum(blocks[n],out=cumulative[1:])
+            exact = cumulative[i:] + wall[int(frames[i])]
+            error = max(error,np.amax(np.abs(bias_matrix[i:,i]-exact)))
+        return error
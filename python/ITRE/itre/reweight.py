@@ -0,0 +1,148 @@
+import numpy as np
+
+
+def interpolate_ct(ct,eval_frames,frames):
+    """
+    Interpolate linearly c(t), known in the evaluated frames, in any frame
+    (c(t) is constant before the first and after the last evaluation).
+    """
+    return np.interp(frames,eval_frames,ct)
+
+
+def log_weights(bias,ct,beta):
+    """The logarithm of the weights exp(beta*(V(s,t)-c(t))) of some frames."""
+    return beta*(np.asarray(bias,dtype=np.float64)-ct)
+
+
+def confidence_band(samples,confidence=0.95):
+    """
+    The percentile band containing a fraction confidence of the samples
+    (along the first axis), ignoring the nan.
+
+    Returns
+    -------
+    lower, upper : the lower and upper limits of the band
+    """
+    if not 0.0 < confidence < 1.0:
+        raise ValueError("The confidence has to be between 0 and 1, not {}".format(confidence))
+    tail = 50.0*(1.0-confidence)
+    return np.nanpercentile(samples,tail,axis=0),np.nanpercentile(samples,100.0-tail,axis=0)
+
+
+def grid_edges(cvs,bins,ranges=None,chunk_size=100000):
+    """
+    The edges of a regular grid on the CVs, with bins bins along each CV (a
+    number or a list). If ranges is None, the grid spans the values of the
+    CVs, which are scanned in chunks.
+
+    Returns
+    -------
+    edges : a list with the bins+1 edges along each CV
+    """
+    dims = cvs.shape[1]
+    bins = np.broadcast_to(np.asarray(bins,dtype=int),(dims,))
+    if ranges is None:
+        lows = np.full(dims,np.inf)
+        highs = np.full(dims,-np.inf)
+        for start in range(0,len(cvs),chunk_size):
+            chunk = np.asarray(cvs[start:start+chunk_size],dtype=np.float64)
+            lows = np.minimum(lows,chunk.min(axis=0))
+            highs = np.maximum(highs,chunk.max(axis=0))
+        ranges = np.stack((lows,highs),axis=1)
+    ranges = np.reshape(np.asarray(ranges,dtype=np.float64),(dims,2))
+    return [np.linspace(ranges[d,0],ranges[d,1],bins[d]+1) for d in range(dims)]
+
+
+def bin_indices(chunk,edges):
+    """
+    The flat index of the bin of each frame of a chunk of CVs, and whether
+    the frame falls inside the grid. The last edge belongs to the last bin.
+    """
+    n_bins = [len(el)-1 for el in edges]
+    indices = np.zeros((len(chunk),len(edges)),dtype=np.int64)
+    inside = np.ones(len(chunk),dtype=bool)
+    for d,el in enumerate(edges):
+        width = (el[-1]-el[0])/n_bins[d]
+        index = np.floor((chunk[:,d]-el[0])/width).astype(np.int64)
+        index[chunk[:,d] == el[-1]] = n_bins[d]-1
+        inside &= (index >= 0) & (index < n_bins[d])
+        indices[:,d] = index
+    flat = np.ravel_multi_index(tuple(np.clip(indices,0,np.array(n_bins)-1).T),n_bins)
+    return flat,inside
+
+
+def _accumulate(log_total,log_values,chunk_max):
+    """Add exp(log_values+chunk_max) to the log-domain accumulator log_total."""
+    with np.errstate(divide='ignore'):
+        return np.logaddexp(log_total,np.log(log_values)+chunk_max)
+
+
+def log_histogram(cvs,weights_of,edges,chunk_size=100000):
+    """
+    Accumulate the weighted histogram of the CVs in the log domain, reading
+    the frames in chunks of chunk_size.
+
+    Parameters
+    ----------
+    cvs : a n_frames*n_cvs array (it can be a memory map)
+    weights_of : a function returning the log weights of the frames in
+                 range(start,stop), called as weights_of(start,stop)
+    edges : the edges of the grid (see grid_edges)
+    chunk_size : the number of frames processed at once
+
+    Returns
+    -------
+    log_hist : the logarithm of the weighted counts, shaped as the grid
+    """
+    n_bins = [len(el)-1 for el in edges]
+    log_hist = np.full(int(np.prod(n_bins)),-np.inf)
+    for start in range(0,len(cvs),chunk_size):
+        stop = min(start+chunk_size,len(cvs))
+        chunk = np.asarray(cvs[start:stop],dtype=np.float64)
+        flat,inside = bin_indices(chunk,edges)
+        if not np.any(inside):
+            continue
+        weights = weights_of(start,stop)[inside]
+        chunk_max = np.amax(weights)
+        counts = np.bincount(flat[inside],weights=np.exp(weights-chunk_max),
+                             minlength=len(log_hist))
+        log_hist = _accumulate(log_hist,counts,chunk_max)
+    return log_hist.reshape(n_bins)
+
+
+def log_kde(cvs,weights_of,centers,bandwidth,chunk_size=100000):
+    """
+    Accumulate a weighted Gaussian kernel density estimate of the CVs on a
+    grid in the log domain, reading the frames in chunks of chunk_size. The
+    kernel is a product of Gaussians along each CV, so that the density of a
+    chunk is a product of small matrices, one per CV.
+
+    Parameters
+    ----------
+    cvs : a n_frames*n_cvs array (it can be a memory map)
+    weights_of : a function returning the log weights of the frames in
+                 range(start,stop), called as weights_of(start,stop)
+    centers : a list with the points of the grid along each CV
+    bandwidth : the width of the Gaussian along each CV (a number or a list)
+    chunk_size : the number of frames processed at once
+
+    Returns
+    -------
+    log_density : the logarithm of the (unnormalized) density on the grid
+    """
+    dims = len(centers)
+    bandwidth = np.broadcast_to(np.asarray(bandwidth,dtype=np.float64),(dims,))
+    letters = 'abcdefghijklmnopqrstuvwxyz'[:dims]
+    # e.g. 'z,za,zb->ab' for 2 CVs, summing over the frames z
+    subscripts = 'z,'+','.join('z'+el for el in letters)+'->'+letters
+    log_density = np.full([len(el) for el in centers],-np.inf)
+    for start in range(0,len(cvs),chunk_size):
+        stop = min(start+chunk_size,len(cvs))
+        chunk = np.asarray(cvs[start:stop],dtype=np.float64)
+        weights = weights_of(start,stop)
+        chunk_max = np.amax(weights)
+        kernels = [np.exp(-0.5*((centers[d][np.newaxis,:]-chunk[:,d,np.newaxis])/bandwidth[d])**2)
+                   for d in range(dims)]
+        density = np.einsum(subscripts,np.exp(weights-chunk_max),*kernels,optimize=True)
+        log_density = _accumulate(log_density,density,chunk_max)
+    return log_density
@@ -0,0 +1,153 @@
+import numpy as np
+
+
+def evaluation_frames(n_evals,stride):
+    """
+    The frames in which the bias is evaluated: one every stride frames, or
+    the first n_evals of the frames given by stride if it is an array (see
+    check_frames).
+    """
+    if np.ndim(stride) == 0:
+        return np.arange(int(n_evals),dtype=np.int64)*int(stride)
+    return np.ascontiguousarray(np.asarray(stride,dtype=np.int64)[:int(n_evals)])
+
+
+def check_frames(frames,steps):
+    """
+    Check that the evaluated frames start from the first frame and are
+    strictly increasing frames of a trajectory of steps frames.
+
+    Returns
+    -------
+    frames : the frames as an int64 array
+    """
+    frames = np.asarray(frames)
+    if frames.ndim != 1 or len(frames) == 0:
+        raise ValueError("The evaluated frames must be a non empty list of frames")
+    if not np.all(frames == np.rint(frames)):
+        raise ValueError("The evaluated frames must be integers")
+    frames = frames.astype(np.int64)
+    if frames[0] != 0:
+        raise ValueError("The first evaluated frame must be 0, not {}".format(frames[0]))
+    if np.any(np.diff(frames) <= 0):
+        raise ValueError("The evaluated frames must be strictly increasing")
+    if frames[-1] >= steps:
+        raise ValueError("The evaluated frame {} is beyond the {} frames of the trajectory"\
+                         .format(frames[-1],steps))
+    return frames
+
+
+def uniform_frames(steps,stride,start=0):
+    """
+    One frame every stride frames from start, as long as stride frames
+    follow it (i.e. steps//stride frames from 0).
+    """
+    return np.arange(int(start),int(steps)-int(stride)+1,int(stride),dtype=np.int64)
+
+
+def geometric_frames(steps,n_evals,first_spacing):
+    """
+    n_evals frames from 0 to the last frame of the trajectory, whose spacing
+    starts from first_spacing and grows geometrically. If the frames do
+    not fit in the trajectory with a growing spacing, they are evenly spaced
+    by first_spacing instead (so there are fewer of them).
+
+    Returns
+    -------
+    frames : the frames, rounded to the closest integer
+    """
+    last = int(steps)-1
+    n_evals = int(n_evals)
+    first_spacing = float(first_spacing)
+    if n_evals < 2 or (n_evals-1)*first_spacing >= last:
+        return uniform_frames(steps,first_spacing)
+
+    # the ratio r such that the n_evals-1 spacings add up to the last frame,
+    # i.e. sum(first_spacing*r**i) == last, found by bisection
+    def span(ratio):
+        return first_spacing*np.sum(ratio**np.arange(n_evals-1))
+    low,high = 1.0,2.0
+    while span(high) < last:
+        low,high = high,2*high
+    for _ in range(100):
+        ratio = 0.5*(low+high)
+        if span(ratio) < last:
+            low = ratio
+        else:
+            high = ratio
+    spacings = first_spacing*ratio**np.arange(n_evals-1)
+    frames = np.rint(np.concatenate(([0.0],np.cumsum(spacings)))).astype(np.int64)
+    return np.unique(np.clip(frames,0,last))
+
+
+def adaptive_frames(rate,n_evals,min_spacing=1):
+    """
+    n_evals frames placed so that the same amount of rate accumulates
+    between two consecutive frames, e.g. with the rate of change of the
+    bias the frames are dense where the bias grows quickly. Two frames are
+    at least min_spacing frames apart, so there can be fewer of them.
+
+    Parameters
+    ----------
+    rate : the non negative rate in each frame of the trajectory
+    n_evals : the number of frames
+    min_spacing : the smallest spacing between two frames
+
+    Returns
+    -------
+    frames : the frames, starting from 0
+    """
+    rate = np.abs(np.asarray(rate,dtype=np.float64))
+    cumulative = np.concatenate(([0.0],np.cumsum(rate[:-1])))
+    if cumulative[-1] == 0.0:
+        # nothing changes, the frames are evenly spaced
+        cumulative = np.arange(len(rate),dtype=np.float64)
+    levels = np.linspace(0.0,cumulative[-1],int(n_evals))
+    candidates = np.unique(np.searchsorted(cumulative,levels))
+
+    frames = [0]
+    for frame in candidates[1:]:
+        frame = max(frame,frames[-1]+int(min_spacing))
+        if frame >= len(rate):
+            break
+        frames.append(frame)
+    return np.array(frames,dtype=np.int64)
+
+
+def window_sums(values,frames):
+    """
+    Sum the values of the hills (along the last axis) over the windows
+    between consecutive frames, i.e. the element j is the sum of the hills
+    deposited from frames[j] to frames[j+1] (excluded), zero if they are
+    equal. The values start from the hill deposited in frames[0].
+
+    Returns
+    -------
+    sums : an array with len(frames)-1 elements along the last axis
+    """
+    frames = np.asarray(frames,dtype=np.int64)
+    values = np.asarray(values)
+    if len(frames) < 2:
+        return np.zeros(values.shape[:-1]+(0,))
+    values = values[...,:frames[-1]-frames[0]]
+    starts = frames[:-1]-frames[0]
+    full = np.diff(frames) > 0
+    if np.all(full):
+        return np.add.reduceat(values,starts,axis=-1)
+    # reduceat does not sum empty windows (e.g. no hill deposited between
+    # two evaluations), so only the others are reduced
+    sums = np.zeros(values.shape[:-1]+(len(starts),),dtype=values.dtype)
+    if np.any(full):
+        sums[...,full] = np.add.reduceat(values,starts[full],axis=-1)
+    return sums
+
+
+def hill_windows(frames,n_hills):
+    """
+    The first row of the bias matrix containing each of the first n_hills
+    hills, i.e. the number of frames up to the one in which it has been
+    deposited (included): the hill k is part of the lagged bias from the
+    evaluation in the first frame after k onward.
+    """
+    return np.searchsorted(np.asarray(frames,dtype=np.int64),
+                           np.arange(int(n_hills)),side='right').astype(np.int64)
@@ -0,0 +1,325 @@
+import numpy as np
+
+
+def packed_offsets(n_evals):
+    """Offset of each row of a packed lower triangular matrix (n_evals+1)."""
+    rows = np.arange(n_evals+1,dtype=np.int64)
+    return rows*(rows+1)//2
+
+
+class PackedMatrix(object):
+    """This class stores a lower triangular matrix (such as the bias matrix)
+       keeping only the lower triangle, packed row by row, so that it
+       requires half of the memory of the dense matrix. The elements can be
+       stored in single precision, and the packed array can be a memory map
+       on file, to handle matrices that do not fit in memory.
+
+       The elements are accessed with the same indexing as a dense matrix,
+       for contiguous slices only. The elements above the diagonal are zero
+       and cannot be set."""
+    def __init__(self,n_evals,dtype=np.float64,filename=None,mode='w+'):
+        """
+        Parameters
+        ----------
+        n_evals : the number of rows (and columns) of the matrix
+        dtype : the type of the elements (e.g. np.float64 or np.float32)
+        filename : if not None, the packed array is a memory map on this file
+        mode : the mode in which filename is opened, 'w+' to create it or
+               'r+' to map the elements already written in it
+        """
+        super(PackedMatrix, self).__init__()
+        self.n_evals = int(n_evals)
+        self.dtype = np.dtype(dtype)
+        self.filename = filename
+        self.row_offsets = packed_offsets(self.n_evals)
+        self.data = self.__allocate(self.row_offsets[-1],mode)
+
+    def __allocate(self,size,mode='w+'):
+        if self.filename is None:
+            return np.zeros(size,dtype=self.dtype)
+        # a memory map cannot be empty
+        return np.memmap(self.filename,dtype=self.dtype,mode=mode,
+                         shape=(max(size,1),))[:size]
+
+    @classmethod
+    def from_dense(cls,matrix,dtype=np.float64,filename=None):
+        """
+        Build a packed matrix from the lower triangle of a dense matrix.
+        """
+        packed = cls(len(matrix),dtype,filename)
+        packed.fill(matrix)
+        return packed
+
+    def fill(self,matrix):
+        """Copy the lower triangle of a dense n_evals*n_evals matrix."""
+        for j in range(self.n_evals):
+            self.row(j)[:] = matrix[j,:j+1]
+
+    @property
+    def shape(self):
+        return (self.n_evals,self.n_evals)
+
+    def __len__(self):
+        return self.n_evals
+
+    def row(self,j):
+        """The elements of the row j up to the diagonal (a view)."""
+        return self.data[self.row_offsets[j]:self.row_offsets[j+1]]
+
+    def rows(self,start,stop):
+        """The packed elements of the rows from start to stop (a view)."""
+        return self.data[self.row_offsets[start]:self.row_offsets[stop]]
+
+    def diagonal(self):
+        """The diagonal of the matrix (a copy)."""
+        return self.data[self.row_offsets[1:]-1]
+
+    def to_dense(self):
+        """The dense float64 matrix, with zeros above the diagonal."""
+        matrix = np.zeros(self.shape)
+        for j in range(self.n_evals):
+            matrix[j,:j+1] = self.row(j)
+        return matrix
+
+    def resize(self,n_evals):
+        """
+        Change the number of rows of the matrix, keeping the first ones. Since
+        the rows are packed one after the other, adding rows only requires to
+        append them to the packed array.
+        """
+        n_evals = int(n_evals)
+        row_offsets = packed_offsets(n_evals)
+        size = row_offsets[-1]
+        if self.filename is None:
+            data = np.zeros(size,dtype=self.dtype)
+            keep = min(size,len(self.data))
+            data[:keep] = self.data[:keep]
+        else:
+            self.flush()
+            del self.data
+            with open(self.filename,'r+b') as file_out:
+                file_out.truncate(max(size,1)*self.dtype.itemsize)
+            data = self.__allocate(size,mode='r+')
+        self.data = data
+        self.n_evals = n_evals
+        self.row_offsets = row_offsets
+
+    def flush(self):
+        """Write the changes on file, if the matrix is a memory map."""
+        if isinstance(self.data,np.memmap):
+            self.data.flush()
+
+    def __range(self,key):
+        """Convert an integer or a contiguous slice in (start,stop,is_int)."""
+        if isinstance(key,(int,np.integer)):
+            if key < 0:
+                key += self.n_evals
+            if key < 0 or key >= self.n_evals:
+                raise IndexError("Index {} out of range".format(key))
+            return int(key),int(key)+1,True
+        if isinstance(key,slice):
+            start,stop,step = key.indices(self.n_evals)
+            if step != 1:
+                raise IndexError("Only contiguous slices are supported")
+            return start,max(start,stop),False
+        raise IndexError("Only integers and slices are supported")
+
+    def __parse(self,key):
+        if not isinstance(key,tuple):
+            key = (key,slice(None))
+        if len(key) != 2:
+            raise IndexError("A matrix requires two indices")
+        return self.__range(key[0]),self.__range(key[1])
+
+    def __getitem__(self,key):
+        (r_start,r_stop,r_int),(c_start,c_stop,c_int) = self.__parse(key)
+        block = np.zeros((r_stop-r_start,c_stop-c_start),dtype=self.dtype)
+        if c_stop-c_start == 1:
+            rows = np.arange(max(r_start,c_start),r_stop)
+            block[rows-r_start,0] = self.data[self.row_offsets[rows]+c_start]
+        else:
+            for j in range(max(r_start,c_start),r_stop):
+                stop = min(c_stop,j+1)
+                block[j-r_start,:stop-c_start] = \
+                    self.data[self.row_offsets[j]+c_start:self.row_offsets[j]+stop]
+        if r_int:
+            block = block[0]
+        if c_int:
+            block = block[...,0]
+        return block
+
+    def __setitem__(self,key,values):
+        (r_start,r_stop,r_int),(c_start,c_stop,c_int) = self.__parse(key)
+        if r_stop > r_start and c_stop-1 > r_start:
+            raise IndexError("Only the lower triangle of a PackedMatrix can be set")
+        values = np.asarray(values)
+        if c_int and values.ndim > 0:
+            values = values[...,np.newaxis]
+        if r_int and values.ndim > 0:
+            values = values[np.newaxis]
+        values = np.broadcast_to(values,(r_stop-r_start,c_stop-c_start))
+        if c_stop-c_start == 1:
+            rows = np.arange(r_start,r_stop)
+            self.data[self.row_offsets[rows]+c_start] = values[:,0]
+        else:
+            for j in range(r_start,r_stop):
+                self.data[self.row_offsets[j]+c_start:self.row_offsets[j]+c_stop] = \
+                    values[j-r_start]
+
+    def exp_dot(self,vector,factor,block_size=2**22):
+        """
+        Evaluate the product between exp(factor*matrix), restricted to the
+        lower triangle, and vector (or the columns of a n_evals*n matrix).
+        The rows are processed in blocks of about block_size elements, so
+        that the exponential of the whole matrix is never stored.
+
+        Returns
+        -------
+        result : the float64 array with the product, shaped as vector
+        """
+        vector = np.asarray(vector)
+        result = np.zeros(vector.shape)
+        start = 0
+        while start < self.n_evals:
+            stop = np.searchsorted(self.row_offsets,self.row_offsets[start]+block_size,
+                                   side='right')-1
+            stop = min(max(stop,start+1),self.n_evals)
+            lengths = np.arange(start+1,stop+1)
+            columns = np.arange(self.row_offsets[stop]-self.row_offsets[start]) - \
+                      np.repeat(self.row_offsets[start:stop]-self.row_offsets[start],lengths)
+            weights = np.exp(factor*self.rows(start,stop).astype(np.float64))
+            if vector.ndim > 1:
+                weights = weights[:,np.newaxis]
+            weighted = weights*vector[columns]
+            result[start:stop] = np.add.reduceat(weighted,self.row_offsets[start:stop]-\
+                                                 self.row_offsets[start])
+            start = stop
+        return result
+
+    def log_exp_dot(self,shift,log_vector,factor,block_size=2**22,dtype=np.float64,
+                    accumulate_dtype=np.float64):
+        """
+        Evaluate for each row j the logarithm of
+        sum_{i<=j} exp(factor*(matrix[j,i]-shift[i])+log_vector[i]) as a
+        log-sum-exp, relative to the largest term of the row (see the
+        module function log_exp_dot).
+        """
+        dtype = np.dtype(dtype)
+        shift = np.asarray(shift,dtype=dtype)
+        log_vector = np.asarray(log_vector,dtype=dtype)
+        result = np.zeros(self.n_evals)
+        start = 0
+        while start < self.n_evals:
+            stop = np.searchsorted(self.row_offsets,self.row_offsets[start]+block_size,
+                                   side='right')-1
+            stop = min(max(stop,start+1),self.n_evals)
+            lengths = np.arange(start+1,stop+1)
+            offsets = self.row_offsets[start:stop]-self.row_offsets[start]
+            columns = np.arange(self.row_offsets[stop]-self.row_offsets[start]) - \
+                      np.repeat(offsets,lengths)
+            terms = factor*(self.rows(start,stop).astype(dtype)-shift[columns]) + \
+                    log_vector[columns]
+            row_max = np.maximum.reduceat(terms,offsets)
+            sums = np.add.reduceat(np.exp(terms-np.repeat(row_max,lengths)),offsets,
+                                   dtype=accumulate_dtype)
+            result[start:stop] = row_max+np.log(sums)
+            start = stop
+        return result
+
+
+def flat_storage(matrix,n_evals):
+    """
+    Return the matrix in which an engine writes the bias, together with its
+    flat data and the offset of each row in the flat data, so that the
+    element (j,i) is data[row_offsets[j]+i] for both a dense and a packed
+    matrix. If matrix is None, a dense float64 matrix is allocated.
+    """
+    if matrix is None:
+        matrix = np.zeros((n_evals,n_evals))
+    if isinstance(matrix,PackedMatrix):
+        return matrix,np.asarray(matrix.data),matrix.row_offsets
+    return matrix,matrix.reshape(-1),np.arange(n_evals+1,dtype=np.int64)*n_evals
+
+
+def exp_dot(matrix,vector,factor,block_size=2**22):
+    """
+    Evaluate the product between exp(factor*matrix), restricted to the lower
+    triangle, and vector (or the columns of a n_evals*n matrix), for a dense
+    or a packed matrix. The rows are processed in blocks of about block_size
+    elements, so that the exponential of the whole matrix is never stored.
+
+    Returns
+    -------
+    result : the float64 array with the product, shaped as vector
+    """
+    if isinstance(matrix,PackedMatrix):
+        return matrix.exp_dot(vector,factor,block_size)
+
+    n_evals = len(matrix)
+    vector = np.asarray(vector)
+    result = np.zeros(vector.shape)
+    start = 0
+    while start < n_evals:
+        # the block only extends up to the diagonal of its last row
+        stop = min(start+max(block_size//n_evals,1),n_evals)
+        block = np.exp(factor*np.asarray(matrix[start:stop,:stop],dtype=np.float64))
+        result[start:stop] = np.tril(block,k=start).dot(vector[:stop])
+        start = stop
+    return result
+
+
+def log_exp_dot(matrix,shift,log_vector,factor,block_size=2**22,dtype=np.float64,
+                accumulate_dtype=np.float64):
+    """
+    Evaluate for each row j the logarithm of
+
+        sum_{i<=j} exp(factor*(matrix[j,i]-shift[i])+log_vector[i])
+
+    for a dense or a packed matrix, as a log-sum-exp relative to the largest
+    term of each row, so that no exponential overflows. With the bias matrix,
+    shift is the instantaneous bias: the lagged bias in a frame is never
+    smaller than the instantaneous one, so the terms stay of order one and
+    can be exponentiated in single precision (dtype), while they are summed
+    in accumulate_dtype. The rows are processed in blocks of about
+    block_size elements.
+
+    Returns
+    -------
+    result : the float64 array with the logarithm of each row sum
+    """
+    if isinstance(matrix,PackedMatrix):
+        return matrix.log_exp_dot(shift,log_vector,factor,block_size,dtype,
+                                  accumulate_dtype)
+
+    n_evals = len(matrix)
+    dtype = np.dtype(dtype)
+    shift = np.asarray(shift,dtype=dtype)
+    log_vector = np.asarray(log_vector,dtype=dtype)
+    result = np.zeros(n_evals)
+    start = 0
+    while start < n_evals:
+        stop = min(start+max(block_size//n_evals,1),n_evals)
+        terms = factor*(np.asarray(matrix[start:stop,:stop],dtype=dtype)-shift[:stop]) + \
+                log_vector[:stop]
+        # the elements above the diagonal do not contribute
+        terms[np.arange(stop)[np.newaxis,:] > np.arange(start,stop)[:,np.newaxis]] = -np.inf
+        row_max = np.amax(terms,axis=1)
+        sums = np.sum(np.exp(terms-row_max[:,np.newaxis]),axis=1,dtype=accumulate_dtype)
+        result[start:stop] = row_max+np.log(sums)
+        start = stop
+    return result
+
+
+def grow(matrix,n_evals):
+    """
+    Return the matrix enlarged to n_evals rows and columns, keeping its
+    elements. A PackedMatrix is resized in place, while a dense matrix is
+    copied in a new one of the same type.
+    """
+    if isinstance(matrix,PackedMatrix):
+        matrix.resize(n_evals)
+        return matrix
+    keep = min(len(matrix),n_evals)
+    grown = np.zeros((n_evals,n_evals),dtype=matrix.dtype)
+    grown[:keep,:keep] = matrix[:keep,:keep]
+    return grown
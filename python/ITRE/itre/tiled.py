@@ -0,0 +1,299 @@
+import os
+import shutil
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from .metadynamics import Metadynamics
+from .atlas import Atlas
+from .storage import PackedMatrix, packed_offsets
+from .cache import hash_inputs
+from .schedule import evaluation_frames
+from .utils import printitre, atomic_file
+from .instrument import active
+
+
+# the arrays shared with the workers, saved as .npy files in the work folder
+# (as float64, except the evaluated frames)
+_input_names = ['colvars','boundaries','sigmas','heights','wall','thetas','frames']
+_input_dtypes = {'frames':np.int64}
+
+
+def _open_inputs(work_dir):
+    """Memory map the inputs saved in the work folder (None if missing)."""
+    inputs = {}
+    for name in _input_names:
+        filename = os.path.join(work_dir,'inputs','{}.npy'.format(name))
+        inputs[name] = np.load(filename,mmap_mode='r') if os.path.exists(filename) else None
+    return inputs
+
+
+def _open_output(matrix_file,dtype,n_evals):
+    """Memory map the packed output written by the workers."""
+    size = packed_offsets(n_evals)[-1]
+    return np.memmap(matrix_file,dtype=dtype,mode='r+',shape=(max(size,1),))[:size]
+
+
+def _tile_block_sums(inputs,residual_w,columns,first_row,last_row):
+    """
+    The hills deposited in the window that ends at the row j (i.e. the
+    increment of bias_matrix[j,i] with respect to bias_matrix[j-1,i]) for
+    the rows from first_row to last_row (excluded) and the given columns.
+
+    Returns
+    -------
+    increments : a len(columns)*(last_row-first_row) float matrix
+    """
+    increments = np.zeros((len(columns),last_row-first_row))
+    # the row 0 has no hills
+    start = max(first_row,1)
+    if start >= last_row:
+        return increments
+    frames = inputs['frames']
+    ref_indices = frames[columns]
+    if inputs['thetas'] is None:
+        blocks = Metadynamics().calculate_block_sums(inputs['colvars'],inputs['boundaries'],
+                                                     inputs['sigmas'],inputs['heights'],
+                                                     ref_indices,start-1,last_row-1,frames)
+    else:
+        blocks = Atlas().calculate_block_sums(inputs['colvars'],inputs['boundaries'],
+                                              inputs['sigmas'],inputs['heights'],
+                                              inputs['thetas'],ref_indices,start-1,
+                                              last_row-1,frames,residual_w)
+    increments[:,start-first_row:] = blocks
+    return increments
+
+
+def _build_tile(work_dir,matrix_file,dtype,n_evals,tile_size,residual_w,row_block,column_block):
+    """
+    Evaluate the tile (row_block,column_block) of the increments of the bias
+    matrix. The tiles below the diagonal are written in the output, while
+    for the tiles above it only the sum over the rows of each column is
+    needed (it is part of the diagonal element), and it is saved in the
+    partials folder. A diagonal tile does both.
+    """
+    inputs = _open_inputs(work_dir)
+    r0,r1 = row_block*tile_size,min((row_block+1)*tile_size,n_evals)
+    c0,c1 = column_block*tile_size,min((column_block+1)*tile_size,n_evals)
+    columns = np.arange(c0,c1)
+    increments = _tile_block_sums(inputs,residual_w,columns,r0,r1)
+
+    if row_block <= column_block:
+        rows = np.arange(r0,r1)
+        upper = increments*(rows[np.newaxis,:] <= columns[:,np.newaxis])
+        with atomic_file(os.path.join(work_dir,'partials',
+                                      '{}_{}.npy'.format(row_block,column_block))) as file_out:
+            np.save(file_out,upper.sum(axis=1))
+
+    if row_block >= column_block:
+        data = _open_output(matrix_file,dtype,n_evals)
+        row_offsets = packed_offsets(n_evals)
+        for j in range(max(r0,c0+1),r1):
+            stop = min(c1,j)
+            data[row_offsets[j]+c0:row_offsets[j]+stop] = increments[:stop-c0,j-r0]
+        data.flush()
+
+
+def _scan_columns(work_dir,matrix_file,dtype,n_evals,tile_size,residual_w,column_block):
+    """
+    Turn the increments of the columns of column_block in the bias, with a
+    cumulative sum along the rows that starts from the diagonal element
+    (the wall, the partial sums of the tiles above the diagonal and, for
+    ATLAS, the hill deposited in the reference frame itself).
+    """
+    # the increments are overwritten, see TiledBuilder.build
+    open(os.path.join(work_dir,'columns','{}.started'.format(column_block)),'w').close()
+    inputs = _open_inputs(work_dir)
+    data = _open_output(matrix_file,dtype,n_evals)
+    row_offsets = packed_offsets(n_evals)
+    c0,c1 = column_block*tile_size,min((column_block+1)*tile_size,n_evals)
+    columns = np.arange(c0,c1)
+    ref_indices = inputs['frames'][columns]
+
+    running = np.zeros(len(columns))
+    for row_block in range(column_block+1):
+        running += np.load(os.path.join(work_dir,'partials',
+                                        '{}_{}.npy'.format(row_block,column_block)))
+    if inputs['wall'] is not None:
+        running += inputs['wall'][ref_indices]
+    if inputs['thetas'] is not None:
+        atlas = Atlas()
+        for n,ref_index in enumerate(ref_indices):
+            running[n] += atlas.hill_contributions_np(inputs['colvars'],inputs['boundaries'],
+                                                      inputs['sigmas'],inputs['heights'],
+                                                      inputs['thetas'],ref_index,ref_index,
+                                                      ref_index+1,residual_w)[0]
+    scale = 1.0/(1+residual_w)
+
+    # the rows crossing the diagonal
+    for j in range(c0,c1):
+        n = j-c0
+        running[:n] += data[row_offsets[j]+c0:row_offsets[j]+j]
+        data[row_offsets[j]+c0:row_offsets[j]+j+1] = running[:n+1]*scale
+    # the rows below, by blocks
+    for r0 in range(c1,n_evals,tile_size):
+        r1 = min(r0+tile_size,n_evals)
+        indices = row_offsets[r0:r1,np.newaxis]+columns
+        cumulative = np.cumsum(data[indices],axis=0,dtype=np.float64)+running
+        data[indices] = cumulative*scale
+        running = cumulative[-1]
+    data.flush()
+
+
+class TiledBuilder(object):
+    """This class evaluates the bias matrix of Metadynamics or ATLAS out of
+       core, splitting it in square tiles of tile_size rows and columns
+       that are evaluated by a pool of processes. The inputs are saved once
+       in a work folder and memory mapped by the workers, which write the
+       tiles directly in the packed matrix mapped on matrix_file.
+
+       The matrix is built in two passes: first each tile (including the
+       ones above the diagonal, whose hills are part of the diagonal
+       elements) evaluates the hills deposited between its rows, then each
+       block of columns is summed along the rows. The completed tiles and
+       columns are marked in the work folder, so that an interrupted build
+       is resumed by calling build again with the same inputs.
+
+       The workers are spawned, so a script that uses this class must
+       protect its main code with if __name__ == '__main__'."""
+    def __init__(self,work_dir,matrix_file=None,tile_size=512,n_workers=None):
+        """
+        Parameters
+        ----------
+        work_dir : the folder with the inputs and the progress of the build
+        matrix_file : the file on which the packed matrix is memory mapped
+                      (bias_matrix.dat in work_dir if None)
+        tile_size : the number of rows and columns of a tile
+        n_workers : the number of processes (all the cores if None)
+        """
+        super(TiledBuilder, self).__init__()
+        self.work_dir = work_dir
+        if matrix_file is None:
+            matrix_file = os.path.join(work_dir,'bias_matrix.dat')
+        self.matrix_file = matrix_file
+        self.tile_size = int(tile_size)
+        self.n_workers = n_workers
+
+    def __marker(self,kind,*indices):
+        return os.path.join(self.work_dir,kind,'_'.join(str(n) for n in indices)+'.done')
+
+    def __prepare(self,inputs,dtype,n_evals,residual_w):
+        """
+        Save the inputs in the work folder, unless it already contains a
+        build with the same inputs, in which case it is resumed.
+
+        Returns
+        -------
+        matrix : the PackedMatrix mapped on matrix_file
+        resumed : whether a previous build is resumed
+        """
+        parameters = {'n_evals':n_evals,'residual_w':residual_w,
+                      'tile_size':self.tile_size,'dtype':dtype.str,
+                      'matrix_file':os.path.abspath(self.matrix_file)}
+        key = hash_inputs(inputs,parameters,'itre-tiled-build-2')
+        key_file = os.path.join(self.work_dir,'key')
+
+        previous = None
+        if os.path.exists(key_file):
+            with open(key_file,'r') as file_in:
+                previous = file_in.read().strip()
+        size = max(packed_offsets(n_evals)[-1],1)*dtype.itemsize
+        if previous == key and os.path.exists(self.matrix_file) and \
+           os.path.getsize(self.matrix_file) == size:
+            return PackedMatrix(n_evals,dtype,self.matrix_file,mode='r+'),True
+
+        for folder in ['inputs','tiles','partials','columns']:
+            shutil.rmtree(os.path.join(self.work_dir,folder),ignore_errors=True)
+            os.makedirs(os.path.join(self.work_dir,folder))
+        for name in _input_names:
+            if inputs[name] is not None:
+                np.save(os.path.join(self.work_dir,'inputs','{}.npy'.format(name)),
+                        np.asarray(inputs[name],dtype=_input_dtypes.get(name,np.float64)))
+        matrix = PackedMatrix(n_evals,dtype,self.matrix_file)
+        matrix.flush()
+        # the key is written last, once the folder is consistent
+        with atomic_file(key_file) as file_out:
+            file_out.write(key.encode())
+        return matrix,False
+
+    def __run(self,function,tasks,arguments,kind):
+        """Run function on the tasks that are not marked as done yet."""
+        pending = [task for task in tasks if not os.path.exists(self.__marker(kind,*task))]
+        if len(pending) < len(tasks):
+            printitre("{} of the {} {} are already done".format(len(tasks)-len(pending),
+                                                             len(tasks),kind))
+        if len(pending) == 0:
+            return
+        done = len(tasks)-len(pending)
+        # the workers are spawned rather than forked, since forking a process
+        # in which numba has started the threads of a parallel kernel can
+        # deadlock
+        with ProcessPoolExecutor(max_workers=self.n_workers,
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = {executor.submit(function,*(arguments+task)):task for task in pending}
+            for future in as_completed(futures):
+                future.result()
+                open(self.__marker(kind,*futures[future]),'w').close()
+                done += 1
+                active().progress(done,len(tasks))
+
+    def build(self,colvars,boundaries,sigmas,heights,wall,n_evals,stride,thetas=None,residual_w=0.0,dtype=np.float64):
+        """
+        Build the bias matrix, or resume the build if the work folder
+        contains an interrupted one with the same inputs.
+
+        Parameters
+        ----------
+        colvars : the values of the collective variables
+        boundaries : the lengths of the periodic boundaries of the CVs
+        sigmas : the covariances use to evaluate the overlap kernel
+        heights : the heights of the hills deposited in the simulations
+        wall : the values of the restraint acting in the simulation
+        n_evals :  the number of evaluation to do (T in here)
+        stride : the stride between two different evaluation, or the array
+                 of the evaluated frames (see schedule).
+        thetas : for ATLAS, the values of the activation function theta
+                 (None for Metadynamics)
+        residual_w : for ATLAS, the weight for the reflected residual CV.
+        dtype : the type of the stored elements
+
+        Returns
+        -------
+        bias_matrix : the T*T PackedMatrix mapped on matrix_file
+        """
+        os.makedirs(self.work_dir,exist_ok=True)
+        n_evals = int(n_evals)
+        dtype = np.dtype(dtype)
+        residual_w = float(residual_w) if thetas is not None else 0.0
+        inputs = {'colvars':colvars,'boundaries':boundaries,'sigmas':sigmas,
+                  'heights':heights,'wall':wall,'thetas':thetas,
+                  'frames':evaluation_frames(n_evals,stride)}
+        matrix,resumed = self.__prepare(inputs,dtype,n_evals,residual_w)
+        if resumed:
+            printitre("Resuming the tiled build in {}".format(self.work_dir))
+
+        n_blocks = -(-n_evals//self.tile_size)
+        # a block of columns interrupted during the sum has lost its
+        # increments, so its tiles are evaluated again
+        for column_block in range(n_blocks):
+            started = os.path.join(self.work_dir,'columns','{}.started'.format(column_block))
+            if os.path.exists(started) and \
+               not os.path.exists(self.__marker('columns',column_block)):
+                for row_block in range(column_block,n_blocks):
+                    marker = self.__marker('tiles',row_block,column_block)
+                    if os.path.exists(marker):
+                        os.remove(marker)
+                os.remove(started)
+
+        arguments = (self.work_dir,self.matrix_file,dtype,n_evals,
+                     self.tile_size,residual_w)
+        tiles = [(row_block,column_block) for column_block in range(n_blocks)
+                 for row_block in range(n_blocks)]
+        printitre("Evaluating {} tiles of {} rows and columns".format(len(tiles),
+                                                                     self.tile_size))
+        self.__run(_build_tile,tiles,arguments,'tiles')
+
+        self.__run(_scan_columns,[(column_block,) for column_block in range(n_blocks)],
+                   arguments,'columns')
+
+        # reopen the map, so that it reflects what the workers have written
+        return PackedMatrix(n_evals,dtype,self.matrix_file,mode='r+')
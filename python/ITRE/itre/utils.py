@@ -1,6 +1,180 @@
-def printitre(arg):
+import os
+import sys
+import types
+import logging
+import functools
+import tempfile
+from contextlib import contextmanager
+import numpy as np
+
+# replaced by numba.prange in the globals of the kernels when they are
+# compiled (see LazyJit)
+prange = range
+
+# the types of the arguments of the kernels in the explicit signatures (see
+# jit): float64 and int64 scalars and C contiguous arrays
+f8, i8 = 'float64', 'int64'
+f8_1d, f8_2d, f8_3d = 'float64[::1]', 'float64[:,::1]', 'float64[:,:,::1]'
+i8_1d, i8_2d, i8_3d = 'int64[::1]', 'int64[:,::1]', 'int64[:,:,::1]'
+
+def signature(*types):
+    """The explicit signature of a kernel taking arguments of the given types."""
+    return '({})'.format(','.join(types))
+
+
+class _StdoutHandler(logging.StreamHandler):
+    """A StreamHandler writing on the current sys.stdout (which can be redirected)."""
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self,value):
+        pass
+
+
+# all the messages of ITRE go through the itre logger, which by default
+# prints them on stdout with the usual decoration
+logger = logging.getLogger('itre')
+if not logger.handlers:
+    _handler = _StdoutHandler()
+    _handler.setFormatter(logging.Formatter('--> ITRE: %(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+def printitre(arg,level=logging.INFO):
     """
     This function is a print decorated with a few characters so that the
     print function present a characteristic string. Useful for postprocess.
+
+    The message is sent to the itre logger with the given level, so that it
+    can be filtered (see set_log_level) or handled with the logging module.
     """
-    print("--> ITRE: {}".format(arg))
+    logger.log(level,arg)
+
+def set_log_level(level):
+    """Set the level (e.g. 'DEBUG' or logging.WARNING) of the itre logger."""
+    if isinstance(level,str):
+        level = level.upper()
+    logger.setLevel(level)
+
+class LazyJit(object):
+    """This class wraps a function that is compiled with numba.jit the first
+       time it is called, so that numba is only imported (and the kernels
+       only compiled) when an engine that needs it is used.
+
+       Before compiling, the jitted functions called by the function (as
+       globals) are compiled in turn, and the function is compiled with a
+       private copy of the globals of its module in which they are replaced
+       by their numba dispatchers and prange by numba.prange, so that numba
+       sees its own objects while the module itself is left untouched.
+
+       The compiled code is cached on disk (cache=True unless specified
+       otherwise), so that only the first process pays for the compilation.
+       The explicit signatures are all compiled (or loaded from the cache)
+       at once, while other argument types (e.g. read only memory maps) are
+       still compiled when they are first seen."""
+    def __init__(self,function,options):
+        super(LazyJit, self).__init__()
+        self.function = function
+        self.options = dict(options)
+        self.signatures = self.options.pop('signatures',[])
+        self.options.setdefault('cache',True)
+        self.dispatcher = None
+        functools.update_wrapper(self,function)
+
+    def compile(self):
+        """Compile the function (once) and return the numba dispatcher."""
+        if self.dispatcher is None:
+            try:
+                import numba as nb
+            except ImportError:
+                raise ImportError("numba is required by {}, select another \
+engine or install numba".format(self.function.__name__))
+
+            namespace = dict(self.function.__globals__)
+            for name in self.function.__code__.co_names:
+                if isinstance(namespace.get(name),LazyJit):
+                    namespace[name] = namespace[name].compile()
+                elif name == 'prange':
+                    namespace[name] = nb.prange
+            function = types.FunctionType(self.function.__code__,namespace,
+                                          self.function.__name__,
+                                          self.function.__defaults__,
+                                          self.function.__closure__)
+            functools.update_wrapper(function,self.function)
+            dispatcher = nb.jit(**self.options)(function)
+            for signature in self.signatures:
+                dispatcher.compile(signature)
+            self.dispatcher = dispatcher
+        return self.dispatcher
+
+    def __call__(self,*args,**kwargs):
+        return self.compile()(*args,**kwargs)
+
+def jit(function=None,**options):
+    """
+    Compile a function with numba.jit, lazily: numba is imported and the
+    function compiled the first time it is called (see LazyJit). When numba
+    is not installed, calling the function raises an ImportError, so that
+    the engines that do not need numba can still be used.
+
+    It can be used both as @jit and as @jit(nopython=True,...), in which case
+    the options are passed to numba.jit, except signatures, the list of the
+    explicit signatures (see signature) compiled together the first time
+    the function is called. The functions are cached on disk by default (in
+    the __pycache__ folder next to the module, or in NUMBA_CACHE_DIR).
+
+    Since numba cannot cache closures, the kernels are module level
+    functions or static methods.
+    """
+    if function is None:
+        return lambda function: jit(function,**options)
+    return LazyJit(function,options)
+
+@contextmanager
+def numba_threads(n_threads=None):
+    """
+    Context manager that sets the number of threads used by the parallel
+    numba engines, restoring the previous value on exit. If n_threads is None
+    the numba default (all the available cores) is used.
+    """
+    import numba as nb
+
+    previous = nb.get_num_threads()
+    if n_threads is not None:
+        if n_threads < 1 or n_threads > nb.config.NUMBA_NUM_THREADS:
+            raise ValueError("n_threads has to be between 1 and {}"\
+                             .format(nb.config.NUMBA_NUM_THREADS))
+        nb.set_num_threads(n_threads)
+    try:
+        yield
+    finally:
+        nb.set_num_threads(previous)
+
+@contextmanager
+def atomic_file(filename):
+    """
+    Context manager yielding a binary file opened on a temporary file in the
+    same folder as filename, which is renamed to filename on exit. In this
+    way a program reading the file never sees a partially written file.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd,tmp_name = tempfile.mkstemp(dir=directory,suffix='.tmp',
+                                   prefix='.{}.'.format(os.path.basename(filename)))
+    try:
+        with os.fdopen(fd,'wb') as file_out:
+            yield file_out
+        os.replace(tmp_name,filename)
+    except BaseException:
+        os.remove(tmp_name)
+        raise
+
+def savetxt_atomic(filename,array,**kwargs):
+    """
+    Save an array with np.savetxt to a temporary file in the same folder,
+    which is then renamed to filename (see atomic_file).
+    """
+    with atomic_file(filename) as file_out:
+        np.savetxt(file_out,array,**kwargs)
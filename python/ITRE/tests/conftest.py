@@ -0,0 +1,114 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+
+import itre
+
+
+def synthetic_meta(steps=240,n_cvs=2,stride=8,periodic=True,seed=0):
+    """
+    An Itre object for a small well tempered Metadynamics on a random walk,
+    with the CVs in [-pi,pi] (periodic or not).
+    """
+    rng = np.random.default_rng(seed)
+    colvars = np.cumsum(rng.normal(scale=0.15,size=(steps,n_cvs)),axis=0)
+    colvars = (colvars+np.pi) % (2*np.pi) - np.pi
+    it = itre.Itre()
+    it.colvars = colvars
+    it.sigmas = 0.3+0.1*rng.random((steps,n_cvs))
+    it.heights = 0.5*np.exp(-2.0*np.arange(steps)/steps)
+    it.wall = 0.1*rng.random(steps)
+    it.stride = stride
+    it.steps = steps
+    it.set_schedule()
+    if periodic:
+        it.set_boundaries([-np.pi,np.pi]*n_cvs)
+    else:
+        it.set_boundaries()
+    return it
+
+
+def synthetic_atlas(steps=180,n_cvs=2,n_minima=3,stride=6,residual=True,seed=0):
+    """
+    An Itre object for a small ATLAS calculation with n_minima minima, with
+    sparse activation functions, and the residual activated or not.
+    """
+    rng = np.random.default_rng(seed)
+    it = itre.Itre()
+    it.colvars = np.cumsum(rng.normal(scale=0.2,size=(steps,n_minima*n_cvs)),axis=0)
+    it.sigmas = np.full((steps,n_minima*n_cvs),0.3)
+    it.heights = 0.02*np.exp(-2.0*np.arange(steps)/steps)
+    thetas = rng.random((steps,n_minima+1))**4
+    thetas[thetas < 0.05] = 0.0
+    thetas[:,-1] += 1e-3
+    it.thetas = thetas
+    it.has_thetas = True
+    it.has_residual = residual
+    it.wall = np.zeros(steps)
+    it.stride = stride
+    it.steps = steps
+    it.set_schedule()
+    it.set_boundaries()
+    return it
+
+
+def walkers(n_walkers=2,**directives):
+    """A synthetic Metadynamics whose hills are deposited by n_walkers walkers."""
+    it = synthetic_meta()
+    it.n_walkers = n_walkers
+    it.steps = len(it.colvars)//n_walkers
+    it.engine = 'numpy'
+    for key,value in directives.items():
+        setattr(it,key,value)
+    it.set_schedule()
+    return it
+
+
+def split(it,n_first):
+    """
+    Keep the first n_first frames of it (with the boundaries of the whole
+    trajectory) and return the arguments of extend for the other frames.
+    """
+    names = ['colvars','sigmas','heights','wall']+(['thetas'] if it.has_thetas else [])
+    rest = [getattr(it,name)[n_first:] for name in names]
+    for name in names:
+        setattr(it,name,getattr(it,name)[:n_first])
+    it.steps = n_first
+    it.set_schedule()
+    return rest
+
+
+def dense(matrix):
+    """The lower triangle of a dense or packed bias matrix, as a float64 array."""
+    if hasattr(matrix,'to_dense'):
+        matrix = matrix.to_dense()
+    return np.tril(np.asarray(matrix,dtype=np.float64))
+
+
+def assert_same_run(it,reference,atol=1e-10):
+    """Check that the bias matrix and c(t) of two solved Itre objects agree."""
+    np.testing.assert_allclose(dense(it.bias_matrix),dense(reference.bias_matrix),
+                               rtol=0,atol=atol)
+    np.testing.assert_allclose(it.ct[-1],reference.ct[-1],rtol=0,atol=atol)
+
+
+def solved(it,engine='python',**directives):
+    """Set the engine and the other directives of it, then solve c(t)."""
+    it.engine = engine
+    for key,value in directives.items():
+        setattr(it,key,value)
+    it.calculate_c_t()
+    return it
+
+
+@pytest.fixture
+def meta():
+    return synthetic_meta
+
+
+@pytest.fixture
+def atlas():
+    return synthetic_atlas
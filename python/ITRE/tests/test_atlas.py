@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from conftest import synthetic_atlas,solved,assert_same_run
+from itre.atlas import atlas_tables
+
+
+def test_atlas_tables():
+    it = synthetic_atlas()
+    hill_thetas,inv_sigmas = atlas_tables(it.sigmas,it.heights,it.thetas)
+    for k in [0,10,99]:
+        expected = it.thetas[k]*it.heights[k]/np.dot(it.thetas[k],it.thetas[k])
+        np.testing.assert_allclose(hill_thetas[k],expected,rtol=1e-14)
+    np.testing.assert_allclose(inv_sigmas,1/it.sigmas,rtol=1e-14)
+
+
+def inactive_minimum(residual):
+    """An ATLAS calculation in which the activation of a minimum always vanishes."""
+    it = synthetic_atlas(residual=residual)
+    it.thetas[:,1] = 0.0
+    return it
+
+
+@pytest.mark.parametrize('engine',['numba','parallel','cutoff'])
+@pytest.mark.parametrize('residual',[True,False])
+def test_atlas_engines(engine,residual):
+    reference = solved(synthetic_atlas(residual=residual),'python')
+    it = solved(synthetic_atlas(residual=residual),engine,cutoff=40.0)
+    assert_same_run(it,reference,atol=1e-9)
+
+
+@pytest.mark.parametrize('engine',['numba','parallel'])
+@pytest.mark.parametrize('residual',[True,False])
+def test_atlas_inactive_minimum(engine,residual):
+    reference = solved(inactive_minimum(residual),'python')
+    it = solved(inactive_minimum(residual),engine)
+    assert_same_run(it,reference,atol=1e-9)
+
+
+@pytest.mark.parametrize('engine',['numba','parallel'])
+def test_atlas_single_cv(engine):
+    reference = solved(synthetic_atlas(n_cvs=1),'python')
+    it = solved(synthetic_atlas(n_cvs=1),engine)
+    assert_same_run(it,reference,atol=1e-9)
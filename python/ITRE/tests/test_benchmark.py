@@ -0,0 +1,30 @@
+import os
+import sys
+import json
+import subprocess
+import pytest
+
+script = os.path.join(os.path.dirname(os.path.abspath(__file__)),'..','tools','benchmark.py')
+
+
+# a baseline much faster than any run is a regression, unless the
+# threshold allows for it
+@pytest.mark.parametrize('build_time,threshold,returncode',[(1e-9,0.2,1),(1e9,0.2,0),
+                                                            (1e-9,1e12,0)])
+def test_compare_exit_code(tmp_path,build_time,threshold,returncode):
+    case = {'kind':'meta','engine':'numpy','steps':200,'n_cvs':1,'stride':10,'n_minima':0}
+    baseline = dict(case,build_time=build_time)
+    with open(tmp_path/'baseline.json','w') as file_out:
+        json.dump({'results':[baseline]},file_out)
+    process = subprocess.run([sys.executable,script,'--kinds','meta','--engines','numpy',
+                              '--steps','200','--n-cvs','1','--repeats','1',
+                              '--iterations','5','--threshold',str(threshold),
+                              '--output',str(tmp_path/'new.json'),
+                              '--compare',str(tmp_path/'baseline.json')],
+                             stdout=subprocess.PIPE,stderr=subprocess.PIPE,
+                             universal_newlines=True)
+    assert process.returncode == returncode
+    with open(tmp_path/'new.json','r') as file_in:
+        results = json.load(file_in)['results']
+    assert len(results) == 1 and 'build_time' in results[0]
+    assert ('SLOWER' in process.stdout) == (returncode == 1)
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+from conftest import solved,dense
+
+
+def replica_ct(it,counts,block_length):
+    """Iterate the self consistent equation with each frame counted as many times as its block."""
+    matrix = dense(it.bias_matrix)
+    multiplicity = counts[np.arange(it.n_evals)//block_length].astype(np.float64)
+    sampled = np.cumsum(multiplicity) > 0
+    ct = np.zeros(it.n_evals)
+    with np.errstate(divide='ignore',invalid='ignore'):
+        for iteration in range(1,it.iterations):
+            vec = multiplicity*np.exp((matrix.diagonal()-ct)/it.kT)
+            ct = -it.kT*np.log((np.tril(np.exp(-matrix/it.kT)) @ vec)/np.cumsum(vec))
+            ct[~sampled] = 0.0
+    ct[~sampled] = np.nan
+    return ct
+
+
+def test_single_block(meta):
+    it = solved(meta(),'numpy')
+    lower,upper = it.bootstrap_c_t(n_replicas=1,block_length=it.n_evals,seed=0)
+    np.testing.assert_allclose(it.bootstrap_ct[0],it.ct[-1],rtol=0,atol=1e-12)
+    np.testing.assert_allclose(lower,upper,rtol=0,atol=1e-12)
+    estimate,lower,upper = it.bootstrap_average(it.colvars[:,0])
+    assert lower == pytest.approx(estimate,abs=1e-12) and upper == pytest.approx(estimate,abs=1e-12)
+
+
+@pytest.mark.parametrize('storage',['dense','packed'])
+def test_replicas(meta,storage):
+    it = solved(meta(),'numpy',storage=storage)
+    lower,upper = it.bootstrap_c_t(n_replicas=8,block_length=4,seed=1)
+    assert it.bootstrap_ct.shape == (8,it.n_evals)
+    assert it.bootstrap_block_length == 4
+    for counts,ct in zip(it.bootstrap_counts,it.bootstrap_ct):
+        assert counts.sum() == len(counts)
+        np.testing.assert_allclose(ct,replica_ct(it,counts,4),rtol=0,atol=1e-10)
+    assert np.all(lower[np.isfinite(lower)] <= upper[np.isfinite(lower)])
+
+
+def test_reproducible_and_log_domain(meta):
+    it = solved(meta(),'numpy',n_threads=2)
+    it.bootstrap_c_t(n_replicas=10,seed=3)
+    replicas = it.bootstrap_ct.copy()
+    assert it.bootstrap_block_length == round(it.n_evals**(1/3))
+    it.log_domain = True
+    it.bootstrap_c_t(n_replicas=10,seed=3)
+    np.testing.assert_allclose(it.bootstrap_ct,replicas,rtol=0,atol=1e-10)
+
+
+def test_bootstrap_average(meta):
+    it = solved(meta(),'numpy')
+    it.bootstrap_c_t(n_replicas=20,seed=2)
+    observables = np.column_stack((it.colvars[:,0],it.colvars[:,1]**2))
+    estimate,lower,upper = it.bootstrap_average(observables)
+    weights = it.weights()
+    expected = weights.dot(observables[np.arange(it.n_evals)*it.stride])/weights.sum()
+    np.testing.assert_allclose(estimate,expected,rtol=1e-12)
+    assert estimate.shape == lower.shape == upper.shape == (2,)
+    assert np.all(lower <= upper)
+
+
+def test_bootstrap_errors(meta):
+    it = solved(meta(),'numpy')
+    with pytest.raises(ValueError):
+        it.bootstrap_average(it.colvars[:,0])
+    with pytest.raises(ValueError):
+        it.bootstrap_c_t(block_length=it.n_evals+1)
+    with pytest.raises(ValueError):
+        it.bootstrap_c_t(n_replicas=2,confidence=1.5)
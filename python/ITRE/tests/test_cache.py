@@ -0,0 +1,89 @@
+import os
+import logging
+import numpy as np
+import pytest
+from conftest import solved,assert_same_run,dense
+from itre.cache import BiasMatrixCache
+from itre.storage import PackedMatrix
+import itre
+
+
+def cached_files(cache_dir):
+    return sorted(name for name in os.listdir(cache_dir) if name.endswith('.npy'))
+
+
+def cache_size(cache_dir):
+    return sum(os.path.getsize(os.path.join(cache_dir,name)) for name in os.listdir(cache_dir))
+
+
+@pytest.mark.parametrize('storage',['dense','packed'])
+def test_cache_reloads_matrix(meta,tmp_path,monkeypatch,storage):
+    cache_dir = str(tmp_path/'cache')
+    reference = solved(meta(),'numpy',cache_dir=cache_dir,storage=storage)
+    assert len(cached_files(cache_dir)) == 1
+
+    def not_called(self):
+        raise AssertionError("The bias matrix should be loaded from the cache")
+    monkeypatch.setattr(itre.Itre,'calculate_bias_matrix',not_called)
+    it = solved(meta(),'numpy',cache_dir=cache_dir,storage=storage)
+    assert_same_run(it,reference,atol=0)
+    # kT does not enter the matrix
+    solved(meta(),'numpy',cache_dir=cache_dir,storage=storage,kT=2.0)
+    assert len(cached_files(cache_dir)) == 1
+
+
+def test_cache_keys(meta,tmp_path):
+    cache_dir = str(tmp_path/'cache')
+    solved(meta(),'numpy',cache_dir=cache_dir)
+    solved(meta(),'python',cache_dir=cache_dir)
+    it = meta(stride=6)
+    solved(it,'numpy',cache_dir=cache_dir)
+    it = meta()
+    it.heights = 2*it.heights
+    solved(it,'numpy',cache_dir=cache_dir)
+    assert len(cached_files(cache_dir)) == 4
+
+
+def test_cache_eviction(meta,tmp_path):
+    cache_dir = str(tmp_path/'cache')
+    solved(meta(),'numpy',cache_dir=cache_dir)
+    size = cache_size(cache_dir)
+    first = cached_files(cache_dir)
+    for name in os.listdir(cache_dir):
+        os.utime(os.path.join(cache_dir,name),(0,0))
+    solved(meta(seed=1),'numpy',cache_dir=cache_dir,cache_size=1.5*size/1e9)
+    assert len(cached_files(cache_dir)) == 1
+    assert cached_files(cache_dir) != first
+
+
+def test_cache_skips_large_matrix(meta,tmp_path,caplog):
+    cache_dir = str(tmp_path/'cache')
+    solved(meta(),'numpy',cache_dir=cache_dir)
+    first = cached_files(cache_dir)
+    # the new matrix alone exceeds the cache: it is not stored and the
+    # cached one is kept
+    with caplog.at_level(logging.WARNING):
+        solved(meta(seed=1),'numpy',cache_dir=cache_dir,cache_size=1e-9)
+    assert 'not stored' in caplog.text
+    assert cached_files(cache_dir) == first
+
+
+def test_cache_keeps_stored_matrix(tmp_path):
+    matrix = np.tril(np.random.default_rng(0).random((40,40)))
+    cache = BiasMatrixCache(str(tmp_path),max_size=matrix.nbytes+1000)
+    cache.store('old',matrix,truncation_error=0.0)
+    cache.store('new',2*matrix,truncation_error=1.0)
+    assert cached_files(str(tmp_path)) == ['new.npy']
+    loaded,info = cache.load('new')
+    np.testing.assert_array_equal(loaded,2*matrix)
+    assert info == {'truncation_error':1.0}
+
+
+def test_cache_loads_packed_by_blocks(tmp_path):
+    matrix = np.tril(np.random.default_rng(0).random((40,40)))
+    cache = BiasMatrixCache(str(tmp_path/'cache'),block_size=7)
+    cache.store('packed',PackedMatrix.from_dense(matrix),truncation_error=0.0)
+    loaded,info = cache.load('packed',str(tmp_path/'matrix.dat'))
+    assert isinstance(loaded,PackedMatrix)
+    np.testing.assert_array_equal(dense(loaded),matrix)
+    assert info == {'truncation_error':0.0}
@@ -0,0 +1,38 @@
+import json
+import numpy as np
+import pytest
+from conftest import synthetic_meta,solved
+from itre.cli import build_parser,main
+
+
+def test_list_directives(capsys):
+    assert main(['--list-directives']) == 0
+    assert 'engine' in capsys.readouterr().out
+    args = build_parser().parse_args(['run.json','--list-directives'])
+    assert args.directives == 'run.json' and args.print_directives
+
+
+@pytest.mark.parametrize('output_format',['txt','npy'])
+def test_run(tmp_path,output_format):
+    reference = solved(synthetic_meta(),'numpy')
+    for name in ['colvars','sigmas','heights']:
+        np.savetxt(str(tmp_path/name.upper()),getattr(reference,name),fmt='%.17g')
+    directives = {'colvars_file':str(tmp_path/'COLVARS'),'sigmas_file':str(tmp_path/'SIGMAS'),
+                  'heights_file':str(tmp_path/'HEIGHTS'),'starting_height':reference.heights[0],
+                  'boundaries':[-np.pi,np.pi,-np.pi,np.pi],'stride':20}
+    with open(tmp_path/'pyitre.json','w') as file_out:
+        json.dump(directives,file_out)
+    reference.wall = np.zeros(reference.steps)
+    reference.has_matrix = False
+    solved(reference,'numpy')
+    output_dir = tmp_path/'results'
+    assert main([str(tmp_path/'pyitre.json'),'--engine','numpy','--stride',str(reference.stride),
+                 '--output-dir',str(output_dir),'--format',output_format]) == 0
+    load = np.load if output_format == 'npy' else np.loadtxt
+    extension = 'npy' if output_format == 'npy' else 'dat'
+    for name in ['c_t','instantaneous_bias','weights']:
+        assert (output_dir/'{}.{}'.format(name,extension)).exists()
+    np.testing.assert_allclose(load(output_dir/'c_t.{}'.format(extension)),reference.ct[-1],
+                               rtol=0,atol=1e-12)
+    np.testing.assert_allclose(load(output_dir/'instantaneous_bias.{}'.format(extension)),
+                               reference.instantaneous_bias,rtol=0,atol=1e-12)
@@ -0,0 +1,116 @@
+import numpy as np
+import pytest
+from conftest import solved,dense,assert_same_run
+from itre.hills import covariance_matrices,inverse_cholesky
+import itre
+
+
+def random_covariances(n_hills,dims,seed=0):
+    """Symmetric positive definite matrices with correlated CVs."""
+    factors = np.random.default_rng(seed).normal(scale=0.15,size=(n_hills,dims,dims))
+    return np.einsum('kab,kcb->kac',factors,factors)+0.09*np.eye(dims)
+
+
+def as_covariances(sigmas):
+    """The diagonal covariance matrices of hills with a sigma per CV."""
+    return np.einsum('ka,ab->kab',sigmas**2,np.eye(sigmas.shape[1]))
+
+
+def brute_force_matrix(it):
+    frames = np.arange(it.n_evals)*it.stride
+    inverse = np.linalg.inv(it.sigmas)
+    matrix = np.zeros((it.n_evals,it.n_evals))
+    for j in range(it.n_evals):
+        n_hills = frames[j]
+        for i in range(j+1):
+            dist = it.colvars[frames[i]]-it.colvars[:n_hills]
+            dist -= it.boundary_lengths*np.rint(dist/it.boundary_lengths)
+            exponent = np.einsum('ka,kab,kb->k',dist,inverse[:n_hills],dist)
+            matrix[j,i] = np.sum(it.heights[:n_hills]*np.exp(-0.5*exponent))+it.wall[frames[i]]
+    return matrix
+
+
+def test_covariance_matrices():
+    covariances = random_covariances(5,3)
+    rows,cols = np.tril_indices(3)
+    np.testing.assert_array_equal(covariance_matrices(covariances[:,rows,cols],3),covariances)
+    np.testing.assert_array_equal(covariance_matrices(covariances.reshape(5,9),3),covariances)
+    with pytest.raises(ValueError):
+        covariance_matrices(covariances.reshape(5,9)[:,:4],3)
+    factors = inverse_cholesky(covariances)
+    np.testing.assert_allclose(np.einsum('kba,kbc->kac',factors,factors),
+                               np.linalg.inv(covariances),rtol=1e-10,atol=1e-10)
+
+
+@pytest.mark.parametrize('engine',['python','numpy','parallel','tiled'])
+def test_diagonal_covariance_meta(meta,tmp_path,engine):
+    reference = solved(meta(),'python')
+    it = meta()
+    it.sigmas = as_covariances(it.sigmas)
+    solved(it,engine,work_dir=str(tmp_path),tile_size=7)
+    assert_same_run(it,reference)
+
+
+@pytest.mark.parametrize('engine',['python','parallel','tiled'])
+def test_diagonal_covariance_atlas(atlas,tmp_path,engine):
+    reference = solved(atlas(),'python')
+    it = atlas()
+    it.sigmas = as_covariances(it.sigmas)
+    solved(it,engine,work_dir=str(tmp_path),tile_size=7)
+    assert_same_run(it,reference,atol=1e-9)
+
+
+@pytest.mark.parametrize('engine',['python','numpy','parallel','tiled'])
+def test_full_covariance_meta(meta,tmp_path,engine):
+    it = meta()
+    it.sigmas = random_covariances(it.steps,2)
+    solved(it,engine,work_dir=str(tmp_path),tile_size=7)
+    np.testing.assert_allclose(dense(it.bias_matrix),brute_force_matrix(it),rtol=0,atol=1e-10)
+
+
+@pytest.mark.parametrize('engine',['parallel','tiled'])
+def test_full_covariance_atlas(atlas,tmp_path,engine):
+    it = atlas()
+    covariances = np.zeros((it.steps,6,6))
+    for start in range(0,6,2):
+        covariances[:,start:start+2,start:start+2] = random_covariances(it.steps,2,seed=start)
+    it.sigmas = covariances
+    reference = atlas()
+    reference.sigmas = covariances
+    solved(reference,'python')
+    solved(it,engine,work_dir=str(tmp_path),tile_size=7)
+    assert_same_run(it,reference,atol=1e-9)
+
+
+@pytest.mark.parametrize('engine',['numba','cutoff','grid'])
+def test_covariance_unsupported(meta,engine):
+    it = meta()
+    it.sigmas = as_covariances(it.sigmas)
+    it.engine = engine
+    with pytest.raises(ValueError):
+        it.calculate_bias_matrix()
+
+
+def test_follow_covariance(meta,tmp_path):
+    converged = {'iterations':500,'tolerance':1e-12}
+    reference = meta()
+    reference.sigmas = random_covariances(reference.steps,2)
+    solved(reference,'python',**converged)
+    rows,cols = np.tril_indices(2)
+    columns = {'COLVARS':reference.colvars,'SIGMAS':reference.sigmas[:,rows,cols],
+               'HEIGHTS':reference.heights,'WALL':reference.wall}
+    directives = {'{}_file'.format(name.lower()):str(tmp_path/name) for name in columns}
+    directives.update(converged)
+    directives.update({'stride':reference.stride,'engine':'numpy','sigmas_format':'covariance',
+                       'starting_height':reference.heights[0],
+                       'boundaries':list(reference.boundaries)})
+    for name in columns:
+        open(tmp_path/name,'w').close()
+    follow = itre.Follow(directives,output_dir=str(tmp_path))
+    for start in range(0,reference.steps,70):
+        for name,array in columns.items():
+            with open(tmp_path/name,'a') as file_out:
+                np.savetxt(file_out,array[start:start+70],fmt='%.17g')
+        follow.update()
+    np.testing.assert_allclose(follow.itre.sigmas,reference.sigmas,rtol=1e-15)
+    assert_same_run(follow.itre,reference,atol=1e-9)
@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+from conftest import solved,dense,assert_same_run
+
+
+@pytest.mark.parametrize('periodic',[True,False])
+def test_cutoff_matches_python_meta(meta,periodic):
+    reference = solved(meta(periodic=periodic),'python')
+    it = solved(meta(periodic=periodic),'cutoff',cutoff=40.0)
+    assert_same_run(it,reference)
+
+
+@pytest.mark.parametrize('residual',[True,False])
+def test_cutoff_matches_python_atlas(atlas,residual):
+    reference = solved(atlas(residual=residual),'python')
+    it = solved(atlas(residual=residual),'cutoff',cutoff=40.0)
+    assert_same_run(it,reference,atol=1e-9)
+
+
+@pytest.mark.parametrize('kind',['meta','atlas'])
+def test_cutoff_truncation_error(meta,atlas,kind):
+    make = meta if kind == 'meta' else atlas
+    reference = solved(make(),'python')
+    it = solved(make(),'cutoff',cutoff=2.0)
+    error = np.amax(np.abs(dense(it.bias_matrix)-dense(reference.bias_matrix)))
+    assert 0 < error <= it.truncation_error
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from conftest import solved,assert_same_run,split
+
+converged = {'iterations':500,'tolerance':1e-12}
+
+
+@pytest.mark.parametrize('n_first',[100,123])
+@pytest.mark.parametrize('engine',['python','numpy'])
+def test_extend_matches_full_meta(meta,engine,n_first):
+    reference = solved(meta(),'python',**converged)
+    it = meta()
+    rest = split(it,n_first)
+    solved(it,engine,**converged)
+    it.extend(*rest)
+    assert it.n_evals == reference.n_evals
+    assert_same_run(it,reference,atol=1e-9)
+
+
+def test_extend_matches_full_atlas(atlas):
+    reference = solved(atlas(),'python',**converged)
+    it = atlas()
+    rest = split(it,97)
+    solved(it,'python',**converged)
+    it.extend(*rest)
+    assert_same_run(it,reference,atol=1e-9)
+
+
+def test_extend_in_pieces(meta):
+    reference = solved(meta(),'python',**converged)
+    it = meta()
+    rest = split(it,40)
+    solved(it,'python',**converged)
+    for start in range(0,len(rest[0]),50):
+        it.extend(*[el[start:start+50] for el in rest])
+    assert_same_run(it,reference,atol=1e-9)
+
+
+def test_extend_without_calculation(meta):
+    reference = solved(meta(),'python')
+    it = meta()
+    rest = split(it,100)
+    it.engine = 'python'
+    it.extend(*rest)
+    assert_same_run(it,reference)
+    np.testing.assert_array_equal(it.colvars,reference.colvars)
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from conftest import synthetic_meta,solved,assert_same_run
+import itre
+
+converged = {'iterations':500,'tolerance':1e-12}
+
+
+def write_frames(tmp_path,reference,start,stop):
+    """Append the frames from start to stop of reference to the followed files."""
+    for name in ['colvars','sigmas','heights','wall']:
+        with open(tmp_path/name.upper(),'a') as file_out:
+            np.savetxt(file_out,np.reshape(getattr(reference,name)[start:stop],(stop-start,-1)))
+
+
+def follower(tmp_path,reference):
+    directives = {'{}_file'.format(name):str(tmp_path/name.upper())
+                  for name in ['colvars','sigmas','heights','wall']}
+    directives.update(converged)
+    directives.update({'stride':reference.stride,'engine':'numpy',
+                       'starting_height':reference.heights[0],
+                       'boundaries':list(reference.boundaries)})
+    for name in ['colvars','sigmas','heights','wall']:
+        open(tmp_path/name.upper(),'w').close()
+    return itre.Follow(directives,output_dir=str(tmp_path))
+
+
+def test_follow_matches_full(tmp_path):
+    reference = solved(synthetic_meta(),'python',**converged)
+    follow = follower(tmp_path,reference)
+    n_evals = 0
+    for start in range(0,reference.steps,70):
+        write_frames(tmp_path,reference,start,min(start+70,reference.steps))
+        n_evals += follow.update()
+        follow.write()
+    assert n_evals == reference.n_evals
+    assert_same_run(follow.itre,reference,atol=1e-9)
+    np.testing.assert_allclose(np.loadtxt(tmp_path/'c_t.dat'),reference.ct[-1],atol=1e-9)
+
+
+def test_follow_short_start(tmp_path):
+    reference = solved(synthetic_meta(),'python',**converged)
+    follow = follower(tmp_path,reference)
+    assert follow.update() == 0
+    # fewer frames than the stride: nothing is evaluated and they are kept
+    write_frames(tmp_path,reference,0,reference.stride-3)
+    assert follow.update() == 0
+    assert follow.itre.colvars is None
+    write_frames(tmp_path,reference,reference.stride-3,reference.stride-1)
+    assert follow.update() == 0
+    write_frames(tmp_path,reference,reference.stride-1,100)
+    assert follow.update() == 100//reference.stride
+    write_frames(tmp_path,reference,100,reference.steps)
+    follow.update()
+    np.testing.assert_array_equal(follow.itre.colvars,reference.colvars)
+    assert_same_run(follow.itre,reference,atol=1e-9)
+
+
+def test_follow_rejects_hills_file(tmp_path):
+    directives = {'colvars_file':str(tmp_path/'COLVAR'),'hills_file':str(tmp_path/'HILLS')}
+    with pytest.raises(ValueError,match='hills_file'):
+        itre.Follow(directives,output_dir=str(tmp_path))
+
+
+def test_too_short_trajectory():
+    it = synthetic_meta(steps=5,stride=8)
+    assert it.n_evals == 0
+    with pytest.raises(ValueError):
+        it.calculate_bias_matrix()
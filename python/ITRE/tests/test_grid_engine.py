@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+from conftest import solved,dense,assert_same_run
+
+
+@pytest.mark.parametrize('n_cvs',[1,2])
+def test_grid_matches_python(meta,n_cvs):
+    reference = solved(meta(n_cvs=n_cvs),'python')
+    it = solved(meta(n_cvs=n_cvs),'grid')
+    assert_same_run(it,reference,atol=5e-2)
+    error = np.amax(np.abs(dense(it.bias_matrix)-dense(reference.bias_matrix)))
+    assert it.interpolation_error <= error
+
+
+def test_grid_converges_with_bins(meta):
+    reference = solved(meta(n_cvs=1),'python')
+    errors = []
+    for bins in [50,200,800]:
+        it = solved(meta(n_cvs=1),'grid',grid_bins=bins)
+        errors.append(np.amax(np.abs(dense(it.bias_matrix)-dense(reference.bias_matrix))))
+    assert errors[0] > errors[1] > errors[2]
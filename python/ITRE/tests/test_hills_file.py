@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+from conftest import synthetic_meta,solved,assert_same_run
+from itre.hills import read_hills,deposited_hills
+import itre
+
+pace,dt,biasf = 3,0.002,10.0
+
+
+def write_plumed_files(tmp_path,it):
+    """Write the CVs of it in a COLVAR file and a hill every pace frames in a HILLS file."""
+    times = np.arange(it.steps)*dt
+    with open(tmp_path/'COLVAR','w') as file_out:
+        file_out.write('#! FIELDS time d1.x d1.y metad.bias\n')
+        np.savetxt(file_out,np.column_stack((times,it.colvars,np.zeros(it.steps))),fmt='%.17g')
+    deposited = np.arange(0,it.steps,pace)
+    with open(tmp_path/'HILLS','w') as file_out:
+        file_out.write('#! FIELDS time d1.x d1.y sigma_d1.x sigma_d1.y height biasf\n')
+        file_out.write('#! SET multivariate false\n')
+        np.savetxt(file_out,np.column_stack((times[deposited],it.colvars[deposited],
+                                             it.sigmas[deposited],
+                                             it.heights[deposited]*biasf/(biasf-1),
+                                             np.full(len(deposited),biasf))),fmt='%.17g')
+    return deposited
+
+
+def padded_reference(it,deposited):
+    """The same run with the heights of the frames without a hill set to zero."""
+    heights = np.zeros(it.steps)
+    heights[deposited] = it.heights[deposited]
+    it.heights = heights/heights[0]
+    it.wall = np.zeros(it.steps)
+    return it
+
+
+def sparse_run(tmp_path,engine,**directives):
+    it = itre.Itre()
+    directives.update({'colvars_file':str(tmp_path/'COLVAR'),'colvars_fields':['d1.x','d1.y'],
+                       'hills_file':str(tmp_path/'HILLS'),'stride':8,'engine':engine,
+                       'boundaries':[-np.pi,np.pi,-np.pi,np.pi],'cutoff':40.0})
+    it.from_dict(directives)
+    it.calculate_c_t()
+    return it
+
+
+def test_read_hills(tmp_path):
+    it = synthetic_meta()
+    deposited = write_plumed_files(tmp_path,it)
+    times,centers,sigmas,heights = read_hills(str(tmp_path/'HILLS'))
+    np.testing.assert_allclose(times,deposited*dt,rtol=1e-15)
+    np.testing.assert_array_equal(centers,it.colvars[deposited])
+    np.testing.assert_array_equal(sigmas,it.sigmas[deposited])
+    np.testing.assert_allclose(heights,it.heights[deposited],rtol=1e-14)
+
+
+def test_deposited_hills():
+    hill_times = np.array([0.0,0.006,0.012])
+    times = np.array([0.0,0.002,0.006,0.0060001,0.008,0.014])
+    np.testing.assert_array_equal(deposited_hills(hill_times,times),[0,1,1,2,2,3])
+
+
+@pytest.mark.parametrize('engine',['numpy','parallel','cutoff'])
+def test_hills_file_matches_padded(tmp_path,engine):
+    it = synthetic_meta()
+    deposited = write_plumed_files(tmp_path,it)
+    reference = solved(padded_reference(it,deposited),'python')
+    sparse = sparse_run(tmp_path,engine)
+    assert len(sparse.hill_times) == len(deposited)
+    assert_same_run(sparse,reference,atol=1e-9)
+    counts = deposited_hills(sparse.hill_times,sparse.times[np.arange(sparse.n_evals)*sparse.stride])
+    assert sparse.timings.kernel_evaluations == sparse.n_evals*counts[-1]
+
+
+@pytest.mark.parametrize('schedule',['geometric','adaptive'])
+def test_hills_file_schedule(tmp_path,schedule):
+    it = synthetic_meta()
+    deposited = write_plumed_files(tmp_path,it)
+    sparse = sparse_run(tmp_path,'numpy',schedule=schedule,schedule_evals=12)
+    reference = padded_reference(it,deposited)
+    reference.set_schedule(sparse.eval_frames)
+    solved(reference,'python')
+    assert_same_run(sparse,reference,atol=1e-9)
+
+
+@pytest.mark.parametrize('engine',['python','numba','grid','tiled'])
+def test_hills_file_unsupported(tmp_path,engine):
+    write_plumed_files(tmp_path,synthetic_meta())
+    with pytest.raises(ValueError):
+        sparse_run(tmp_path,engine,work_dir=str(tmp_path/'work'))
@@ -0,0 +1,41 @@
+import json
+import numpy as np
+import pytest
+from conftest import synthetic_meta,solved,walkers
+
+
+@pytest.mark.parametrize('engine',['python','numpy','cutoff'])
+def test_kernel_evaluations(meta,engine):
+    it = solved(meta(),engine)
+    expected = it.n_evals*(it.n_evals-1)*it.stride
+    assert it.timings.kernel_evaluations == expected
+    assert it.timing_report['phases']['calculate_bias_matrix']['kernel_evaluations'] == expected
+
+
+def test_walker_kernel_evaluations():
+    it = walkers()
+    it.calculate_c_t()
+    frames = np.arange(it.n_evals)*it.stride
+    assert it.timings.kernel_evaluations == 2*it.n_evals*frames[-1]*2
+
+
+def test_no_evaluated_frames():
+    it = synthetic_meta(steps=5,stride=8)
+    with pytest.raises(ValueError):
+        it.calculate_bias_matrix()
+    assert it.timings.kernel_evaluations == 0
+    it = walkers(stride=200)
+    with pytest.raises(ValueError):
+        it.calculate_walker_bias_matrices()
+
+
+def test_timing_file(meta,tmp_path):
+    progress = []
+    it = meta()
+    it.progress_callback = lambda *args: progress.append(args)
+    solved(it,'numpy',timing_file=str(tmp_path/'timings.json'))
+    with open(tmp_path/'timings.json') as file_in:
+        report = json.load(file_in)
+    assert set(['calculate_c_t','calculate_bias_matrix']) <= set(report['phases'])
+    assert report['kernel_evaluations'] == it.timings.kernel_evaluations
+    assert len(progress) > 0
@@ -0,0 +1,15 @@
+from conftest import solved,assert_same_run
+from itre import metadynamics,atlas
+from itre.utils import LazyJit
+
+
+def test_compile_leaves_module_globals(meta):
+    reference = solved(meta(),'python')
+    it = solved(meta(),'parallel')
+    assert_same_run(it,reference)
+    for module in [metadynamics,atlas]:
+        assert module.prange is range
+        kernels = [value for name,value in vars(module).items() if name.endswith('_nb')]
+        assert len(kernels) > 0
+        assert all(isinstance(kernel,LazyJit) for kernel in kernels)
+    assert metadynamics.Metadynamics._bias_matrix_parallel.dispatcher is not None
@@ -0,0 +1,89 @@
+import os
+import glob
+import numpy as np
+import pytest
+from conftest import synthetic_meta,solved,assert_same_run
+from itre.loader import read_fields,read_settings,load_columns
+import itre
+
+fields = ['time','d1.x','d1.y','sigma_d1.x','sigma_d1.y','height','biasf']
+
+
+def write_hills(filename,it,restart=None):
+    """Write the hills of it as a HILLS file, with the header repeated at restart."""
+    table = np.column_stack((np.arange(it.steps),it.colvars,it.sigmas,it.heights,
+                             np.full(it.steps,10.0)))
+    header = '#! FIELDS {}\n#! SET multivariate false\n#! SET min_d1.x -pi\n'.format(' '.join(fields))
+    with open(filename,'w') as file_out:
+        file_out.write(header)
+        np.savetxt(file_out,table[:restart],fmt='%.17g')
+        if restart is not None:
+            file_out.write(header)
+            np.savetxt(file_out,table[restart:],fmt='%.17g')
+
+
+def sidecars(filename):
+    return glob.glob(os.path.join(os.path.dirname(filename),'.*.itre.npy'))
+
+
+def test_header(tmp_path):
+    filename = str(tmp_path/'HILLS')
+    write_hills(filename,synthetic_meta(steps=10))
+    assert read_fields(filename) == fields
+    assert read_settings(filename) == {'multivariate':'false','min_d1.x':'-pi'}
+
+
+@pytest.mark.parametrize('sidecar',[True,False])
+def test_load_columns(tmp_path,sidecar):
+    it = synthetic_meta(steps=50)
+    filename = str(tmp_path/'HILLS')
+    write_hills(filename,it,restart=20)
+    for repeat in range(2):
+        np.testing.assert_array_equal(load_columns(filename,['d1.x','d1.y'],sidecar),it.colvars)
+        np.testing.assert_array_equal(load_columns(filename,'height',sidecar),it.heights)
+        np.testing.assert_array_equal(load_columns(filename,[3,4],sidecar),it.sigmas)
+        assert len(sidecars(filename)) == (1 if sidecar else 0)
+    with pytest.raises(ValueError):
+        load_columns(filename,'d2.x',sidecar)
+
+
+def test_sidecar_views(tmp_path):
+    it = synthetic_meta(steps=50)
+    filename = str(tmp_path/'HILLS')
+    write_hills(filename,it)
+    load_columns(filename)
+    # the second load memory maps the sidecar, and only the columns that
+    # are not consecutive are copied
+    for fields in [None,'height',['d1.x','d1.y'],[-1]]:
+        assert isinstance(load_columns(filename,fields),np.memmap)
+    selected = load_columns(filename,['d1.y','d1.x'])
+    assert not isinstance(selected,np.memmap)
+    np.testing.assert_array_equal(selected,it.colvars[:,::-1])
+    np.testing.assert_array_equal(load_columns(filename,[-1]),np.full(it.steps,10.0))
+
+
+def test_stale_sidecar(tmp_path):
+    filename = str(tmp_path/'HILLS')
+    write_hills(filename,synthetic_meta(steps=50))
+    load_columns(filename,'height')
+    first = sidecars(filename)
+    it = synthetic_meta(steps=60,seed=1)
+    write_hills(filename,it)
+    np.testing.assert_array_equal(load_columns(filename,'height'),it.heights)
+    assert len(sidecars(filename)) == 1 and sidecars(filename) != first
+
+
+def test_from_dict_fields(tmp_path):
+    reference = solved(synthetic_meta(),'numpy')
+    filename = str(tmp_path/'HILLS')
+    write_hills(filename,reference,restart=100)
+    np.savetxt(str(tmp_path/'WALL'),reference.wall,fmt='%.17g')
+    it = itre.Itre()
+    it.from_dict({'colvars_file':filename,'colvars_fields':['d1.x','d1.y'],
+                  'sigmas_file':filename,'sigmas_fields':['sigma_d1.x','sigma_d1.y'],
+                  'heights_file':filename,'heights_fields':'height',
+                  'wall_file':str(tmp_path/'WALL'),'stride':reference.stride,
+                  'starting_height':reference.heights[0],
+                  'boundaries':[-np.pi,np.pi,-np.pi,np.pi],'engine':'numpy'})
+    it.calculate_c_t()
+    assert_same_run(it,reference,atol=1e-12)
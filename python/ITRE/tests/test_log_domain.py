@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from conftest import solved,dense,assert_same_run
+
+
+def log_domain_ct(matrix,iterations,kT=1.0):
+    """Iterate the self consistent equation with log-sum-exp on a dense matrix."""
+    matrix = dense(matrix)
+    instantaneous = matrix.diagonal()
+    lower = np.tril(np.ones(matrix.shape,dtype=bool))
+    ct = np.zeros(len(matrix))
+    for iteration in range(1,iterations):
+        log_vec = (instantaneous-ct)/kT
+        terms = np.where(lower,-matrix/kT+log_vec,-np.inf)
+        ct = -kT*(np.logaddexp.reduce(terms,axis=1)-np.logaddexp.accumulate(log_vec))
+    return ct
+
+
+@pytest.mark.parametrize('storage',['dense','packed'])
+@pytest.mark.parametrize('kind',['meta','atlas'])
+def test_log_domain_matches_linear(meta,atlas,kind,storage):
+    make = meta if kind == 'meta' else atlas
+    reference = solved(make(),'python')
+    it = solved(make(),'python',log_domain=True,storage=storage)
+    assert_same_run(it,reference,atol=1e-10)
+
+
+@pytest.mark.parametrize('block_size',[None,40])
+def test_log_domain_large_bias(meta,block_size):
+    it = meta()
+    it.heights = 200*it.heights
+    linear = meta()
+    linear.heights = it.heights
+    with np.errstate(over='ignore',invalid='ignore',divide='ignore'):
+        solved(linear,'numpy')
+    assert not np.all(np.isfinite(linear.ct[-1]))
+    solved(it,'numpy',log_domain=True,block_size=block_size,storage='packed')
+    assert np.all(np.isfinite(it.ct[-1]))
+    np.testing.assert_allclose(it.ct[-1],log_domain_ct(it.bias_matrix,it.iterations),
+                               rtol=1e-12)
+
+
+@pytest.mark.parametrize('storage',['dense','packed'])
+def test_single_precision(meta,storage):
+    reference = solved(meta(),'python')
+    it = solved(meta(),'numpy',log_domain=True,storage=storage,matrix_dtype='float32',
+                compute_dtype='float32')
+    np.testing.assert_allclose(it.ct[-1],reference.ct[-1],rtol=0,atol=1e-5)
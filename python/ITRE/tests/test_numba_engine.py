@@ -0,0 +1,34 @@
+import pytest
+from conftest import solved,assert_same_run
+from itre.metadynamics import Metadynamics
+
+
+@pytest.mark.parametrize('n_cvs',[1,2])
+@pytest.mark.parametrize('periodic',[True,False])
+def test_numba_matches_python(meta,n_cvs,periodic):
+    reference = solved(meta(n_cvs=n_cvs,periodic=periodic),'python')
+    it = solved(meta(n_cvs=n_cvs,periodic=periodic),'numba')
+    assert_same_run(it,reference)
+
+
+def test_use_numba(meta):
+    reference = solved(meta(),'numba')
+    it = meta()
+    it.use_numba = True
+    it.calculate_c_t()
+    assert_same_run(it,reference,atol=0)
+
+
+def test_explicit_signatures(meta):
+    solved(meta(),'parallel')
+    dispatcher = Metadynamics._bias_matrix_parallel.compile()
+    assert len(dispatcher.signatures) >= len(Metadynamics._bias_matrix_parallel.signatures) > 0
+
+
+def test_read_only_inputs(meta):
+    reference = solved(meta(),'python')
+    it = meta()
+    for name in ['colvars','sigmas','heights','wall']:
+        getattr(it,name).flags.writeable = False
+    solved(it,'parallel')
+    assert_same_run(it,reference)
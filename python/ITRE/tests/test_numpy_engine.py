@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+from conftest import solved,assert_same_run
+
+
+@pytest.mark.parametrize('periodic',[True,False])
+@pytest.mark.parametrize('n_cvs',[1,2])
+def test_numpy_matches_python(meta,periodic,n_cvs):
+    reference = solved(meta(n_cvs=n_cvs,periodic=periodic),'python')
+    it = solved(meta(n_cvs=n_cvs,periodic=periodic),'numpy')
+    assert_same_run(it,reference)
+
+
+def test_numpy_bias_matrix(meta):
+    reference = meta()
+    reference.engine = 'python'
+    it = meta()
+    it.engine = 'numpy'
+    np.testing.assert_allclose(it.calculate_bias_matrix(),reference.calculate_bias_matrix(),
+                               rtol=0,atol=1e-10)
@@ -0,0 +1,23 @@
+import pytest
+from conftest import solved,assert_same_run
+
+
+@pytest.mark.parametrize('n_threads',[None,1])
+@pytest.mark.parametrize('periodic',[True,False])
+def test_parallel_matches_python_meta(meta,periodic,n_threads):
+    reference = solved(meta(periodic=periodic),'python')
+    it = solved(meta(periodic=periodic),'parallel',n_threads=n_threads)
+    assert_same_run(it,reference)
+
+
+def test_parallel_matches_python_single_cv(meta):
+    reference = solved(meta(n_cvs=1),'python')
+    it = solved(meta(n_cvs=1),'parallel')
+    assert_same_run(it,reference)
+
+
+@pytest.mark.parametrize('residual',[True,False])
+def test_parallel_matches_python_atlas(atlas,residual):
+    reference = solved(atlas(residual=residual),'python')
+    it = solved(atlas(residual=residual),'parallel')
+    assert_same_run(it,reference,atol=1e-9)
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+from conftest import solved
+
+
+def frame_bias(it):
+    """A bias in every frame, equal to the instantaneous bias in the evaluated ones."""
+    frames = np.arange(it.n_evals)*it.stride
+    bias = np.interp(np.arange(it.steps),frames,it.instantaneous_bias)+0.1*np.sin(np.arange(it.steps))
+    bias[frames] = it.instantaneous_bias
+    return bias
+
+
+def test_weights_evaluated_frames(meta):
+    it = solved(meta(),'numpy')
+    log_w = it.instantaneous_bias-it.ct[-1]
+    np.testing.assert_allclose(it.weights(log=True),log_w,rtol=1e-14)
+    np.testing.assert_allclose(it.weights(),np.exp(log_w-log_w.max()),rtol=1e-12)
+
+
+def test_weights_all_frames(meta):
+    it = solved(meta(),'numpy',kT=1.5)
+    bias = frame_bias(it)
+    frames = np.arange(it.n_evals)*it.stride
+    log_w = it.weights(bias,log=True)
+    assert len(log_w) == it.steps
+    ct = np.interp(np.arange(it.steps),frames,it.ct[-1])
+    np.testing.assert_allclose(log_w,(bias-ct)/1.5,rtol=1e-13)
+    np.testing.assert_allclose(log_w[frames],it.weights(log=True),rtol=1e-13)
+
+
+@pytest.mark.parametrize('chunk_size',[7,100000])
+def test_free_energy_histogram(meta,chunk_size):
+    it = solved(meta(),'numpy')
+    bias = frame_bias(it)
+    fes,centers = it.free_energy(bins=[12,9],bias=bias,chunk_size=chunk_size)
+    assert fes.shape == (12,9)
+    weights = it.weights(bias)
+    counts,edges_x,edges_y = np.histogram2d(it.colvars[:,0],it.colvars[:,1],bins=[12,9],
+                                            weights=weights)
+    with np.errstate(divide='ignore'):
+        expected = -it.kT*np.log(counts)
+    expected -= np.amin(expected)
+    np.testing.assert_allclose(fes,expected,rtol=0,atol=1e-10)
+    np.testing.assert_allclose(centers[0],0.5*(edges_x[1:]+edges_x[:-1]),rtol=1e-14)
+
+
+def test_free_energy_kde(meta):
+    it = solved(meta(n_cvs=1),'numpy')
+    fes,centers = it.free_energy(bins=20,ranges=[[-np.pi,np.pi]],bandwidth=0.3,chunk_size=5)
+    weights = it.weights()
+    cvs = np.reshape(it.colvars,-1)[np.arange(it.n_evals)*it.stride]
+    density = np.sum(weights*np.exp(-0.5*((centers[0][:,np.newaxis]-cvs)/0.3)**2),axis=1)
+    expected = -np.log(density)
+    np.testing.assert_allclose(fes,expected-np.amin(expected),rtol=0,atol=1e-10)
+
+
+def test_weights_before_c_t(meta):
+    with pytest.raises(ValueError):
+        meta().weights()
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+from conftest import solved
+
+converged = {'iterations':2000,'tolerance':1e-11}
+
+
+@pytest.mark.parametrize('kind',['meta','atlas'])
+def test_scan_matches_single_points(meta,atlas,kind):
+    make = meta if kind == 'meta' else atlas
+    kT_values = np.array([[0.8],[1.0],[2.0]])
+    h0 = make().heights[0]
+    starting_heights = np.array([h0,1.5*h0])
+    it = solved(make(),'numpy' if kind == 'meta' else 'python',**converged)
+    scan = it.scan_c_t(kT_values,starting_heights)
+    assert scan.shape == (6,it.n_evals)
+    for point,(kT,height) in enumerate(zip(*[el.reshape(-1) for el in
+                                             np.broadcast_arrays(kT_values,starting_heights)])):
+        single = make()
+        single.heights = single.heights*height/h0
+        solved(single,'python',kT=kT,**converged)
+        np.testing.assert_allclose(scan[point],single.ct[-1],rtol=0,atol=1e-8)
+
+
+def test_scan_without_rescaling(meta):
+    reference = solved(meta(),'python',**converged)
+    it = meta()
+    it.engine = 'numpy'
+    it.iterations = converged['iterations']
+    it.tolerance = converged['tolerance']
+    scan = it.scan_c_t(1.0)
+    np.testing.assert_allclose(scan[0],reference.ct[-1],rtol=0,atol=1e-9)
+    assert it.scan_ct is scan
@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+from conftest import solved,dense,assert_same_run,split
+from itre.schedule import check_frames,geometric_frames,adaptive_frames,window_sums
+
+frame_lists = {'meta':[0,1,2,5,9,14,30,31,60,100,150,200,239],
+               'atlas':[0,1,2,5,9,14,30,31,60,100,150,179]}
+
+
+def test_geometric_frames():
+    frames = geometric_frames(1000,20,5)
+    assert frames[0] == 0 and frames[-1] == 999 and len(frames) == 20
+    spacings = np.diff(frames)
+    assert spacings[0] == 5 and np.all(np.diff(spacings) >= -1)
+    np.testing.assert_array_equal(geometric_frames(100,50,5),np.arange(0,100,5))
+
+
+def test_adaptive_frames():
+    rate = np.concatenate((np.full(100,10.0),np.full(900,0.1)))
+    frames = adaptive_frames(rate,20,min_spacing=3)
+    assert frames[0] == 0 and np.all(np.diff(frames) >= 3)
+    assert np.sum(frames < 100) > np.sum(frames >= 100)
+    np.testing.assert_array_equal(adaptive_frames(np.zeros(100),11),np.append(np.arange(0,100,10),99))
+
+
+def test_check_frames():
+    np.testing.assert_array_equal(check_frames([0.0,3.0,7.0],10),[0,3,7])
+    for frames in [[],[1,3],[0,3,3],[0,2.5],[0,10]]:
+        with pytest.raises(ValueError):
+            check_frames(frames,10)
+
+
+def test_window_sums():
+    values = np.arange(1.0,13.0)
+    frames = [2,4,4,7,7,7,14]
+    np.testing.assert_array_equal(window_sums(values,frames),[3.0,0.0,12.0,0.0,0.0,63.0])
+    np.testing.assert_array_equal(window_sums(values,[2,6,9]),[10.0,18.0])
+
+
+def schedule_run(make,schedule,engine,**directives):
+    it = make()
+    it.schedule = schedule
+    it.schedule_evals = 15
+    it.set_schedule()
+    return solved(it,engine,**directives)
+
+
+def brute_force_matrix(it):
+    frames = it.eval_frames
+    matrix = np.zeros((it.n_evals,it.n_evals))
+    for j in range(it.n_evals):
+        n_hills = frames[j]
+        for i in range(j+1):
+            dist = it.colvars[frames[i]]-it.colvars[:n_hills]
+            dist -= it.boundary_lengths*np.rint(dist/it.boundary_lengths)
+            kernel = np.exp(-0.5*np.sum((dist/it.sigmas[:n_hills])**2,axis=1))
+            matrix[j,i] = np.sum(it.heights[:n_hills]*kernel)+it.wall[frames[i]]
+    return matrix
+
+
+@pytest.mark.parametrize('schedule',['geometric','adaptive','list'])
+def test_schedule_python(meta,schedule):
+    schedule = frame_lists['meta'] if schedule == 'list' else schedule
+    it = schedule_run(meta,schedule,'python')
+    np.testing.assert_allclose(dense(it.bias_matrix),brute_force_matrix(it),rtol=0,atol=1e-10)
+
+
+@pytest.mark.parametrize('schedule',['geometric','list'])
+@pytest.mark.parametrize('engine',['numba','numpy','parallel','cutoff','grid','tiled'])
+def test_schedule_meta(meta,tmp_path,engine,schedule):
+    schedule = frame_lists['meta'] if schedule == 'list' else schedule
+    reference = schedule_run(meta,schedule,'python')
+    it = schedule_run(meta,schedule,engine,cutoff=40.0,work_dir=str(tmp_path),tile_size=4)
+    np.testing.assert_array_equal(it.eval_frames,reference.eval_frames)
+    assert_same_run(it,reference,atol=5e-2 if engine == 'grid' else 1e-10)
+
+
+@pytest.mark.parametrize('engine',['numba','parallel','cutoff','tiled'])
+def test_schedule_atlas(atlas,tmp_path,engine):
+    reference = schedule_run(atlas,frame_lists['atlas'],'python')
+    it = schedule_run(atlas,frame_lists['atlas'],engine,cutoff=40.0,work_dir=str(tmp_path),
+                      tile_size=4)
+    assert_same_run(it,reference,atol=1e-9)
+
+
+@pytest.mark.parametrize('kind',['meta','atlas'])
+def test_schedule_extend(meta,atlas,kind):
+    make = meta if kind == 'meta' else atlas
+    it = make()
+    rest = split(it,120)
+    it.set_schedule(geometric_frames(120,10,2))
+    solved(it,'python',iterations=1000,tolerance=1e-12)
+    it.extend(*rest)
+    assert it.eval_frames[-1]+it.stride > make().steps-it.stride
+    reference = make()
+    reference.set_schedule(it.eval_frames)
+    solved(reference,'python',iterations=1000,tolerance=1e-12)
+    assert_same_run(it,reference,atol=1e-9)
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from conftest import solved,assert_same_run
+import itre.core
+
+
+def test_tolerance_stops_early(meta):
+    it = solved(meta(),'numpy',iterations=500,tolerance=1e-10)
+    assert it.converged
+    assert it.ct_residuals[-1] < 1e-10
+    assert len(it.ct) == len(it.ct_residuals)+1 < 500
+    assert np.all(it.ct_residuals[:-1] >= 1e-10)
+
+
+def test_tolerance_not_reached(meta):
+    it = solved(meta(),'numpy',iterations=3,tolerance=1e-10)
+    assert not it.converged
+    assert len(it.ct_residuals) == 2
+
+
+def test_ct_history_last(meta):
+    reference = solved(meta(),'python')
+    it = solved(meta(),'python',ct_history='last')
+    assert it.ct.shape == (2,it.n_evals)
+    assert_same_run(it,reference,atol=1e-12)
+    np.testing.assert_allclose(it.ct[0],reference.ct[-2],rtol=0,atol=1e-12)
+
+
+@pytest.mark.parametrize('storage',['dense','packed'])
+@pytest.mark.parametrize('block_size',[1,50])
+def test_block_size(meta,storage,block_size):
+    reference = solved(meta(),'python')
+    it = solved(meta(),'numpy',storage=storage,block_size=block_size)
+    assert_same_run(it,reference)
+
+
+@pytest.mark.parametrize('directives,streamed',[({},False),({'ct_history':'last'},True),
+                                                ({'tolerance':1e-10},True)])
+def test_streamed_by_default(meta,monkeypatch,directives,streamed):
+    reference = solved(meta(),'python',**directives)
+    calls = []
+    exp_dot = itre.core.exp_dot
+    def counted(*args):
+        calls.append(args[-1])
+        return exp_dot(*args)
+    monkeypatch.setattr(itre.core,'exp_dot',counted)
+    it = solved(meta(),'numpy',**directives)
+    assert (len(calls) > 0) == streamed
+    assert all(el == 2**22 for el in calls)
+    assert_same_run(it,reference)
+
+
+@pytest.mark.parametrize('kind',['meta','atlas'])
+def test_anderson_matches_picard(meta,atlas,kind):
+    make = meta if kind == 'meta' else atlas
+    reference = solved(make(),'python',iterations=1000,tolerance=1e-12)
+    it = solved(make(),'python',solver='anderson',iterations=1000,tolerance=1e-12)
+    assert it.converged
+    assert len(it.ct_residuals) < len(reference.ct_residuals)
+    assert_same_run(it,reference,atol=1e-9)
+
+
+def test_unknown_solver(meta):
+    with pytest.raises(ValueError):
+        solved(meta(),'numpy',solver='newton')
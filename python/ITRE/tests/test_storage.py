@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from conftest import solved,dense,assert_same_run
+from itre.storage import PackedMatrix
+
+
+def test_packed_matrix_round_trip():
+    matrix = np.tril(np.random.default_rng(0).random((7,7)))
+    packed = PackedMatrix.from_dense(matrix)
+    np.testing.assert_array_equal(packed.to_dense(),matrix)
+    np.testing.assert_array_equal(packed.diagonal(),matrix.diagonal())
+    np.testing.assert_array_equal(packed[2:5,1:4],matrix[2:5,1:4])
+    np.testing.assert_array_equal(packed[:,3],matrix[:,3])
+    with pytest.raises(IndexError):
+        packed[1,3] = 1.0
+
+
+@pytest.mark.parametrize('block_size',[1,10,2**22])
+def test_packed_exp_dot(block_size):
+    rng = np.random.default_rng(0)
+    matrix = np.tril(rng.random((9,9)))
+    vector = rng.random(9)
+    packed = PackedMatrix.from_dense(matrix)
+    expected = np.tril(np.exp(-2.0*matrix)) @ vector
+    np.testing.assert_allclose(packed.exp_dot(vector,-2.0,block_size),expected,rtol=1e-14)
+
+
+@pytest.mark.parametrize('engine',['python','numpy','parallel','cutoff'])
+def test_packed_matches_dense_meta(meta,engine):
+    reference = solved(meta(),'python')
+    it = solved(meta(),engine,storage='packed',cutoff=40.0)
+    assert isinstance(it.bias_matrix,PackedMatrix)
+    assert_same_run(it,reference)
+
+
+@pytest.mark.parametrize('engine',['python','parallel'])
+def test_packed_matches_dense_atlas(atlas,engine):
+    reference = solved(atlas(),'python')
+    it = solved(atlas(),engine,storage='packed')
+    assert_same_run(it,reference,atol=1e-9)
+
+
+@pytest.mark.parametrize('storage',['dense','packed'])
+def test_float32_matrix(meta,storage):
+    reference = solved(meta(),'python')
+    it = solved(meta(),'numpy',storage=storage,matrix_dtype='float32')
+    assert it.bias_matrix.dtype == np.float32
+    assert_same_run(it,reference,atol=1e-5)
+
+
+def test_memory_mapped_matrix(meta,tmp_path):
+    reference = solved(meta(),'python')
+    matrix_file = str(tmp_path/'matrix.bin')
+    it = solved(meta(),'numpy',storage='packed',matrix_file=matrix_file)
+    assert isinstance(it.bias_matrix.data,np.memmap)
+    assert_same_run(it,reference)
+    it.bias_matrix.flush()
+    mapped = PackedMatrix(it.n_evals,filename=matrix_file,mode='r+')
+    np.testing.assert_array_equal(mapped.to_dense(),dense(it.bias_matrix))
+
+
+def test_dense_matrix_file(meta,tmp_path):
+    it = meta()
+    it.matrix_file = str(tmp_path/'matrix.bin')
+    with pytest.raises(ValueError):
+        it.calculate_bias_matrix()
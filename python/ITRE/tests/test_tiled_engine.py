@@ -0,0 +1,47 @@
+import os
+import numpy as np
+import pytest
+from conftest import solved,dense,assert_same_run
+from itre.storage import PackedMatrix
+
+
+@pytest.mark.parametrize('tile_size',[7,512])
+def test_tiled_matches_python_meta(meta,tmp_path,tile_size):
+    reference = solved(meta(),'python')
+    it = solved(meta(),'tiled',tile_size=tile_size,work_dir=str(tmp_path),n_threads=2)
+    assert isinstance(it.bias_matrix,PackedMatrix)
+    assert_same_run(it,reference)
+
+
+@pytest.mark.parametrize('residual',[True,False])
+def test_tiled_matches_python_atlas(atlas,tmp_path,residual):
+    reference = solved(atlas(residual=residual),'python')
+    it = solved(atlas(residual=residual),'tiled',tile_size=7,work_dir=str(tmp_path))
+    assert_same_run(it,reference,atol=1e-9)
+
+
+def test_tiled_resume(meta,tmp_path):
+    work_dir = str(tmp_path/'work')
+    reference = solved(meta(),'tiled',tile_size=7,work_dir=work_dir)
+    # interrupt the build while the last block of columns was being summed
+    n_blocks = len(os.listdir(os.path.join(work_dir,'columns')))//2
+    os.remove(os.path.join(work_dir,'columns','{}.done'.format(n_blocks-1)))
+    it = solved(meta(),'tiled',tile_size=7,work_dir=work_dir)
+    assert_same_run(it,reference,atol=0)
+
+
+def test_tiled_after_parallel(meta,tmp_path):
+    # numba has started the threads of its parallel kernels in this process
+    reference = solved(meta(),'parallel')
+    it = solved(meta(),'tiled',tile_size=7,work_dir=str(tmp_path))
+    assert_same_run(it,reference)
+
+
+def test_tiled_matrix_file(meta,tmp_path):
+    matrix_file = str(tmp_path/'matrix.bin')
+    it = solved(meta(),'tiled',tile_size=9,matrix_file=matrix_file)
+    assert os.path.isdir(matrix_file+'.tiles')
+    mapped = PackedMatrix(it.n_evals,filename=matrix_file,mode='r+')
+    np.testing.assert_array_equal(mapped.to_dense(),dense(it.bias_matrix))
+    with pytest.raises(ValueError):
+        solved(meta(),'tiled')
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from conftest import walkers,dense
+
+
+def brute_force_matrix(it,walker):
+    """The lagged bias of all the hills in the frames of a walker, one element at a time."""
+    frames = np.arange(it.n_evals)*it.stride
+    ref_colvars = it.colvars[walker::it.n_walkers]
+    wall = it.wall[walker::it.n_walkers]
+    matrix = np.zeros((it.n_evals,it.n_evals))
+    for j in range(it.n_evals):
+        n_hills = frames[j]*it.n_walkers
+        for i in range(j+1):
+            dist = ref_colvars[frames[i]]-it.colvars[:n_hills]
+            dist -= it.boundary_lengths*np.rint(dist/it.boundary_lengths)
+            kernel = np.exp(-0.5*np.sum((dist/it.sigmas[:n_hills])**2,axis=1))
+            matrix[j,i] = np.sum(it.heights[:n_hills]*kernel)+wall[frames[i]]
+    return matrix
+
+
+def shared_ct(matrices,iterations,kT=1.0):
+    """Iterate the self consistent equation summed over the frames of all the walkers."""
+    matrices = [dense(el) for el in matrices]
+    ct = np.zeros(len(matrices[0]))
+    for iteration in range(1,iterations):
+        res,norm = 0.0,0.0
+        for matrix in matrices:
+            vec = np.exp((matrix.diagonal()-ct)/kT)
+            res = res+np.tril(np.exp(-matrix/kT)) @ vec
+            norm = norm+vec
+        ct = -kT*np.log(res/np.cumsum(norm))
+    return ct
+
+
+@pytest.mark.parametrize('storage',['dense','packed'])
+def test_walker_matrices(storage):
+    it = walkers(storage=storage)
+    matrices = it.calculate_walker_bias_matrices()
+    assert len(matrices) == 2
+    for walker,matrix in enumerate(matrices):
+        np.testing.assert_allclose(dense(matrix),brute_force_matrix(it,walker),rtol=0,atol=1e-10)
+
+
+@pytest.mark.parametrize('n_walkers',[2,3])
+def test_walkers_shared_ct(n_walkers):
+    it = walkers(n_walkers)
+    it.calculate_c_t()
+    np.testing.assert_allclose(it.ct[-1],shared_ct(it.bias_matrix,it.iterations),rtol=0,atol=1e-10)
+
+
+def test_walker_colvars():
+    it = walkers()
+    reference = walkers()
+    it.walker_colvars = [reference.colvars[w::2] for w in range(2)]
+    it.walker_wall = [reference.wall[w::2] for w in range(2)]
+    it.calculate_c_t()
+    reference.calculate_c_t()
+    np.testing.assert_array_equal(it.ct[-1],reference.ct[-1])
+
+
+def test_walkers_atlas(atlas):
+    it = atlas()
+    it.n_walkers = 2
+    with pytest.raises(ValueError):
+        it.calculate_walker_bias_matrices()
@@ -0,0 +1,261 @@
+"""
+This script benchmarks the engines that evaluate the bias matrix, on
+synthetic Metadynamics and ATLAS trajectories, so that nothing is plotted
+and no input file is needed. It sweeps the number of steps, of CVs, of
+minima (for ATLAS), the stride and the engine, for example
+
+python benchmark.py --kinds meta atlas --steps 2000 8000 --n-cvs 1 2 \
+                    --engines numba parallel --output results.json
+
+Each case runs in a fresh process, after a small warm up run that compiles
+the numba kernels, and records the wall and CPU time spent building the
+bias matrix and solving c(t) (the best of --repeats runs), the peak
+resident memory, and the number of kernel evaluations (reference frame,
+hill) per second. The results are written in a json file.
+
+With --compare, the results are compared with a previous json file and the
+script exits with an error if the bias matrix of any case is slower than
+the baseline by more than --threshold (20% by default), e.g.
+
+python benchmark.py --output new.json --compare baseline.json
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import platform
+import shutil
+import tempfile
+import resource
+import subprocess
+import contextlib
+import argparse as ap
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+
+engines = {'meta':['python','numba','numpy','parallel','cutoff','grid','tiled'],
+           'atlas':['python','numba','parallel','cutoff','tiled']}
+
+
+def synthetic_meta(steps,n_cvs,seed=0):
+    """
+    A well tempered Metadynamics on a random walk in a periodic box, with the
+    CVs in [-pi,pi].
+    """
+    rng = np.random.default_rng(seed)
+    colvars = np.cumsum(rng.normal(scale=0.1,size=(steps,n_cvs)),axis=0)
+    colvars = (colvars+np.pi) % (2*np.pi) - np.pi
+    sigmas = np.full((steps,n_cvs),0.3)
+    heights = 1.2*np.exp(-2.0*np.arange(steps)/steps)
+    boundaries = [-np.pi,np.pi]*n_cvs
+    return {'colvars':colvars,'sigmas':sigmas,'heights':heights,
+            'boundaries':boundaries}
+
+
+def synthetic_atlas(steps,n_cvs,n_minima,seed=0):
+    """
+    An ATLAS calculation with n_minima minima, each with n_cvs local CVs,
+    with sparse activation functions (most of them vanish in each frame).
+    """
+    rng = np.random.default_rng(seed)
+    colvars = np.cumsum(rng.normal(scale=0.05,size=(steps,n_minima*n_cvs)),axis=0)
+    sigmas = np.full((steps,n_minima*n_cvs),0.3)
+    heights = 1.2*np.exp(-2.0*np.arange(steps)/steps)
+    thetas = rng.random((steps,n_minima+1))**4
+    thetas[thetas < 0.05] = 0.0
+    thetas[:,-1] += 1e-3
+    return {'colvars':colvars,'sigmas':sigmas,'heights':heights,
+            'thetas':thetas,'boundaries':None}
+
+
+def setup(case,steps,work_dir):
+    """Build an Itre object for the case, with steps steps."""
+    import itre
+
+    if case['kind'] == 'meta':
+        data = synthetic_meta(steps,case['n_cvs'])
+    else:
+        data = synthetic_atlas(steps,case['n_cvs'],case['n_minima'])
+
+    it = itre.Itre()
+    it.colvars = data['colvars']
+    it.sigmas = data['sigmas']
+    it.heights = data['heights']
+    it.wall = np.zeros(steps)
+    if case['kind'] == 'atlas':
+        it.thetas = data['thetas']
+        it.has_thetas = True
+    it.stride = case['stride']
+    it.n_evals = steps//case['stride']
+    it.iterations = case['iterations']
+    it.engine = case['engine']
+    it.n_threads = case['n_threads']
+    it.work_dir = work_dir
+    it.set_boundaries(data['boundaries'])
+    return it
+
+
+def run_case(case):
+    """
+    Run a single case in this process and return its measurements. The
+    output of Itre is discarded.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        # compile the kernels on a small trajectory first
+        with tempfile.TemporaryDirectory() as work_dir:
+            warm_up = setup(case,20*case['stride'],work_dir)
+            warm_up.calculate_c_t()
+
+        # the best of the repeats is kept, the least affected by the noise
+        build_wall,build_cpu,ct_wall,ct_cpu = np.inf,np.inf,np.inf,np.inf
+        for repeat in range(case['repeats']):
+            work_dir = tempfile.mkdtemp()
+            it = setup(case,case['steps'],work_dir)
+            wall_start,cpu_start = time.perf_counter(),time.process_time()
+            bias_matrix = it.calculate_bias_matrix()
+            build_wall = min(build_wall,time.perf_counter()-wall_start)
+            build_cpu = min(build_cpu,time.process_time()-cpu_start)
+
+            it.bias_matrix = bias_matrix
+            it.instantaneous_bias = np.array(bias_matrix.diagonal(),dtype=np.float64)
+            wall_start,cpu_start = time.perf_counter(),time.process_time()
+            it.calculate_c_t()
+            ct_wall = min(ct_wall,time.perf_counter()-wall_start)
+            ct_cpu = min(ct_cpu,time.process_time()-cpu_start)
+            del bias_matrix,it
+            shutil.rmtree(work_dir)
+
+    n_evals = case['steps']//case['stride']
+    # every frame is evaluated against the hills deposited before the last evaluation
+    kernel_evaluations = n_evals*(n_evals-1)*case['stride']
+    result = dict(case)
+    result.update({'n_evals':n_evals,
+                   'build_time':build_wall,'build_cpu_time':build_cpu,
+                   'ct_time':ct_wall,'ct_cpu_time':ct_cpu,
+                   'kernel_evaluations':kernel_evaluations,
+                   'evaluations_per_second':kernel_evaluations/max(build_wall,1e-9),
+                   # ru_maxrss is in kB on linux
+                   'peak_rss_mb':resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.})
+    return result
+
+
+def case_key(case):
+    """The parameters that identify a case, to compare it with a baseline."""
+    return (case['kind'],case['engine'],case['steps'],case['n_cvs'],
+            case['stride'],case['n_minima'])
+
+
+def make_cases(args):
+    """All the supported combinations of the swept parameters."""
+    cases = []
+    for kind in args.kinds:
+        for engine in args.engines or engines[kind]:
+            if engine not in engines[kind]:
+                continue
+            for steps in args.steps:
+                for n_cvs in args.n_cvs:
+                    if engine == 'grid' and n_cvs > 3:
+                        continue
+                    for stride in args.strides:
+                        for n_minima in (args.minima if kind == 'atlas' else [0]):
+                            cases.append({'kind':kind,'engine':engine,'steps':steps,
+                                          'n_cvs':n_cvs,'stride':stride,
+                                          'n_minima':n_minima,
+                                          'iterations':args.iterations,
+                                          'repeats':args.repeats,
+                                          'n_threads':args.threads})
+    return cases
+
+
+def compare(results,baseline,threshold):
+    """
+    Print the ratio between the build times of the results and of the
+    baseline, and return the number of cases slower than the threshold.
+    """
+    reference = {case_key(el):el for el in baseline['results'] if 'build_time' in el}
+    regressions = 0
+    print("{:>6} {:>8} {:>7} {:>5} {:>6} {:>7} {:>10} {:>10} {:>7}".format(
+          'kind','engine','steps','cvs','stride','minima','baseline','time','ratio'))
+    for result in results:
+        old = reference.get(case_key(result))
+        if old is None or 'build_time' not in result:
+            continue
+        ratio = result['build_time']/old['build_time']
+        flag = ''
+        if ratio > 1+threshold:
+            flag = ' SLOWER'
+            regressions += 1
+        print("{:>6} {:>8} {:>7} {:>5} {:>6} {:>7} {:>10.4f} {:>10.4f} {:>7.2f}{}".format(
+              result['kind'],result['engine'],result['steps'],result['n_cvs'],
+              result['stride'],result['n_minima'],old['build_time'],
+              result['build_time'],ratio,flag))
+    return regressions
+
+
+def main():
+    parser = ap.ArgumentParser(description='Benchmark the ITRE engines on synthetic trajectories')
+    parser.add_argument('--kinds',nargs='+',default=['meta','atlas'],choices=['meta','atlas'],help='the kind of simulations')
+    parser.add_argument('--engines',nargs='+',help='the engines to run (all the supported ones by default)')
+    parser.add_argument('--steps',type=int,nargs='+',default=[1000,4000],help='the lengths of the trajectories')
+    parser.add_argument('--n-cvs',type=int,nargs='+',default=[1,2],help='the number of CVs (per minimum for ATLAS)')
+    parser.add_argument('--strides',type=int,nargs='+',default=[10],help='the strides between two evaluations')
+    parser.add_argument('--minima',type=int,nargs='+',default=[2],help='the number of minima for ATLAS')
+    parser.add_argument('--iterations',type=int,default=20,help='the iterations of the self consistent cycle')
+    parser.add_argument('--repeats',type=int,default=3,help='the repeats of each build, the fastest is reported')
+    parser.add_argument('--threads',type=int,help='the threads (or processes) of the parallel engines')
+    parser.add_argument('--output','-o',default='benchmark.json',help='the json file with the results')
+    parser.add_argument('--compare','-c',help='a previous json file to compare with')
+    parser.add_argument('--threshold',type=float,default=0.2,help='the relative slow down reported as a regression')
+    parser.add_argument('--case',help=ap.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case is not None:
+        # a single case, run by the main process in a fresh interpreter
+        print(json.dumps(run_case(json.loads(args.case))))
+        return 0
+
+    results = []
+    for case in make_cases(args):
+        process = subprocess.run([sys.executable,os.path.abspath(__file__),
+                                  '--case',json.dumps(case)],
+                                 stdout=subprocess.PIPE,stderr=subprocess.PIPE,
+                                 universal_newlines=True)
+        if process.returncode != 0:
+            result = dict(case)
+            result['error'] = process.stderr.strip().splitlines()[-1]
+            print("{kind} {engine} steps={steps} n_cvs={n_cvs} stride={stride} \
+failed: {error}".format(**result))
+        else:
+            result = json.loads(process.stdout.strip().splitlines()[-1])
+            print("{kind} {engine} steps={steps} n_cvs={n_cvs} stride={stride} \
+minima={n_minima}: {build_time:.4f} s, {evaluations_per_second:.3e} evaluations/s, \
+{peak_rss_mb:.1f} MB".format(**result))
+        results.append(result)
+
+    try:
+        import numba
+        numba_version = numba.__version__
+    except ImportError:
+        numba_version = None
+    with open(args.output,'w') as file_out:
+        json.dump({'python':platform.python_version(),'numpy':np.__version__,
+                   'numba':numba_version,'machine':platform.platform(),
+                   'processor':platform.processor(),'cpu_count':os.cpu_count(),
+                   'date':time.strftime('%Y-%m-%d %H:%M:%S'),
+                   'results':results},file_out,indent=1)
+
+    if args.compare is not None:
+        with open(args.compare,'r') as file_in:
+            baseline = json.load(file_in)
+        regressions = compare(results,baseline,args.threshold)
+        if regressions > 0:
+            print("{} cases are slower than the baseline".format(regressions))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())